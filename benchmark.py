@@ -0,0 +1,498 @@
+"""
+Replay benchmark.
+
+Feeds a stream of Telegram updates (a synthetic workload, or a recording of
+raw webhook bodies as JSON lines) straight into the handlers main.py
+registers, with a fake HTTP layer under the Bot that answers every Bot API
+call instantly and counts it. Runs against the in-memory store or a local
+MongoDB (database unimatch_bench, dropped first) and prints JSON:
+throughput, end-to-end update latency, per-handler p50/p95/p99, DB round
+trips and Bot API calls per update. The clock stops once broadcasts have
+finished and the outbox has drained, so elapsed_s and throughput include
+outbound sends under the real rate limits; handlers_elapsed_s is when the
+last handler returned.
+
+    python benchmark.py --users 300 --actions 20 --out before.json
+    python benchmark.py --backend mongo --mongo-uri mongodb://localhost:27017
+    python benchmark.py --save stream.jsonl    # keep the generated stream
+    python benchmark.py --replay stream.jsonl  # replay a saved/recorded one
+    python benchmark.py --sweep-users 250,1000,4000 --broadcasts 0
+
+A recorded stream is replayed as-is, so it should start from an empty store
+(users come in through /start like real ones).
+
+--sweep-users runs the synthetic workload once per user count, each in a
+fresh process, and reports how latency changes as the user base grows.
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+from pymongo import monitoring
+from telegram import Update
+from telegram.request import BaseRequest
+
+import broadcast
+from data import db
+from data import storage
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1000
+BOT_USER = {"id": 999, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+# weights of the post-onboarding actions a synthetic user takes
+ACTIONS = {
+    "find_match": 35,
+    "like": 25,
+    "skip": 20,
+    "main_menu": 8,
+    "leaderboard": 5,
+    "view_profile": 5,
+    "report": 2,
+}
+
+
+def _pct(samples, p):
+    return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+
+
+def _summary_ms(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "p50_ms": round(_pct(samples, 0.50) * 1000, 3),
+        "p95_ms": round(_pct(samples, 0.95) * 1000, 3),
+        "p99_ms": round(_pct(samples, 0.99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3) if samples else 0.0,
+    }
+
+
+# ------------------- SYNTHETIC STREAM -------------------
+class StreamBuilder:
+    """
+    Produces raw update dicts, shaped like the JSON Telegram posts to the webhook.
+    """
+
+    def __init__(self):
+        self._update_id = 0
+        self._message_id = 0
+        self._date = int(time.time())
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id, message_id, **content):
+        return {
+            "message_id": message_id,
+            "date": self._date,
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **content,
+        }
+
+    def text(self, user_id, text):
+        update_id, message_id = self._next_ids()
+        content = {"text": text}
+        if text.startswith("/"):
+            content["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": self._message(user_id, message_id, **content)}
+
+    def photo(self, user_id):
+        update_id, message_id = self._next_ids()
+        photo = {"file_id": f"photo-{user_id}", "file_unique_id": f"p{user_id}", "width": 640, "height": 640}
+        return {"update_id": update_id, "message": self._message(user_id, message_id, photo=[photo])}
+
+    def button(self, user_id, data):
+        update_id, message_id = self._next_ids()
+        message = self._message(user_id, message_id, text="…")
+        message["from"] = BOT_USER
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": data,
+        }}
+
+
+def synthetic_stream(users, actions, broadcasts, seed):
+    """
+    Onboard `users` users (interleaved, as they would arrive), then have them
+    take `actions` random actions each; the admin starts `broadcasts`
+    broadcasts and pages the report queue along the way.
+    """
+    rng = random.Random(seed)
+    build = StreamBuilder()
+    ids = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+    genders = {uid: ("male", "female")[i % 2] for i, uid in enumerate(ids)}
+    by_gender = {g: [uid for uid in ids if genders[uid] == g] for g in ("male", "female")}
+
+    def onboarding(uid):
+        return [
+            build.text(uid, "/start"),
+            build.button(uid, "start_onboarding"),
+            build.text(uid, f"User {uid}"),
+            build.text(uid, "Computer Science"),
+            build.text(uid, rng.choice(["1st", "2nd", "3rd", "4th"])),
+            build.button(uid, f"gender_{genders[uid]}"),
+            build.text(uid, str(rng.randint(18, 30))),
+            build.photo(uid),
+            build.button(uid, f"interest_{rng.choice(['male', 'female', 'both'])}"),
+            build.text(uid, "Here for study buddies."),
+        ]
+
+    stream = []
+    scripts = [onboarding(uid) for uid in ids]
+    for step in range(max(map(len, scripts), default=0)):
+        stream += [script[step] for script in scripts if step < len(script)]
+
+    names, weights = zip(*ACTIONS.items())
+    total = users * actions
+    broadcast_at = {total * (i + 1) // (broadcasts + 1) for i in range(broadcasts)}
+    for n in range(total):
+        if n in broadcast_at:
+            stream += [build.button(ADMIN_ID, "broadcast"), build.text(ADMIN_ID, f"Benchmark broadcast #{n}")]
+            stream.append(build.button(ADMIN_ID, "admin_list_reports"))
+        uid = rng.choice(ids)
+        action = rng.choices(names, weights)[0]
+        target = rng.choice(by_gender["female" if genders[uid] == "male" else "male"] or ids)
+        if action in ("like", "skip", "report"):
+            stream.append(build.button(uid, f"{action}_{target}"))
+        else:
+            stream.append(build.button(uid, action))
+    return stream
+
+
+# ------------------- FAKE BOT API -------------------
+class RecordingRequest(BaseRequest):
+    """
+    Stands in for the HTTP client under the Bot: answers every Bot API call
+    with a minimal successful result (after `latency` seconds) and counts it.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 10 ** 6
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if endpoint.startswith(("send", "edit", "copy", "forward")):
+            self._message_id += 1
+            chat_id = int(params.get("chat_id") or 0)
+            return {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text") or params.get("caption") or "",
+            }
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+
+# ------------------- INSTRUMENTATION -------------------
+class HandlerTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, fn, name=None):
+        name = name or fn.__name__
+
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.samples[name].append(time.perf_counter() - started)
+
+        return timed
+
+
+def _instrument_handlers(app, bot, timer):
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = timer.wrap(handler.callback)
+    # handle_buttons dispatches through these tables; time the routed handlers too
+    for table in (bot.BUTTON_ROUTES, bot.BUTTON_PREFIXES):
+        for key, fn in table.items():
+            table[key] = timer.wrap(fn)
+
+
+def _count_store_calls(counter):
+    """
+    Memory backend: count calls into the storage namespaces (there are no
+    network round trips to observe).
+    """
+    for ns in (storage.users, storage.edges, storage.notifications, storage.reports, storage.decks, storage.broadcasts):
+        for name, fn in inspect.getmembers(ns, inspect.iscoroutinefunction):
+            if name.startswith("_"):
+                continue
+
+            def counted(*args, _fn=fn, _name=f"{ns.name}.{name}", **kwargs):
+                counter[_name] += 1
+                return _fn(*args, **kwargs)
+
+            setattr(ns, name, counted)
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Mongo backend: counts every command sent to the server, by name.
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def started(self, event):
+        self.counter[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# ------------------- RUN -------------------
+def _configure_env(args):
+    os.environ.update({
+        "BOT_TOKEN": "123456:benchmark",
+        "ADMIN_ID": str(ADMIN_ID),
+        "ADMIN_CHANNEL_ID": "",
+        "BASE_URL": "",
+        "REPLICA_MODE": "false",
+        "UPDATE_DEDUP_SHARED": "false",
+        "STORAGE_BACKEND": args.backend,
+        "STORAGE_LOG_PATH": args.log_path or "",
+        "MAX_CONCURRENT_UPDATES": str(args.in_flight),
+    })
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, raw_updates):
+    _configure_env(args)
+    db_calls = Counter()
+    if args.backend == "mongo":
+        if args.db_name == db.DB_NAME:
+            sys.exit("Refusing to benchmark against (and drop) the bot's own database.")
+        db.DB_NAME = args.db_name
+        # registered before main.py creates the MongoClient, so it sees every command
+        monitoring.register(CommandCounter(db_calls))
+
+    import main as bot  # reads the environment set above
+
+    logging.getLogger().setLevel(args.log_level)
+    if storage.backend == storage.MONGO:
+        db.client.drop_database(db.DB_NAME)
+    else:
+        _count_store_calls(db_calls)
+
+    request = RecordingRequest(latency=args.bot_latency / 1000)
+    app = bot.build_application(request=request)
+    timer = HandlerTimer()
+    _instrument_handlers(app, bot, timer)
+    errors = Counter()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    app.add_error_handler(count_error)
+
+    await app.initialize()
+    await bot.post_init(app)
+    # like run_polling: handler-spawned tasks (deck refills, broadcasts) are tracked from here on
+    await app.start()
+    updates = [Update.de_json(raw, app.bot) for raw in raw_updates]
+    # setup traffic (getMe, index builds) is not part of the measurement
+    request.calls.clear()
+    db_calls.clear()
+
+    latencies = []
+    window = asyncio.Semaphore(args.in_flight)
+
+    async def feed(update):
+        started = time.perf_counter()
+        try:
+            await app.update_processor.process_update(update, app.process_update(update))
+        finally:
+            latencies.append(time.perf_counter() - started)
+            window.release()
+
+    started = time.perf_counter()
+    tasks = []
+    for update in updates:
+        await window.acquire()
+        tasks.append(asyncio.create_task(feed(update)))
+    await asyncio.gather(*tasks)
+    handlers_elapsed = time.perf_counter() - started
+    # broadcasts and queued notifications are part of the work: wait for them to go out
+    await asyncio.gather(*list(broadcast._active.values()), return_exceptions=True)
+    await bot.outbox.drain()
+    elapsed = time.perf_counter() - started
+    outbox_metrics = bot.outbox.metrics()
+
+    await app.stop()
+    await bot.post_shutdown(app)
+    await app.shutdown()
+
+    count = len(updates)
+    return {
+        "commit": _git_commit(),
+        "backend": storage.backend,
+        "updates": count,
+        "in_flight": args.in_flight,
+        "bot_latency_ms": args.bot_latency,
+        "elapsed_s": round(elapsed, 3),
+        "handlers_elapsed_s": round(handlers_elapsed, 3),
+        "throughput_ups": round(count / elapsed, 1) if elapsed else None,
+        "update_latency": _summary_ms(latencies),
+        "handlers": {name: _summary_ms(samples) for name, samples in sorted(timer.samples.items())},
+        "db_round_trips_per_update": round(sum(db_calls.values()) / count, 2) if count else 0,
+        "db_round_trip_source": "mongo commands" if storage.backend == storage.MONGO else "memory store calls",
+        "db_round_trips": dict(db_calls.most_common()),
+        "bot_calls_per_update": round(sum(request.calls.values()) / count, 2) if count else 0,
+        "bot_calls": dict(request.calls.most_common()),
+        "errors": dict(errors),
+        "outbox": outbox_metrics,
+    }
+
+
+# handlers whose cost could grow with the user base
+SWEEP_HANDLERS = ("find_match", "handle_like", "skip_candidate", "show_leaderboard", "show_profile")
+
+
+def sweep(args):
+    """
+    Run the benchmark once per user count in args.sweep_users, each in its own
+    process (main.py binds its storage at import), and collect the figures
+    that show whether latency stays flat as the user base grows.
+    """
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--backend", args.backend,
+        "--db-name", args.db_name,
+        "--actions", str(args.actions),
+        "--broadcasts", str(args.broadcasts),
+        "--seed", str(args.seed),
+        "--in-flight", str(args.in_flight),
+        "--bot-latency", str(args.bot_latency),
+        "--log-level", args.log_level,
+    ]
+    if args.mongo_uri:
+        command += ["--mongo-uri", args.mongo_uri]
+    rows = []
+    for users in args.sweep_users:
+        child = subprocess.run(command + ["--users", str(users)], capture_output=True, text=True)
+        if child.returncode:
+            sys.exit(f"Benchmark with {users} users failed:\n{child.stderr}")
+        result = json.loads(child.stdout)
+        rows.append({
+            "users": users,
+            "updates": result["updates"],
+            "throughput_ups": result["throughput_ups"],
+            "update_latency": result["update_latency"],
+            "handlers": {name: result["handlers"][name] for name in SWEEP_HANDLERS if name in result["handlers"]},
+            "db_round_trips_per_update": result["db_round_trips_per_update"],
+            "errors": result["errors"],
+        })
+    return {"commit": _git_commit(), "backend": args.backend, "actions_per_user": args.actions, "sweep": rows}
+
+
+def _user_counts(value):
+    return [int(n) for n in value.split(",") if n.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("memory", "mongo"), default="memory")
+    parser.add_argument("--mongo-uri", help="defaults to MONGO_URI, then a local mongod")
+    parser.add_argument("--db-name", default="unimatch_bench", help="database to use (and drop) with --backend mongo")
+    parser.add_argument("--log-path", help="memory backend: append-only log file, to include its cost")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--actions", type=int, default=20, help="actions per user after onboarding")
+    parser.add_argument("--broadcasts", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--in-flight", type=int, default=64, help="updates being processed at once")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="simulated Bot API round trip, ms")
+    parser.add_argument("--sweep-users", type=_user_counts, help="comma-separated user counts to run one after another")
+    parser.add_argument("--replay", help="JSON-lines file of raw updates to replay instead of the synthetic stream")
+    parser.add_argument("--save", help="write the update stream to this JSON-lines file")
+    parser.add_argument("--out", help="write the results here instead of stdout")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def _run_once(args):
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as f:
+            raw_updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        raw_updates = synthetic_stream(args.users, args.actions, args.broadcasts, args.seed)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(raw) + "\n" for raw in raw_updates)
+
+    return asyncio.run(run(args, raw_updates))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.sweep_users:
+        if args.replay or args.save or args.log_path:
+            sys.exit("--sweep-users generates its own streams; it cannot be combined with --replay, --save or --log-path.")
+        results = sweep(args)
+    else:
+        results = _run_once(args)
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
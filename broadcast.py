@@ -0,0 +1,160 @@
+"""
+Broadcast engine.
+
+A broadcast is a persisted job (see data/broadcasts.py) processed by a
+background task: recipients are read in user_id order in batches and queued
+in the outbox's bulk lane (which applies rate limits and RetryAfter), and the cursor and
+counters are saved after every batch. If the process dies, resume_broadcasts()
+picks running jobs back up after the last saved batch, so at most one batch
+is re-sent. The admin who started it gets a status message that is edited
+as the job runs.
+
+watch_jobs() is the job runner for the replica holding the background-jobs
+lease: it picks up jobs created on any replica and stops its own when the
+lease is lost, leaving them for the next leader to resume.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import ratelimit
+from data import storage
+from outbox import outbox, BULK, NOTIFICATION
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+PROGRESS_EVERY = 5  # seconds between status message edits
+JOB_POLL_INTERVAL = 5  # seconds between checks for jobs started elsewhere
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+
+_active = {}  # job id -> task running it in this process
+
+
+async def _send_one(chat_id, text):
+    try:
+        await outbox.send_message(chat_id, text, priority=BULK)
+        return SENT
+    except Forbidden:
+        # user blocked the bot or deactivated their account
+        return BLOCKED
+    except TelegramError:
+        return FAILED
+
+
+def _progress_text(job, finished=False):
+    done = job["sent"] + job["failed"] + job["blocked"]
+    head = "✅ Broadcast finished." if finished else "📢 Broadcast in progress…"
+    return (
+        f"{head}\n"
+        f"Processed: {done}/{job.get('total') or '?'}\n"
+        f"Sent: {job['sent']} | Failed: {job['failed']} | Blocked: {job['blocked']}"
+    )
+
+
+async def _report(bot, job, finished=False):
+    chat_id = job.get("report_chat_id")
+    if not chat_id:
+        return
+    text = _progress_text(job, finished)
+    try:
+        if job.get("report_message_id"):
+            # edits can't go through the outbox, but they count against the same limits
+            await ratelimit.global_bucket.acquire()
+            await ratelimit.chat_limiter.acquire(chat_id)
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=job["report_message_id"])
+        else:
+            # ahead of the job's own bulk sends
+            msg = await outbox.send_message(chat_id, text, priority=NOTIFICATION)
+            job["report_message_id"] = msg.message_id
+            await storage.broadcasts.set_job_fields(job["_id"], {"report_message_id": msg.message_id})
+    except RetryAfter as e:
+        # skip this update; the pause holds back the outbox's sends too
+        ratelimit.global_bucket.pause(ratelimit.retry_after_seconds(e))
+    except BadRequest:
+        # "message is not modified" and friends
+        pass
+    except TelegramError:
+        logger.exception("Failed to report broadcast %s progress", job["_id"])
+
+
+async def run_job(bot, job):
+    """
+    Process a broadcast job from its saved cursor to the end.
+    """
+    logger.info("Running broadcast %s from cursor %s", job["_id"], job.get("cursor"))
+    await _report(bot, job)
+    last_report = time.monotonic()
+    while True:
+        recipients = await storage.broadcasts.next_recipients(job.get("cursor"), BATCH_SIZE)
+        if not recipients:
+            break
+        results = await asyncio.gather(*(_send_one(uid, job["text"]) for uid in recipients))
+        job = await storage.broadcasts.record_batch(
+            job["_id"],
+            recipients[-1],
+            results.count(SENT),
+            results.count(FAILED),
+            results.count(BLOCKED),
+        )
+        if time.monotonic() - last_report >= PROGRESS_EVERY:
+            await _report(bot, job)
+            last_report = time.monotonic()
+
+    await storage.broadcasts.set_job_fields(job["_id"], {"status": "done", "finished_at": datetime.utcnow()})
+    await _report(bot, job, finished=True)
+    logger.info("Broadcast %s finished: sent=%s failed=%s blocked=%s", job["_id"], job["sent"], job["failed"], job["blocked"])
+
+
+async def _run_logged(bot, job):
+    try:
+        await run_job(bot, job)
+    except Exception:
+        # the job stays "running" and is resumed on next start
+        logger.exception("Broadcast %s crashed", job["_id"])
+
+
+def _launch(application, job):
+    if job["_id"] in _active:
+        return
+    task = application.create_task(_run_logged(application.bot, job))
+    _active[job["_id"]] = task
+    task.add_done_callback(lambda _task, job_id=job["_id"]: _active.pop(job_id, None))
+
+
+async def start_broadcast(application, text, report_chat_id, run_here=True):
+    """
+    Persist a new broadcast job and, with run_here, start processing it in
+    the background. Otherwise the leader's watch_jobs() picks it up.
+    """
+    total = await storage.broadcasts.count_recipients()
+    job = await storage.broadcasts.create_job(text, report_chat_id, total)
+    if run_here:
+        _launch(application, job)
+    return job
+
+
+async def resume_broadcasts(application):
+    """
+    Start every running job that this process is not already processing.
+    """
+    for job in await storage.broadcasts.running_jobs():
+        _launch(application, job)
+
+
+async def watch_jobs(application, interval=JOB_POLL_INTERVAL):
+    try:
+        while True:
+            try:
+                await resume_broadcasts(application)
+            except Exception:
+                logger.exception("Failed to check for broadcast jobs")
+            await asyncio.sleep(interval)
+    finally:
+        # stopped (e.g. leadership lost): jobs stay "running" for the next runner
+        for task in list(_active.values()):
+            task.cancel()
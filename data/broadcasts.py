@@ -0,0 +1,58 @@
+"""
+Broadcast job repository. A job stores its text, a keyset cursor over
+users.user_id and running counters, so an interrupted broadcast resumes after
+the last user it finished.
+"""
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from data import db
+
+
+async def create_job(text, report_chat_id, total):
+    doc = {
+        "text": text,
+        "status": "running",  # running | done
+        "cursor": None,  # last user_id whose batch was fully processed
+        "sent": 0,
+        "failed": 0,
+        "blocked": 0,
+        "total": total,
+        "report_chat_id": report_chat_id,
+        "report_message_id": None,
+        "created_at": datetime.utcnow(),
+        "finished_at": None,
+    }
+    res = await db.broadcasts.insert_one(doc)
+    doc["_id"] = res.inserted_id
+    return doc
+
+
+async def running_jobs():
+    return await db.broadcasts.find({"status": "running"})
+
+
+async def count_recipients():
+    return await db.users.count_documents({})
+
+
+async def next_recipients(cursor, batch_size):
+    query = {"user_id": {"$gt": cursor}} if cursor is not None else {}
+    docs = await db.users.find(query, {"_id": 0, "user_id": 1}, sort=[("user_id", 1)], limit=batch_size)
+    return [d["user_id"] for d in docs]
+
+
+async def record_batch(job_id, cursor, sent, failed, blocked):
+    """
+    Persist one processed batch and return the updated job.
+    """
+    return await db.broadcasts.find_one_and_update(
+        {"_id": job_id},
+        {"$set": {"cursor": cursor}, "$inc": {"sent": sent, "failed": failed, "blocked": blocked}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def set_job_fields(job_id, fields):
+    await db.broadcasts.update_one({"_id": job_id}, {"$set": fields})
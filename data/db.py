@@ -0,0 +1,132 @@
+"""
+Async access to MongoDB.
+
+pymongo is blocking, so every collection call is handed to a bounded thread
+pool and awaited. A slow query then only holds up the update that issued it;
+the event loop keeps serving everyone else. The pool size caps how many
+queries can be in flight at once. Calls run in a copy of the caller's
+context, so command listeners (metrics.py) can tell which handler issued them.
+"""
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from pymongo import MongoClient
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = "unimatch_bot2"
+
+client = None
+users = None
+reports = None
+like_notifications = None
+decks = None
+edges = None
+like_pairs = None
+broadcasts = None
+report_summaries = None
+processed_updates = None
+conversation_state = None
+leases = None
+replicas = None
+_executor = None
+
+
+class AsyncCollection:
+    """
+    Awaitable wrapper around a pymongo Collection. Cursor-returning calls are
+    drained inside the worker thread and come back as plain lists.
+    """
+
+    def __init__(self, collection, executor):
+        self._collection = collection
+        self._executor = executor
+
+    @property
+    def name(self):
+        return self._collection.name
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, partial(ctx.run, fn, *args, **kwargs))
+
+    async def find_one(self, *args, **kwargs):
+        return await self._run(self._collection.find_one, *args, **kwargs)
+
+    async def find(self, *args, **kwargs):
+        return await self._run(lambda: list(self._collection.find(*args, **kwargs)))
+
+    async def aggregate(self, pipeline, **kwargs):
+        return await self._run(lambda: list(self._collection.aggregate(pipeline, **kwargs)))
+
+    async def count_documents(self, *args, **kwargs):
+        return await self._run(self._collection.count_documents, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await self._run(self._collection.insert_one, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self._run(self._collection.update_one, *args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        return await self._run(self._collection.update_many, *args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return await self._run(self._collection.find_one_and_update, *args, **kwargs)
+
+    async def find_one_and_delete(self, *args, **kwargs):
+        return await self._run(self._collection.find_one_and_delete, *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await self._run(self._collection.delete_one, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await self._run(self._collection.delete_many, *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self._run(self._collection.bulk_write, *args, **kwargs)
+
+    async def create_indexes(self, *args, **kwargs):
+        return await self._run(self._collection.create_indexes, *args, **kwargs)
+
+    async def explain_find(self, *args, **kwargs):
+        return await self._run(lambda: self._collection.find(*args, **kwargs).explain())
+
+    async def command(self, name, **kwargs):
+        """
+        Run a database command against this collection, e.g. collStats/collMod.
+        """
+        return await self._run(self._collection.database.command, name, self._collection.name, **kwargs)
+
+
+def init_db(uri=None, max_workers=16, event_listeners=None):
+    """
+    Connect to MongoDB and expose the bot's collections as AsyncCollection
+    module attributes (db.users, db.reports, db.like_notifications).
+    event_listeners are passed to the MongoClient (pymongo.monitoring).
+    """
+    global client, users, reports, like_notifications, decks, edges, like_pairs, broadcasts, report_summaries, processed_updates,\
+        conversation_state, leases, replicas, _executor
+
+    options = {"event_listeners": event_listeners} if event_listeners else {}
+    client = MongoClient(uri, **options) if uri else MongoClient(**options)
+    database = client[DB_NAME]
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+
+    users = AsyncCollection(database["users"], _executor)
+    reports = AsyncCollection(database["reports"], _executor)  # persisted user reports
+    like_notifications = AsyncCollection(database["like_notifications"], _executor)  # queued "someone liked you" notices
+    decks = AsyncCollection(database["decks"], _executor)  # per-viewer pre-shuffled candidate ids
+    edges = AsyncCollection(database["edges"], _executor)  # likes / passes between users
+    like_pairs = AsyncCollection(database["like_pairs"], _executor)  # who liked whom, per unordered pair
+    broadcasts = AsyncCollection(database["broadcasts"], _executor)  # resumable broadcast jobs
+    report_summaries = AsyncCollection(database["report_summaries"], _executor)  # archived reports, one doc per month
+    processed_updates = AsyncCollection(database["processed_updates"], _executor)  # recent update_ids, for de-duplication
+    conversation_state = AsyncCollection(database["conversation_state"], _executor)  # shared flags and drafts (replica mode)
+    leases = AsyncCollection(database["leases"], _executor)  # leader election
+    replicas = AsyncCollection(database["replicas"], _executor)  # live replica heartbeats
+    logger.info("MongoDB initialised (db=%s, max_workers=%s)", DB_NAME, max_workers)
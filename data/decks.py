@@ -0,0 +1,69 @@
+"""
+Per-viewer candidate decks.
+
+Each viewer gets a persisted, pre-shuffled list of eligible candidate ids.
+find_match pops the next id off the front (one small write) and loads that
+single profile (one small read) instead of re-running the candidate query on
+every swipe. Decks are topped up in the background once they run low.
+"""
+from datetime import datetime
+
+from data import db
+from data import users as user_repo
+
+DECK_SIZE = 50
+# Top the deck up in the background once fewer than this many ids are left
+DECK_REFILL_AT = 10
+
+
+async def pop_next(viewer_id):
+    """
+    Atomically pop the front of the viewer's deck.
+    Returns (candidate_id, remaining, interested_in); candidate_id is None when
+    the deck is empty. Returns None when the viewer has no deck at all.
+    """
+    doc = await db.decks.find_one_and_update(
+        {"user_id": viewer_id},
+        {"$pop": {"ids": -1}},
+        projection={"_id": 0, "ids": {"$slice": 1}, "size": {"$size": "$ids"}, "interested_in": 1},
+    )
+    if doc is None:
+        return None
+    ids = doc.get("ids") or []
+    remaining = max(doc.get("size", 0) - 1, 0)
+    return (ids[0] if ids else None), remaining, doc.get("interested_in")
+
+
+async def build_deck(viewer_id, interested_in, exclude_ids):
+    """
+    Replace the viewer's deck with a freshly shuffled one. Returns the new ids.
+    """
+    ids = await user_repo.sample_candidate_ids(viewer_id, interested_in, exclude_ids, DECK_SIZE)
+    await db.decks.update_one(
+        {"user_id": viewer_id},
+        {"$set": {"ids": ids, "interested_in": interested_in, "built_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return ids
+
+
+async def refill_deck(viewer_id, exclude_ids):
+    """
+    Append fresh candidates to the back of the viewer's deck, skipping ids
+    already queued in it. Returns how many were added.
+    """
+    deck = await db.decks.find_one({"user_id": viewer_id}, {"_id": 0, "ids": 1, "interested_in": 1})
+    if deck is None:
+        return 0
+    queued = deck.get("ids") or []
+    want = DECK_SIZE - len(queued)
+    if want <= 0:
+        return 0
+    ids = await user_repo.sample_candidate_ids(viewer_id, deck.get("interested_in"), [*exclude_ids, *queued], want)
+    if ids:
+        await db.decks.update_one({"user_id": viewer_id}, {"$push": {"ids": {"$each": ids}}})
+    return len(ids)
+
+
+async def discard_deck(viewer_id):
+    await db.decks.delete_one({"user_id": viewer_id})
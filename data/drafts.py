@@ -0,0 +1,144 @@
+"""
+Onboarding and profile-edit conversation state.
+
+The profile being built during onboarding (current step plus the fields
+entered so far) is kept in memory rather than written to the user document
+at every step. Changed drafts are checkpointed to users.step / users.draft by
+a periodic batched write, so a restart resumes from the last checkpoint, and the
+finished profile is committed in one write at step "done". Edit sessions are
+not checkpointed: losing one just means tapping Edit again.
+
+With use_store() (replica mode) drafts live in a shared data.state store
+instead of process memory, so a user's next update may land on any replica.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from data import storage
+
+logger = logging.getLogger(__name__)
+
+MAX_DRAFTS = 50_000
+CHECKPOINT_INTERVAL = 30  # seconds
+SHARED_DRAFT_TTL = 7 * 86400  # seconds an idle draft survives in a shared store
+
+_store = None  # shared data.state store, or None for process memory
+
+_drafts = OrderedDict()  # user_id -> {"step": str, "fields": dict}
+_dirty = {}  # user_id -> snapshot of a draft changed since the last checkpoint
+stats = {"restored": 0, "checkpointed": 0, "completed": 0}
+
+
+def use_store(store):
+    global _store
+    _store = store
+
+
+async def _put(user_id, draft, persist):
+    if _store is not None:
+        await _store.set(f"draft:{user_id}", draft, SHARED_DRAFT_TTL)
+    else:
+        _drafts[user_id] = draft
+        _drafts.move_to_end(user_id)
+        if len(_drafts) > MAX_DRAFTS:
+            # an evicted draft that is still dirty is recovered from _dirty by get()
+            _drafts.popitem(last=False)
+    if persist:
+        _dirty[user_id] = {"step": draft["step"], "fields": dict(draft["fields"])}
+    return draft
+
+
+async def get(user_id):
+    if _store is not None:
+        return await _store.get(f"draft:{user_id}")
+    draft = _drafts.get(user_id)
+    if draft is not None:
+        _drafts.move_to_end(user_id)
+        return draft
+    snapshot = _dirty.get(user_id)
+    if snapshot is not None:
+        return await _put(user_id, {"step": snapshot["step"], "fields": dict(snapshot["fields"])}, persist=False)
+    return None
+
+
+async def restore(user_id, doc):
+    """
+    Rebuild a draft from the user document: its checkpoint, or an unfinished
+    step left by an older version. Returns None for finished profiles.
+    """
+    step = doc.get("step")
+    if not step or step == "done":
+        return None
+    stats["restored"] += 1
+    return await _put(user_id, {"step": step, "fields": dict(doc.get("draft") or {})}, persist=False)
+
+
+async def begin(user_id, step):
+    return await _put(user_id, {"step": step, "fields": {}}, persist=True)
+
+
+async def begin_edit(user_id, step):
+    _dirty.pop(user_id, None)
+    return await _put(user_id, {"step": step, "fields": {}}, persist=False)
+
+
+async def advance(user_id, fields, step):
+    """
+    Record validated fields and move the draft to `step`.
+    """
+    draft = await get(user_id) or {"step": step, "fields": {}}
+    draft["fields"].update(fields)
+    draft["step"] = step
+    return await _put(user_id, draft, persist=True)
+
+
+async def discard(user_id):
+    _drafts.pop(user_id, None)
+    _dirty.pop(user_id, None)
+    if _store is not None:
+        await _store.pop(f"draft:{user_id}")
+
+
+async def complete(user_id, fields):
+    """
+    Commit every drafted field plus `fields` with step "done" in one write.
+    """
+    draft = await get(user_id) or {"fields": {}}
+    profile = {**draft["fields"], **fields, "step": "done"}
+    await storage.users.update_user(user_id, {"$set": profile, "$unset": {"draft": ""}})
+    await discard(user_id)
+    stats["completed"] += 1
+
+
+async def flush():
+    """
+    Checkpoint every changed draft in one batched write. Returns how many were written.
+    """
+    if not _dirty:
+        return 0
+    batch = dict(_dirty)
+    _dirty.clear()
+    # the step guard stops a checkpoint that lands late from reopening a completed profile
+    try:
+        await storage.users.set_fields_many(
+            {uid: {"step": d["step"], "draft": d["fields"]} for uid, d in batch.items()},
+            unfinished_only=True
+        )
+    except Exception:
+        for uid, d in batch.items():
+            _dirty.setdefault(uid, d)
+        raise
+    stats["checkpointed"] += len(batch)
+    return len(batch)
+
+
+async def run_checkpointer(interval=CHECKPOINT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            written = await flush()
+            if written:
+                logger.debug("Checkpointed %s onboarding drafts (stats=%s)", written, stats)
+        except Exception:
+            logger.exception("Failed to checkpoint onboarding drafts")
@@ -0,0 +1,216 @@
+"""
+Social-graph edges: one document per (liker_id, target_id, kind), where kind
+is "like" or "pass". Keeping these out of the user document stops popular
+profiles from growing with every like and keeps profile reads small.
+
+Likes are also mirrored into like_pairs, one document per unordered pair of
+users, so detecting a mutual like is a single atomic update on a document both
+users contend on.
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from data import db
+from data import users as user_repo
+
+logger = logging.getLogger(__name__)
+
+LIKE = "like"
+PASS = "pass"
+
+
+async def _record(liker_id, target_id, kind):
+    res = await db.edges.update_one(
+        {"liker_id": liker_id, "target_id": target_id, "kind": kind},
+        {"$setOnInsert": {"created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return res.upserted_id is not None
+
+
+async def _record_like_edge(liker_id, target_id):
+    # counted stays False until the target's likes_received has been bumped;
+    # edges that predate the flag were counted by the backfill
+    return await db.edges.find_one_and_update(
+        {"liker_id": liker_id, "target_id": target_id, "kind": LIKE},
+        {"$setOnInsert": {"created_at": datetime.utcnow(), "counted": False}},
+        projection={"_id": 0, "counted": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+
+
+def _pair_id(a, b):
+    lo, hi = sorted((a, b))
+    return f"{lo}:{hi}"
+
+
+async def _add_pair_like(liker_id, target_id):
+    update = {
+        "$addToSet": {"likes": liker_id},
+        "$min": {f"liked_at.{liker_id}": datetime.utcnow()},
+    }
+    for attempt in range(2):
+        try:
+            return await db.like_pairs.find_one_and_update(
+                {"_id": _pair_id(liker_id, target_id)},
+                update,
+                projection={"_id": 0, "likes": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # both users created the pair document at once; the retry hits the existing one
+            if attempt:
+                raise
+
+
+async def record_like(liker_id, target_id):
+    """
+    Record that liker_id liked target_id and detect a mutual like. The edge
+    upsert and the pair update are both idempotent and go out as two
+    concurrent writes, then the caller bumps the target's counter and calls
+    mark_counted. A tap retried after a partial failure fills in whichever
+    write is missing, and an edge whose counter bump never landed counts as
+    new again.
+
+    Returns (new, mutual): new is False when both writes were already there
+    and the like was counted; mutual is True only for the like that completed
+    the pair (decided by the atomic pair update), so when both users tap at
+    the same moment exactly one of them sees it.
+    """
+    edge, before = await asyncio.gather(
+        _record_like_edge(liker_id, target_id),
+        _add_pair_like(liker_id, target_id),
+    )
+    uncounted = edge is None or edge.get("counted", True) is False
+    likes = (before or {}).get("likes") or []
+    new = uncounted or liker_id not in likes
+    return new, new and target_id in likes
+
+
+async def mark_counted(liker_id, target_id):
+    """
+    Note that target_id's likes_received includes this like, so a retried
+    tap no longer reports it as new.
+    """
+    await db.edges.update_one(
+        {"liker_id": liker_id, "target_id": target_id, "kind": LIKE},
+        {"$set": {"counted": True}}
+    )
+
+
+async def record_pass(liker_id, target_id):
+    return await _record(liker_id, target_id, PASS)
+
+
+async def outgoing_ids(liker_id, kinds=(LIKE, PASS)):
+    """
+    Ids of every user liker_id has liked and/or passed on.
+    """
+    docs = await db.edges.find({"liker_id": liker_id, "kind": {"$in": list(kinds)}}, {"_id": 0, "target_id": 1})
+    return [d["target_id"] for d in docs]
+
+
+async def clear_passes(liker_id):
+    await db.edges.delete_many({"liker_id": liker_id, "kind": PASS})
+
+
+async def migrate_user_arrays(batch_size=200):
+    """
+    Online migration of the legacy likes / liked_by / passed arrays on user
+    documents into edges. Safe to run while the bot serves traffic: handlers
+    only write edges now, and each user's arrays are unset after their edges
+    are upserted. Returns the number of users migrated.
+    """
+    legacy = {"$or": [{"likes": {"$exists": True}}, {"liked_by": {"$exists": True}}, {"passed": {"$exists": True}}]}
+    migrated = 0
+    while True:
+        batch = await db.users.find(legacy, {"_id": 0, "user_id": 1, "likes": 1, "liked_by": 1, "passed": 1}, limit=batch_size)
+        if not batch:
+            break
+        now = datetime.utcnow()
+        ops = []
+        pair_ops = []
+        for u in batch:
+            uid = u["user_id"]
+            pairs = [(uid, t, LIKE) for t in u.get("likes") or []]
+            pairs += [(other, uid, LIKE) for other in u.get("liked_by") or []]
+            pairs += [(uid, t, PASS) for t in u.get("passed") or []]
+            for liker_id, target_id, kind in pairs:
+                ops.append(UpdateOne(
+                    {"liker_id": liker_id, "target_id": target_id, "kind": kind},
+                    {"$setOnInsert": {"created_at": now}},
+                    upsert=True
+                ))
+                if kind == LIKE:
+                    pair_ops.append(UpdateOne(
+                        {"_id": _pair_id(liker_id, target_id)},
+                        {"$addToSet": {"likes": liker_id}},
+                        upsert=True
+                    ))
+        if ops:
+            await db.edges.bulk_write(ops, ordered=False)
+        if pair_ops:
+            await db.like_pairs.bulk_write(pair_ops, ordered=False)
+        migrated_ids = [u["user_id"] for u in batch]
+        await db.users.update_many(
+            {"user_id": {"$in": migrated_ids}},
+            {"$unset": {"likes": "", "liked_by": "", "passed": ""}}
+        )
+        user_repo.invalidate(*migrated_ids)
+        migrated += len(batch)
+    if migrated:
+        logger.info("Migrated social-graph arrays of %s users into edges", migrated)
+    return migrated
+
+
+async def backfill_like_pairs():
+    """
+    Build like_pairs from existing like edges when the collection is still
+    empty (first start after it was introduced). Runs entirely server-side.
+    """
+    if await db.like_pairs.find_one({}, {"_id": 1}):
+        return
+    pair_key = {"$concat": [
+        {"$toString": {"$min": ["$liker_id", "$target_id"]}},
+        ":",
+        {"$toString": {"$max": ["$liker_id", "$target_id"]}},
+    ]}
+    await db.edges.aggregate([
+        {"$match": {"kind": LIKE}},
+        {"$group": {"_id": pair_key, "likes": {"$addToSet": "$liker_id"}}},
+        {"$merge": {
+            "into": "like_pairs",
+            "whenMatched": [{"$set": {"likes": {"$setUnion": ["$likes", "$$new.likes"]}}}],
+            "whenNotMatched": "insert",
+        }},
+    ])
+    logger.info("Backfilled like_pairs from like edges")
+
+
+async def backfill_like_counts():
+    """
+    Materialize users.likes_received from like edges for users that predate
+    the counter. Runs server-side; a no-op once every user has the field.
+    """
+    if not await db.users.find_one({"likes_received": {"$exists": False}}, {"_id": 1}):
+        return
+    await db.edges.aggregate([
+        {"$match": {"kind": LIKE}},
+        {"$group": {"_id": "$target_id", "likes": {"$sum": 1}}},
+        {"$project": {"_id": 0, "user_id": "$_id", "likes": 1}},
+        {"$merge": {
+            "into": "users",
+            "on": "user_id",
+            "whenMatched": [{"$set": {"likes_received": "$$new.likes"}}],
+            "whenNotMatched": "discard",
+        }},
+    ])
+    await db.users.update_many({"likes_received": {"$exists": False}}, {"$set": {"likes_received": 0}})
+    user_repo.invalidate_all()
+    logger.info("Backfilled users.likes_received from like edges")
@@ -0,0 +1,156 @@
+"""
+Index bootstrap. Every index the bot's query shapes rely on is declared here
+and created idempotently at startup; HOT_QUERIES are then explained so any
+shape still answered by a collection scan shows up in the startup log.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from data import db
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+        # candidate sampling (step == done, gender in ..., banned != True) uses the
+        # (step, gender) prefix; the leaderboard walks likes_received per gender
+        IndexModel([("step", ASCENDING), ("gender", ASCENDING), ("likes_received", DESCENDING)], name="step_gender_likes"),
+    ],
+    "like_notifications": [
+        IndexModel([("recipient_id", ASCENDING), ("status", ASCENDING), ("sent_at", DESCENDING)], name="recipient_status_sent_at"),
+        IndexModel([("recipient_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING)], name="recipient_status_created_at"),
+        # at most one notification awaiting a response per recipient; makes claim_next race-free
+        IndexModel([("recipient_id", ASCENDING)], unique=True, partialFilterExpression={"status": "sent"}, name="one_sent_per_recipient"),
+        # new likes fold into the single queued digest
+        IndexModel([("recipient_id", ASCENDING)], unique=True, partialFilterExpression={"status": "queued"}, name="one_queued_per_recipient"),
+    ],
+    "reports": [
+        IndexModel([("target_id", ASCENDING), ("reporter_id", ASCENDING), ("status", ASCENDING)], name="target_reporter_status"),
+        # admin queue: open reports oldest first, keyset-paginated
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], name="status_created_at"),
+    ],
+    "edges": [
+        IndexModel([("liker_id", ASCENDING), ("target_id", ASCENDING), ("kind", ASCENDING)], unique=True, name="liker_target_kind_unique"),
+        IndexModel([("target_id", ASCENDING), ("kind", ASCENDING)], name="target_kind"),
+        # admin stats: likes per day over a recent window
+        IndexModel([("kind", ASCENDING), ("created_at", ASCENDING)], name="kind_created_at"),
+    ],
+    "decks": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    # replica mode
+    "conversation_state": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "replicas": [
+        IndexModel([("seen_at", ASCENDING)], expireAfterSeconds=3600, name="seen_at_ttl"),
+    ],
+}
+
+NOTIFICATION_TTL_INDEX = "closed_at_ttl"
+UPDATE_TTL_INDEX = "seen_at_ttl"
+INDEX_OPTIONS_CONFLICT = 85
+
+# Indexes correctness depends on, not just speed: without these, two racing
+# deliveries can both send. Failing to build one stops startup.
+REQUIRED_INDEXES = {
+    ("like_notifications", "one_sent_per_recipient"),
+    ("like_notifications", "one_queued_per_recipient"),
+}
+
+
+async def _ensure_ttl(name, field, index_name, seconds):
+    model = IndexModel([(field, ASCENDING)], expireAfterSeconds=int(seconds), name=index_name)
+    collection = getattr(db, name)
+    try:
+        await collection.create_indexes([model])
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        # the configured lifetime changed since the index was built; adjust it in place
+        await collection.command("collMod", index={"name": index_name, "expireAfterSeconds": int(seconds)})
+
+
+# (collection, filter, sort) for the queries that run on every update
+HOT_QUERIES = [
+    ("users", {"user_id": 0}, None),
+    ("users", {"step": "done", "gender": {"$in": ["male", "female"]}, "banned": {"$ne": True}}, None),
+    ("users", {"step": "done", "gender": "male", "banned": {"$ne": True}, "likes_received": {"$gt": 0}}, [("likes_received", -1)]),
+    ("like_notifications", {"recipient_id": 0, "status": "sent"}, [("sent_at", -1)]),
+    ("like_notifications", {"recipient_id": 0, "status": "queued"}, [("created_at", -1)]),
+    ("reports", {"target_id": 0, "reporter_id": 0, "status": {"$in": ["open", "pending"]}}, None),
+    ("reports", {"status": {"$in": ["open", "pending"]}}, [("created_at", 1), ("_id", 1)]),
+    ("edges", {"liker_id": 0, "kind": {"$in": ["like", "pass"]}}, None),
+    ("edges", {"target_id": 0, "kind": "like"}, None),
+    ("decks", {"user_id": 0}, None),
+]
+
+
+async def ensure_indexes(notification_retention_days=None, update_dedup_window=None):
+    """
+    Create every declared index. Existing identical indexes are a no-op; a
+    failure (e.g. duplicate user_id values blocking the unique index) is logged
+    and does not stop the remaining indexes or the bot, except for
+    REQUIRED_INDEXES, whose failure is raised once the rest are built.
+
+    With notification_retention_days set, responded/cancelled notifications
+    are also given a TTL of that many days; update_dedup_window (seconds)
+    does the same for processed update ids.
+    """
+    required_failure = None
+    for name, models in INDEXES.items():
+        collection = getattr(db, name)
+        for model in models:
+            try:
+                await collection.create_indexes([model])
+            except PyMongoError as e:
+                logger.exception("Failed to create index %s on %s", model.document["name"], name)
+                if (name, model.document["name"]) in REQUIRED_INDEXES:
+                    required_failure = required_failure or e
+    ttls = []
+    if notification_retention_days:
+        # only terminal rows carry closed_at, so queued/sent digests never expire
+        ttls.append(("like_notifications", "closed_at", NOTIFICATION_TTL_INDEX, notification_retention_days * 86400))
+    if update_dedup_window:
+        ttls.append(("processed_updates", "seen_at", UPDATE_TTL_INDEX, update_dedup_window))
+    for name, field, index_name, seconds in ttls:
+        try:
+            await _ensure_ttl(name, field, index_name, seconds)
+            logger.info("%s documents expire %ss after %s", name, int(seconds), field)
+        except PyMongoError:
+            logger.exception("Failed to set up the %s TTL index on %s", index_name, name)
+    if required_failure:
+        raise required_failure
+
+
+def _plan_stages(plan):
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def report_collscans():
+    """
+    Explain each hot query and warn about those whose winning plan still
+    contains a COLLSCAN. Returns the offending (collection, filter) pairs.
+    """
+    offenders = []
+    for name, query, sort in HOT_QUERIES:
+        try:
+            explain = await getattr(db, name).explain_find(query, sort=sort)
+        except PyMongoError:
+            logger.exception("Failed to explain hot query on %s: %s", name, query)
+            continue
+        winning = explain.get("queryPlanner", {}).get("winningPlan", {})
+        winning = winning.get("queryPlan", winning)
+        if "COLLSCAN" in _plan_stages(winning):
+            logger.warning("Hot query on %s is a COLLSCAN: filter=%s sort=%s", name, query, sort)
+            offenders.append((name, query))
+    if not offenders:
+        logger.info("All %s hot queries are index-backed", len(HOT_QUERIES))
+    return offenders
@@ -0,0 +1,47 @@
+"""
+Lease documents for leader election, and replica heartbeats. Expiry is
+compared against the server clock ($$NOW), so clock skew between replicas
+cannot make two of them believe they hold the same lease.
+"""
+from pymongo.errors import DuplicateKeyError
+
+from data import db
+
+
+async def acquire(name, holder, ttl):
+    """
+    Take or renew lease `name` for `ttl` seconds. Returns True if `holder`
+    owns it afterwards.
+    """
+    try:
+        await db.leases.update_one(
+            {"_id": name, "$expr": {"$or": [
+                {"$eq": ["$holder", holder]},
+                {"$lt": ["$expires_at", "$$NOW"]},
+            ]}},
+            [{"$set": {"holder": holder, "expires_at": {"$add": ["$$NOW", int(ttl * 1000)]}}}],
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # someone else holds a live lease, so the filter missed and the upsert collided
+        return False
+    return True
+
+
+async def release(name, holder):
+    await db.leases.delete_one({"_id": name, "holder": holder})
+
+
+async def heartbeat(replica_id, ttl):
+    """
+    Record that replica_id is alive and return how many replicas have sent
+    a heartbeat within the last `ttl` seconds (including this one).
+    """
+    await db.replicas.update_one({"_id": replica_id}, [{"$set": {"seen_at": "$$NOW"}}], upsert=True)
+    return await db.replicas.count_documents(
+        {"$expr": {"$gt": ["$seen_at", {"$subtract": ["$$NOW", int(ttl * 1000)]}]}}
+    )
+
+
+async def forget_replica(replica_id):
+    await db.replicas.delete_one({"_id": replica_id})
@@ -0,0 +1,679 @@
+"""
+In-memory storage engine.
+
+Implements the coroutines the handlers use from the MongoDB repositories
+(data/users.py, edges.py, notifications.py, reports.py, decks.py and
+broadcasts.py) on plain dicts. The ordered queries keep sorted secondary
+indexes: likes per gender for the leaderboard, (created_at, _id) of open
+reports for the moderation queue and the sorted user ids the broadcast cursor
+walks. No operation awaits anything, so each one is atomic with respect to
+other updates, as the single-document Mongo writes are.
+
+With a log path, every write is appended to a JSON-lines log (bson extended
+JSON, so datetimes and ObjectIds round-trip) and replayed on start; the log
+is then compacted into a single snapshot line. Decks are not logged: they
+are rebuilt on demand after a restart. Closed like notifications are dropped
+straight away rather than kept for a retention period.
+"""
+import logging
+import os
+import random
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+from bson import json_util
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from data.decks import DECK_SIZE, DECK_REFILL_AT
+from data.edges import LIKE, PASS
+from data.notifications import DIGEST_CAP
+from data.reports import OPEN_STATUSES, QUEUE_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+CANDIDATE_GENDERS = ("male", "female")
+UPDATE_OPERATORS = ("$set", "$unset", "$inc", "$addToSet", "$push")
+LOG_OPTIONS = json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=False)
+
+
+def _clone(value):
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+
+def _project(doc, projection):
+    if projection is None:
+        return _clone(doc)
+    keep = {k for k, v in projection.items() if v}
+    if projection.get("_id", 1):
+        keep.add("_id")
+    return {k: _clone(v) for k, v in doc.items() if k in keep}
+
+
+def _each(value):
+    if isinstance(value, dict) and "$each" in value:
+        return value["$each"]
+    return [value]
+
+
+def _apply_update(doc, update):
+    """
+    Apply the update operators the repositories use ($set, $unset, $inc,
+    $addToSet and $push with $each) to top-level fields of doc.
+    """
+    for op, fields in update.items():
+        if op not in UPDATE_OPERATORS:
+            raise ValueError(f"Unsupported update operator {op}")
+        if any("." in key for key in fields):
+            raise ValueError(f"Dotted paths are not supported: {list(fields)}")
+    for op, fields in update.items():
+        for key, value in fields.items():
+            if op == "$set":
+                doc[key] = _clone(value)
+            elif op == "$unset":
+                doc.pop(key, None)
+            elif op == "$inc":
+                doc[key] = doc.get(key, 0) + value
+            elif op == "$addToSet":
+                items = doc.setdefault(key, [])
+                items.extend(v for v in _each(value) if v not in items)
+            else:
+                doc.setdefault(key, []).extend(_clone(_each(value)))
+
+
+class _Namespace:
+    """
+    One repository's worth of state. Public coroutines mirror the Mongo
+    repository; writes go through engine.write() so they are logged, and the
+    matching _op_<name> method does the actual change.
+    """
+    name = None
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def _write(self, op, *args):
+        return self._engine.write(self.name, op, args)
+
+    def dump(self):
+        return None
+
+    def load(self, state):
+        pass
+
+
+# ------------------- USERS -------------------
+class MemoryUsers(_Namespace):
+    name = "users"
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._docs = {}  # user_id -> document
+        self._ids = []  # sorted user ids (broadcast cursor)
+        self._pools = {g: set() for g in CANDIDATE_GENDERS}  # finished, unbanned profiles per gender
+        self._ranked = {g: [] for g in CANDIDATE_GENDERS}  # same profiles, sorted (-likes_received, user_id)
+
+    @staticmethod
+    def _candidate_key(doc):
+        if doc.get("step") != "done" or doc.get("banned") is True or doc.get("gender") not in CANDIDATE_GENDERS:
+            return None
+        return doc["gender"], doc.get("likes_received") or 0
+
+    def _unindex(self, doc):
+        key = self._candidate_key(doc)
+        if key is None:
+            return
+        gender, likes = key
+        self._pools[gender].discard(doc["user_id"])
+        ranked = self._ranked[gender]
+        del ranked[bisect_left(ranked, (-likes, doc["user_id"]))]
+
+    def _index(self, doc):
+        key = self._candidate_key(doc)
+        if key is None:
+            return
+        gender, likes = key
+        self._pools[gender].add(doc["user_id"])
+        insort(self._ranked[gender], (-likes, doc["user_id"]))
+
+    def _modify(self, user_id, change):
+        doc = self._docs.get(user_id)
+        if doc is None:
+            return
+        self._unindex(doc)
+        try:
+            change(doc)
+        finally:
+            self._index(doc)
+
+    def _op_create_user(self, doc):
+        if doc["user_id"] in self._docs:
+            raise DuplicateKeyError(f"user_id {doc['user_id']} already exists")
+        doc = _clone(doc)
+        self._docs[doc["user_id"]] = doc
+        insort(self._ids, doc["user_id"])
+        self._index(doc)
+
+    def _op_set_fields(self, user_id, fields):
+        self._modify(user_id, lambda doc: doc.update(_clone(fields)))
+
+    def _op_update_user(self, user_id, update):
+        self._modify(user_id, lambda doc: _apply_update(doc, update))
+
+    def _op_add_likes_received(self, user_id, n):
+        self._modify(user_id, lambda doc: _apply_update(doc, {"$inc": {"likes_received": n}}))
+
+    def _op_set_fields_many(self, items, unfinished_only):
+        for user_id, fields in items:
+            doc = self._docs.get(user_id)
+            if doc is not None and not (unfinished_only and doc.get("step") == "done"):
+                self._op_set_fields(user_id, fields)
+
+    async def get_user(self, user_id, projection=None):
+        doc = self._docs.get(user_id)
+        return _project(doc, projection) if doc else None
+
+    async def get_users(self, user_ids, projection=None):
+        return {uid: _project(self._docs[uid], projection) for uid in user_ids if uid in self._docs}
+
+    async def create_user(self, doc):
+        doc.setdefault("_id", ObjectId())
+        self._write("create_user", doc)
+
+    async def set_fields(self, user_id, fields):
+        self._write("set_fields", user_id, fields)
+
+    async def update_user(self, user_id, update):
+        self._write("update_user", user_id, update)
+
+    async def set_fields_many(self, fields_by_user, unfinished_only=False):
+        # a list of pairs: JSON would turn integer dict keys into strings
+        self._write("set_fields_many", list(fields_by_user.items()), unfinished_only)
+
+    async def add_likes_received(self, user_id, n=1):
+        self._write("add_likes_received", user_id, n)
+
+    async def top_by_likes(self, gender, limit=10):
+        fields = ("name", "department", "year", "likes_received")
+        return [
+            {k: self._docs[uid][k] for k in fields if k in self._docs[uid]}
+            for _, uid in self._ranked.get(gender, [])[:limit]
+        ]
+
+    def _pool(self, interested_in):
+        if interested_in and interested_in != "both":
+            return self._pools.get(interested_in, set())
+        return self._pools["male"] | self._pools["female"]
+
+    async def sample_candidate_ids(self, viewer_id, interested_in, exclude_ids, size):
+        excluded = {viewer_id, *exclude_ids}
+        eligible = [uid for uid in self._pool(interested_in) if uid not in excluded]
+        return random.sample(eligible, min(size, len(eligible)))
+
+    async def get_candidate(self, candidate_id, viewer_id, interested_in):
+        if candidate_id == viewer_id or candidate_id not in self._pool(interested_in):
+            return None
+        doc = self._docs[candidate_id]
+        candidate = {k: _clone(doc[k]) for k in ("user_id", "name", "age", "department", "year", "bio") if k in doc}
+        photos = doc.get("photos")
+        candidate["photos"] = photos[-1:] if isinstance(photos, list) else None
+        return candidate
+
+    def dump(self):
+        return list(self._docs.values())
+
+    def load(self, state):
+        for doc in state:
+            self._op_create_user(doc)
+
+
+# ------------------- EDGES -------------------
+class MemoryEdges(_Namespace):
+    name = "edges"
+    LIKE = LIKE
+    PASS = PASS
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._out = {LIKE: {}, PASS: {}}  # kind -> liker_id -> set of target ids
+        self._uncounted = set()  # (liker_id, target_id) likes not yet in likes_received
+
+    def _op_record_like(self, liker_id, target_id):
+        likes = self._out[LIKE].setdefault(liker_id, set())
+        if target_id in likes and (liker_id, target_id) not in self._uncounted:
+            return False, False
+        likes.add(target_id)
+        self._uncounted.add((liker_id, target_id))
+        return True, liker_id in self._out[LIKE].get(target_id, ())
+
+    def _op_mark_counted(self, liker_id, target_id):
+        self._uncounted.discard((liker_id, target_id))
+
+    def _op_record_pass(self, liker_id, target_id):
+        passes = self._out[PASS].setdefault(liker_id, set())
+        if target_id in passes:
+            return False
+        passes.add(target_id)
+        return True
+
+    def _op_clear_passes(self, liker_id):
+        self._out[PASS].pop(liker_id, None)
+
+    async def record_like(self, liker_id, target_id):
+        return self._write("record_like", liker_id, target_id)
+
+    async def mark_counted(self, liker_id, target_id):
+        self._write("mark_counted", liker_id, target_id)
+
+    async def record_pass(self, liker_id, target_id):
+        return self._write("record_pass", liker_id, target_id)
+
+    async def outgoing_ids(self, liker_id, kinds=(LIKE, PASS)):
+        ids = []
+        for kind in kinds:
+            ids.extend(self._out[kind].get(liker_id, ()))
+        return ids
+
+    async def clear_passes(self, liker_id):
+        self._write("clear_passes", liker_id)
+
+    def dump(self):
+        return {
+            "out": [[kind, liker_id, list(targets)] for kind, by_liker in self._out.items() for liker_id, targets in by_liker.items()],
+            "uncounted": [list(pair) for pair in self._uncounted],
+        }
+
+    def load(self, state):
+        for kind, liker_id, targets in state["out"]:
+            self._out[kind].setdefault(liker_id, set()).update(targets)
+        self._uncounted.update(tuple(pair) for pair in state["uncounted"])
+
+
+# ------------------- NOTIFICATIONS -------------------
+class MemoryNotifications(_Namespace):
+    name = "notifications"
+    DIGEST_CAP = DIGEST_CAP
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._queued = {}  # recipient_id -> queued digest
+        self._sent = {}  # recipient_id -> digest awaiting a response
+
+    def _op_add_like(self, recipient_id, liker_id, now, new_id):
+        doc = self._queued.get(recipient_id)
+        if doc is None:
+            doc = self._queued[recipient_id] = {
+                "_id": new_id, "recipient_id": recipient_id, "status": "queued", "liker_ids": [], "count": 0,
+                "created_at": now, "sent_at": None, "response": None,
+            }
+        doc["liker_ids"] = (doc["liker_ids"] + [liker_id])[-DIGEST_CAP:]
+        doc["count"] += 1
+        doc["updated_at"] = now
+        return str(doc["_id"])
+
+    def _op_expire_sent(self, recipient_id, sent_before):
+        doc = self._sent.get(recipient_id)
+        if doc is not None and doc["sent_at"] < sent_before:
+            del self._sent[recipient_id]
+
+    def _op_claim_next(self, recipient_id, now):
+        if recipient_id not in self._queued:
+            return None, False
+        if recipient_id in self._sent:
+            return None, True
+        doc = self._sent[recipient_id] = self._queued.pop(recipient_id)
+        doc.update(status="sent", sent_at=now)
+        return _clone(doc), False
+
+    def _op_release_claim(self, notification_id):
+        for recipient_id, doc in self._sent.items():
+            if doc["_id"] == notification_id:
+                del self._sent[recipient_id]
+                queued = self._queued.get(recipient_id)
+                if queued is None:
+                    doc.update(status="queued", sent_at=None)
+                    self._queued[recipient_id] = doc
+                    return
+                # a like arrived during the send: fold the failed digest in, older likers first
+                queued["liker_ids"] = (doc["liker_ids"] + queued["liker_ids"])[-DIGEST_CAP:]
+                queued["count"] += doc["count"]
+                queued["created_at"] = min(queued["created_at"], doc["created_at"])
+                return
+
+    def _op_mark_responded(self, recipient_id, liker_id):
+        doc = self._sent.get(recipient_id)
+        if doc is None or (liker_id is not None and liker_id not in doc["liker_ids"]):
+            return 0
+        del self._sent[recipient_id]
+        return 1
+
+    async def add_like(self, recipient_id, liker_id, now):
+        return self._write("add_like", recipient_id, liker_id, now, ObjectId())
+
+    async def latest_sent(self, recipient_id):
+        doc = self._sent.get(recipient_id)
+        return _clone(doc) if doc else None
+
+    async def expire_sent(self, recipient_id, sent_before, now):
+        if recipient_id in self._sent:
+            self._write("expire_sent", recipient_id, sent_before)
+
+    async def claim_next(self, recipient_id, now):
+        if recipient_id not in self._queued:
+            return None, False
+        return self._write("claim_next", recipient_id, now)
+
+    async def release_claim(self, notification_id, now):
+        self._write("release_claim", notification_id)
+
+    async def mark_responded(self, recipient_id, liker_id, response_type, now):
+        if recipient_id not in self._sent:
+            return 0
+        return self._write("mark_responded", recipient_id, liker_id)
+
+    async def pending_recipients(self):
+        return [
+            {"_id": recipient_id, "queued": 1, "last_sent_at": (self._sent.get(recipient_id) or {}).get("sent_at")}
+            for recipient_id in self._queued
+        ]
+
+    async def backfill_closed_at(self, now):
+        # closed digests are not kept, so there is nothing to stamp
+        return 0
+
+    def dump(self):
+        return list(self._queued.values()) + list(self._sent.values())
+
+    def load(self, state):
+        for doc in state:
+            target = self._queued if doc["status"] == "queued" else self._sent
+            target[doc["recipient_id"]] = doc
+
+
+# ------------------- REPORTS -------------------
+class MemoryReports(_Namespace):
+    name = "reports"
+    OPEN_STATUSES = OPEN_STATUSES
+    QUEUE_PAGE_SIZE = QUEUE_PAGE_SIZE
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._docs = {}  # _id -> report
+        self._open = []  # sorted (created_at, _id) of open reports
+        self._open_by_target = {}  # target_id -> sorted (created_at, _id) of its open reports
+        self._summaries = {}  # "YYYY-MM" -> {"total": n, "by_status": {status: n}}
+
+    def _set_open(self, doc, is_open):
+        key = (doc["created_at"], doc["_id"])
+        target = self._open_by_target.setdefault(doc["target_id"], [])
+        if is_open:
+            insort(self._open, key)
+            insort(target, key)
+        else:
+            del self._open[bisect_left(self._open, key)]
+            del target[bisect_left(target, key)]
+            if not target:
+                del self._open_by_target[doc["target_id"]]
+
+    def _set_status(self, doc, fields):
+        was_open = doc.get("status") in OPEN_STATUSES
+        doc.update(_clone(fields))
+        is_open = doc.get("status") in OPEN_STATUSES
+        if was_open != is_open:
+            self._set_open(doc, is_open)
+
+    def _op_insert_report(self, doc):
+        doc = _clone(doc)
+        # BSON dates hold milliseconds; queue cursors are encoded at that precision too
+        created_at = doc["created_at"]
+        doc["created_at"] = created_at.replace(microsecond=created_at.microsecond // 1000 * 1000)
+        self._docs[doc["_id"]] = doc
+        if doc.get("status") in OPEN_STATUSES:
+            self._set_open(doc, True)
+
+    def _op_set_report_fields(self, report_oid, fields):
+        doc = self._docs.get(report_oid)
+        if doc is not None:
+            self._set_status(doc, fields)
+
+    def _op_resolve_target(self, target_id, status, reviewer_id, now):
+        keys = list(self._open_by_target.get(target_id, ()))
+        for _, oid in keys:
+            self._set_status(self._docs[oid], {"status": status, "reviewed_by": reviewer_id, "reviewed_at": now})
+        return len(keys)
+
+    def _op_archive_closed_reports(self, created_before):
+        archived = [
+            doc for doc in self._docs.values()
+            if doc.get("status") not in OPEN_STATUSES and doc["created_at"] < created_before
+        ]
+        for doc in archived:
+            summary = self._summaries.setdefault(f"{doc['created_at']:%Y-%m}", {"total": 0, "by_status": {}})
+            summary["total"] += 1
+            summary["by_status"][doc["status"]] = summary["by_status"].get(doc["status"], 0) + 1
+            del self._docs[doc["_id"]]
+        return len(archived)
+
+    async def find_open_report(self, target_id, reporter_id):
+        for _, oid in self._open_by_target.get(target_id, ()):
+            if self._docs[oid]["reporter_id"] == reporter_id:
+                return _clone(self._docs[oid])
+        return None
+
+    async def insert_report(self, doc):
+        doc.setdefault("_id", ObjectId())
+        self._write("insert_report", doc)
+        return str(doc["_id"])
+
+    async def set_report_fields(self, report_oid, fields):
+        self._write("set_report_fields", report_oid, fields)
+
+    async def open_queue_page(self, after=None, limit=QUEUE_PAGE_SIZE):
+        """
+        Same contract as data.reports.open_queue_page: a target is listed at
+        the position of its oldest open report.
+        """
+        rows = []
+        start = bisect_right(self._open, tuple(after)) if after else 0
+        for created_at, oid in self._open[start:]:
+            target_id = self._docs[oid]["target_id"]
+            reports = self._open_by_target[target_id]
+            if reports[0][1] != oid:
+                continue
+            rows.append({"target_id": target_id, "count": len(reports), "first_at": created_at})
+            if len(rows) == limit:
+                return rows, (created_at, oid)
+        return rows, None
+
+    async def resolve_target(self, target_id, status, reviewer_id, now):
+        return self._write("resolve_target", target_id, status, reviewer_id, now)
+
+    async def archive_closed_reports(self, created_before):
+        return self._write("archive_closed_reports", created_before)
+
+    def dump(self):
+        return {"reports": list(self._docs.values()), "summaries": self._summaries}
+
+    def load(self, state):
+        for doc in state["reports"]:
+            self._op_insert_report(doc)
+        self._summaries.update(state["summaries"])
+
+
+# ------------------- DECKS -------------------
+class MemoryDecks(_Namespace):
+    """
+    Per-viewer candidate decks. Not logged: an empty deck is rebuilt by
+    find_match, so losing them on restart costs one sampling pass per viewer.
+    """
+    name = "decks"
+    DECK_SIZE = DECK_SIZE
+    DECK_REFILL_AT = DECK_REFILL_AT
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._decks = {}  # viewer_id -> {"ids": [...], "interested_in": str}
+
+    async def pop_next(self, viewer_id):
+        deck = self._decks.get(viewer_id)
+        if deck is None:
+            return None
+        ids = deck["ids"]
+        candidate_id = ids.pop(0) if ids else None
+        return candidate_id, len(ids), deck["interested_in"]
+
+    async def build_deck(self, viewer_id, interested_in, exclude_ids):
+        ids = await self._engine.users.sample_candidate_ids(viewer_id, interested_in, exclude_ids, DECK_SIZE)
+        self._decks[viewer_id] = {"ids": list(ids), "interested_in": interested_in}
+        return ids
+
+    async def refill_deck(self, viewer_id, exclude_ids):
+        deck = self._decks.get(viewer_id)
+        if deck is None:
+            return 0
+        want = DECK_SIZE - len(deck["ids"])
+        if want <= 0:
+            return 0
+        ids = await self._engine.users.sample_candidate_ids(viewer_id, deck["interested_in"], [*exclude_ids, *deck["ids"]], want)
+        deck["ids"].extend(ids)
+        return len(ids)
+
+    async def discard_deck(self, viewer_id):
+        self._decks.pop(viewer_id, None)
+
+
+# ------------------- BROADCASTS -------------------
+class MemoryBroadcasts(_Namespace):
+    name = "broadcasts"
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._jobs = {}  # _id -> job
+
+    def _op_create_job(self, doc):
+        self._jobs[doc["_id"]] = _clone(doc)
+
+    def _op_record_batch(self, job_id, cursor, sent, failed, blocked):
+        job = self._jobs[job_id]
+        job["cursor"] = cursor
+        job["sent"] += sent
+        job["failed"] += failed
+        job["blocked"] += blocked
+        return _clone(job)
+
+    def _op_set_job_fields(self, job_id, fields):
+        if job_id in self._jobs:
+            self._jobs[job_id].update(_clone(fields))
+
+    async def create_job(self, text, report_chat_id, total):
+        doc = {
+            "_id": ObjectId(),
+            "text": text,
+            "status": "running",
+            "cursor": None,
+            "sent": 0,
+            "failed": 0,
+            "blocked": 0,
+            "total": total,
+            "report_chat_id": report_chat_id,
+            "report_message_id": None,
+            "created_at": datetime.utcnow(),
+            "finished_at": None,
+        }
+        self._write("create_job", doc)
+        return doc
+
+    async def running_jobs(self):
+        return [_clone(job) for job in self._jobs.values() if job["status"] == "running"]
+
+    async def count_recipients(self):
+        return len(self._engine.users._ids)
+
+    async def next_recipients(self, cursor, batch_size):
+        ids = self._engine.users._ids
+        start = bisect_right(ids, cursor) if cursor is not None else 0
+        return ids[start:start + batch_size]
+
+    async def record_batch(self, job_id, cursor, sent, failed, blocked):
+        return self._write("record_batch", job_id, cursor, sent, failed, blocked)
+
+    async def set_job_fields(self, job_id, fields):
+        self._write("set_job_fields", job_id, fields)
+
+    def dump(self):
+        return list(self._jobs.values())
+
+    def load(self, state):
+        for doc in state:
+            self._op_create_job(doc)
+
+
+# ------------------- ENGINE -------------------
+class MemoryEngine:
+    """
+    Holds every namespace and, with log_path, the append-only write log.
+    """
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._log = None
+        self.users = MemoryUsers(self)
+        self.edges = MemoryEdges(self)
+        self.notifications = MemoryNotifications(self)
+        self.reports = MemoryReports(self)
+        self.decks = MemoryDecks(self)
+        self.broadcasts = MemoryBroadcasts(self)
+        self._namespaces = {ns.name: ns for ns in (self.users, self.edges, self.notifications, self.reports, self.broadcasts)}
+
+    def write(self, namespace, op, args):
+        result = getattr(self._namespaces[namespace], f"_op_{op}")(*args)
+        if self._log is not None:
+            # logged after it applied, so a failed write is never replayed
+            self._log.write(json_util.dumps([namespace, op, list(args)], json_options=LOG_OPTIONS) + "\n")
+            self._log.flush()
+        return result
+
+    def open(self):
+        """
+        Replay the log (if any), compact it into one snapshot line and keep
+        it open for appending.
+        """
+        if not self.log_path:
+            return
+        replayed = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, encoding="utf-8") as f:
+                for lineno, line in enumerate(f, 1):
+                    try:
+                        namespace, op, args = json_util.loads(line, json_options=LOG_OPTIONS)
+                    except ValueError:
+                        # a write cut short by a crash; everything before it is intact
+                        logger.warning("Skipping unreadable line %s of %s", lineno, self.log_path)
+                        continue
+                    if namespace == "snapshot":
+                        for name, state in args[0].items():
+                            self._namespaces[name].load(state)
+                    else:
+                        getattr(self._namespaces[namespace], f"_op_{op}")(*args)
+                    replayed += 1
+        self._compact()
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        logger.info("In-memory storage loaded %s log entries from %s (%s users)", replayed, self.log_path, len(self.users._docs))
+
+    def _compact(self):
+        snapshot = {name: ns.dump() for name, ns in self._namespaces.items()}
+        tmp_path = f"{self.log_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(["snapshot", None, [snapshot]], json_options=LOG_OPTIONS) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.log_path)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,226 @@
+"""
+Like-notification repository. Each document is a per-recipient digest of
+"someone liked you" notices moving through queued -> sent -> responded | cancelled.
+
+A recipient has at most one queued digest: new likes are folded into it
+(capped liker_ids, running count) instead of adding a row per like, so storage
+and delivery cost stay O(1) per recipient however popular they are.
+
+Every state transition is a single atomic update. Partial unique indexes
+(see data/indexes.py) allow at most one queued and one 'sent' digest per
+recipient, so two concurrent claims can never both deliver.
+
+Terminal transitions stamp closed_at; a TTL index on it deletes closed
+digests once the configured retention has passed.
+"""
+from datetime import datetime
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from data import db
+
+DIGEST_CAP = 10  # liker ids kept per digest; count keeps going past it
+
+
+async def add_like(recipient_id, liker_id, now):
+    """
+    Fold a like into the recipient's queued digest, creating it if needed.
+    Returns the digest id as a string.
+    """
+    update = {
+        "$push": {"liker_ids": {"$each": [liker_id], "$slice": -DIGEST_CAP}},
+        "$inc": {"count": 1},
+        "$set": {"updated_at": now},
+        "$setOnInsert": {"created_at": now, "sent_at": None, "response": None},
+    }
+    for attempt in range(2):
+        try:
+            doc = await db.like_notifications.find_one_and_update(
+                {"recipient_id": recipient_id, "status": "queued"},
+                update,
+                projection={"_id": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return str(doc["_id"])
+        except DuplicateKeyError:
+            # a concurrent like created the digest first; the retry folds into it
+            if attempt:
+                raise
+
+
+async def latest_sent(recipient_id):
+    return await db.like_notifications.find_one({
+        "recipient_id": recipient_id,
+        "status": "sent",
+    }, sort=[("sent_at", -1)])
+
+
+async def expire_sent(recipient_id, sent_before, now):
+    """
+    Cancel the recipient's unresponded notifications sent before `sent_before`.
+    """
+    await db.like_notifications.update_many(
+        {"recipient_id": recipient_id, "status": "sent", "sent_at": {"$lt": sent_before}},
+        {"$set": {"status": "cancelled", "closed_at": now}}
+    )
+
+
+async def claim_next(recipient_id, now):
+    """
+    Atomically move the recipient's newest queued notification to 'sent'.
+    Returns (doc, busy): doc is the claimed notification or None when nothing is
+    queued; busy is True when another notification is still awaiting a response.
+    """
+    try:
+        doc = await db.like_notifications.find_one_and_update(
+            {"recipient_id": recipient_id, "status": "queued"},
+            {"$set": {"status": "sent", "sent_at": now}},
+            sort=[("created_at", -1)],
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return None, True
+    return doc, False
+
+
+async def release_claim(notification_id, now):
+    """
+    Put a claimed notification back in the queue after a failed send. If a
+    like arrived meanwhile and opened a new queued digest, the failed one is
+    folded into that digest (its likers ahead of the newer ones) and closed.
+    """
+    try:
+        await db.like_notifications.update_one(
+            {"_id": notification_id, "status": "sent"},
+            {"$set": {"status": "queued", "sent_at": None}}
+        )
+        return
+    except DuplicateKeyError:
+        pass
+    failed = await db.like_notifications.find_one_and_update(
+        {"_id": notification_id, "status": "sent"},
+        {"$set": {"status": "cancelled", "closed_at": now}},
+        projection={"recipient_id": 1, "liker_ids": 1, "count": 1, "created_at": 1, "updated_at": 1}
+    )
+    if not failed:
+        return
+    liker_ids = failed.get("liker_ids") or []
+    update = {
+        "$push": {"liker_ids": {"$each": liker_ids, "$position": 0, "$slice": -DIGEST_CAP}},
+        "$inc": {"count": failed.get("count") or len(liker_ids)},
+        "$min": {"created_at": failed.get("created_at") or now},
+        "$max": {"updated_at": failed.get("updated_at") or now},
+        "$setOnInsert": {"sent_at": None, "response": None},
+    }
+    for attempt in range(2):
+        try:
+            # upsert: the queued digest may have been claimed since the first attempt
+            await db.like_notifications.update_one(
+                {"recipient_id": failed["recipient_id"], "status": "queued"},
+                update,
+                upsert=True
+            )
+            return
+        except DuplicateKeyError:
+            if attempt:
+                raise
+
+
+async def mark_responded(recipient_id, liker_id, response_type, now):
+    query = {"recipient_id": recipient_id, "status": "sent"}
+    if liker_id is not None:
+        query["liker_ids"] = liker_id
+    res = await db.like_notifications.update_many(query, {
+        "$set": {"status": "responded", "response": response_type, "responded_at": now, "closed_at": now}
+    })
+    return res.modified_count
+
+
+async def pending_recipients():
+    """
+    Recipients that still have queued notifications, with the time their most
+    recent notification was sent (None if never). Used to seed the scheduler.
+    """
+    return await db.like_notifications.aggregate([
+        {"$match": {"status": {"$in": ["queued", "sent"]}}},
+        {"$group": {
+            "_id": "$recipient_id",
+            "queued": {"$sum": {"$cond": [{"$eq": ["$status", "queued"]}, 1, 0]}},
+            "last_sent_at": {"$max": "$sent_at"},
+        }},
+        {"$match": {"queued": {"$gt": 0}}},
+    ])
+
+
+async def collapse_legacy_rows():
+    """
+    Fold rows from the old one-row-per-like layout into digests: queued rows
+    become one queued digest per recipient; all other rows get liker_ids/count.
+    Must run before the one-queued-per-recipient index is created.
+    """
+    legacy_queued = {"status": "queued", "liker_id": {"$exists": True}}
+    groups = await db.like_notifications.aggregate([
+        {"$match": legacy_queued},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": "$recipient_id",
+            "liker_ids": {"$push": "$liker_id"},
+            "count": {"$sum": 1},
+            "created_at": {"$min": "$created_at"},
+            "updated_at": {"$max": "$created_at"},
+        }},
+    ])
+    if groups:
+        await db.like_notifications.update_many(legacy_queued, {"$set": {"status": "cancelled", "closed_at": datetime.utcnow()}})
+        for g in groups:
+            await db.like_notifications.update_one(
+                {"recipient_id": g["_id"], "status": "queued", "liker_id": {"$exists": False}},
+                {
+                    "$push": {"liker_ids": {"$each": g["liker_ids"], "$slice": -DIGEST_CAP}},
+                    "$inc": {"count": g["count"]},
+                    "$max": {"updated_at": g["updated_at"]},
+                    "$setOnInsert": {"created_at": g["created_at"], "sent_at": None, "response": None},
+                },
+                upsert=True
+            )
+    await db.like_notifications.update_many(
+        {"liker_id": {"$exists": True}},
+        [{"$set": {"liker_ids": ["$liker_id"], "count": 1}}, {"$unset": "liker_id"}]
+    )
+
+
+async def collapse_duplicate_sent(now):
+    """
+    Keep only the most recently sent digest awaiting a response per recipient
+    and cancel the rest; rows written before claims were atomic can hold
+    several. Must run before the one-sent-per-recipient index is created.
+    Returns the number cancelled.
+    """
+    groups = await db.like_notifications.aggregate([
+        {"$match": {"status": "sent"}},
+        {"$sort": {"sent_at": -1}},
+        {"$group": {"_id": "$recipient_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+    stale = [oid for g in groups for oid in g["ids"][1:]]
+    if not stale:
+        return 0
+    res = await db.like_notifications.update_many(
+        {"_id": {"$in": stale}, "status": "sent"},
+        {"$set": {"status": "cancelled", "closed_at": now}}
+    )
+    return res.modified_count
+
+
+async def backfill_closed_at(now):
+    """
+    Stamp closed_at on terminal rows written before it existed, so the TTL
+    index can expire them. Uses responded_at where known. Returns the count.
+    """
+    res = await db.like_notifications.update_many(
+        {"status": {"$in": ["responded", "cancelled"]}, "closed_at": {"$exists": False}},
+        [{"$set": {"closed_at": {"$ifNull": ["$responded_at", now]}}}]
+    )
+    return res.modified_count
@@ -0,0 +1,151 @@
+"""
+Report repository: user-filed reports and their moderation state.
+
+Closed reports (anything no longer open/pending) are eventually archived:
+rolled up into one report_summaries document per month and deleted.
+"""
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from data import db
+
+OPEN_STATUSES = ["open", "pending"]
+QUEUE_PAGE_SIZE = 5
+
+
+async def find_open_report(target_id, reporter_id):
+    return await db.reports.find_one({
+        "target_id": target_id,
+        "reporter_id": reporter_id,
+        "status": {"$in": OPEN_STATUSES}
+    })
+
+
+async def insert_report(doc):
+    """
+    Persist a report and return its id as a string.
+    """
+    res = await db.reports.insert_one(doc)
+    return str(res.inserted_id)
+
+
+async def set_report_fields(report_oid, fields):
+    await db.reports.update_one({"_id": report_oid}, {"$set": fields})
+
+
+async def open_queue_page(after=None, limit=QUEUE_PAGE_SIZE):
+    """
+    One page of the moderation queue: reported users ordered by their oldest
+    open report, each as {target_id, count, first_at}. `after` is the
+    (created_at, _id) of the previous page's last head report. Returns
+    (rows, next_after); next_after is None on the last page.
+
+    Reports are walked with the status_created_at index from the cursor; a
+    target is listed only on the page holding its oldest open report, so it
+    never shows up twice while paging forward.
+    """
+    rows = []
+    cursor = after
+    batch_size = limit * 4
+    while True:
+        query = {"status": {"$in": OPEN_STATUSES}}
+        if cursor:
+            query["$or"] = [
+                {"created_at": {"$gt": cursor[0]}},
+                {"created_at": cursor[0], "_id": {"$gt": cursor[1]}},
+            ]
+        batch = await db.reports.find(
+            query, {"target_id": 1, "created_at": 1},
+            sort=[("created_at", 1), ("_id", 1)], limit=batch_size
+        )
+        if not batch:
+            return rows, None
+        first_seen = {}
+        for r in batch:
+            first_seen.setdefault(r["target_id"], r)
+        heads = await db.reports.aggregate([
+            {"$match": {"target_id": {"$in": list(first_seen)}, "status": {"$in": OPEN_STATUSES}}},
+            {"$sort": {"created_at": 1, "_id": 1}},
+            {"$group": {"_id": "$target_id", "head": {"$first": "$_id"}, "count": {"$sum": 1}}},
+        ])
+        heads = {h["_id"]: h for h in heads}
+        for target_id, r in first_seen.items():
+            head = heads.get(target_id)
+            if not head or head["head"] != r["_id"]:
+                # listed on an earlier page (or resolved meanwhile)
+                continue
+            rows.append({"target_id": target_id, "count": head["count"], "first_at": r["created_at"]})
+            if len(rows) == limit:
+                return rows, (r["created_at"], r["_id"])
+        if len(batch) < batch_size:
+            return rows, None
+        cursor = (batch[-1]["created_at"], batch[-1]["_id"])
+
+
+async def resolve_target(target_id, status, reviewer_id, now):
+    """
+    Close every open report against target_id in one write. Returns the
+    number of reports closed.
+    """
+    res = await db.reports.update_many(
+        {"target_id": target_id, "status": {"$in": OPEN_STATUSES}},
+        {"$set": {"status": status, "reviewed_by": reviewer_id, "reviewed_at": now}}
+    )
+    return res.modified_count
+
+
+async def _summarise_run(run_id):
+    """
+    Fold the reports tagged with run_id into the monthly summaries. Each
+    summary remembers the runs it has absorbed, so repeating a run after a
+    crash does not count its reports twice.
+    """
+    months = await db.reports.aggregate([
+        {"$match": {"archive_run": run_id}},
+        {"$group": {
+            "_id": {"month": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}}, "status": "$status"},
+            "count": {"$sum": 1},
+        }},
+    ])
+    inc = {}
+    for row in months:
+        month_inc = inc.setdefault(row["_id"]["month"] or "unknown", {"total": 0})
+        month_inc["total"] += row["count"]
+        month_inc[f"by_status.{row['_id']['status']}"] = row["count"]
+    for month, counts in inc.items():
+        try:
+            await db.report_summaries.update_one(
+                {"_id": month, "runs": {"$ne": run_id}},
+                {"$inc": counts, "$addToSet": {"runs": run_id}, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # this run was already applied to the month before a crash
+            pass
+    res = await db.reports.delete_many({"archive_run": run_id})
+    return res.deleted_count
+
+
+async def archive_closed_reports(created_before):
+    """
+    Move closed reports filed before `created_before` into report_summaries
+    and delete them. Also finishes runs a previous process left half done.
+    Returns the number of reports archived.
+    """
+    archived = 0
+    stale = await db.reports.aggregate([
+        {"$match": {"archive_run": {"$exists": True}}},
+        {"$group": {"_id": "$archive_run"}},
+    ])
+    for run in stale:
+        archived += await _summarise_run(run["_id"])
+
+    run_id = ObjectId()
+    await db.reports.update_many(
+        {"status": {"$nin": OPEN_STATUSES}, "created_at": {"$lt": created_before}, "archive_run": {"$exists": False}},
+        {"$set": {"archive_run": run_id}}
+    )
+    archived += await _summarise_run(run_id)
+    return archived
@@ -0,0 +1,69 @@
+"""
+Short-lived conversation state (flags such as "the next message is a
+broadcast", onboarding drafts) behind one small key/value interface.
+
+MemoryStore keeps it in this process; MongoStore keeps it in the
+conversation_state collection so every replica behind the webhook sees the
+same state. Entries expire after their ttl in both.
+"""
+import time
+from datetime import datetime, timedelta
+
+from data import db
+
+
+class MemoryStore:
+    shared = False
+
+    def __init__(self):
+        self._items = {}  # key -> (monotonic expiry, value)
+
+    async def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._items[key]
+            return None
+        return item[1]
+
+    async def set(self, key, value, ttl):
+        self._items[key] = (time.monotonic() + ttl, value)
+        if len(self._items) > 10_000:
+            # opportunistic sweep; entries are small and short-lived
+            now = time.monotonic()
+            self._items = {k: v for k, v in self._items.items() if v[0] >= now}
+
+    async def pop(self, key):
+        value = await self.get(key)
+        self._items.pop(key, None)
+        return value
+
+
+class MongoStore:
+    shared = True
+
+    async def get(self, key):
+        doc = await db.conversation_state.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        return doc["value"] if doc else None
+
+    async def set(self, key, value, ttl):
+        await db.conversation_state.update_one(
+            {"_id": key},
+            {"$set": {"value": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    async def pop(self, key):
+        doc = await db.conversation_state.find_one_and_delete({"_id": key})
+        if not doc or doc["expires_at"] <= datetime.utcnow():
+            return None
+        return doc["value"]
+
+
+store = MemoryStore()
+
+
+def use_mongo():
+    global store
+    store = MongoStore()
@@ -0,0 +1,105 @@
+"""
+Read-only aggregations behind the admin /stats view. Every figure is
+computed inside MongoDB and comes back as a handful of small rows; callers
+cache the result rather than running these per request.
+"""
+from datetime import datetime, timedelta
+
+from data import db
+from data.edges import LIKE
+from data.reports import OPEN_STATUSES
+
+
+async def user_breakdown():
+    """
+    Users per onboarding step, and finished profiles per (gender, interested_in).
+    """
+    docs = await db.users.aggregate([
+        {"$facet": {
+            "steps": [
+                {"$group": {"_id": "$step", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+            ],
+            "split": [
+                {"$match": {"step": "done"}},
+                {"$group": {"_id": {"gender": "$gender", "interested_in": "$interested_in"}, "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+            ],
+        }},
+    ])
+    return docs[0] if docs else {"steps": [], "split": []}
+
+
+async def likes_per_day(since):
+    """
+    Likes and mutual matches per UTC day since `since`. A like counts as a
+    match when the reverse like already existed; the reverse lookup is an
+    indexed point query per like, so cost follows the window, not the graph.
+    """
+    return await db.edges.aggregate([
+        {"$match": {"kind": LIKE, "created_at": {"$gte": since}}},
+        {"$lookup": {
+            "from": "edges",
+            "let": {"liker": "$liker_id", "target": "$target_id", "at": "$created_at"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$liker_id", "$$target"]},
+                    {"$eq": ["$target_id", "$$liker"]},
+                    {"$eq": ["$kind", LIKE]},
+                    {"$lte": ["$created_at", "$$at"]},
+                ]}}},
+                {"$limit": 1},
+                {"$project": {"_id": 1}},
+            ],
+            "as": "reverse",
+        }},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+            "likes": {"$sum": 1},
+            "matches": {"$sum": {"$cond": [{"$gt": [{"$size": "$reverse"}, 0]}, 1, 0]}},
+        }},
+        {"$sort": {"_id": 1}},
+    ])
+
+
+async def notification_outcomes():
+    """
+    Like-notification digests per status and per response, with the number of
+    likes they carried. Closed digests older than the retention window have
+    already expired, so this covers the retention period only.
+    """
+    docs = await db.like_notifications.aggregate([
+        {"$facet": {
+            "status": [{"$group": {"_id": "$status", "digests": {"$sum": 1}, "likes": {"$sum": "$count"}}}],
+            "response": [
+                {"$match": {"status": "responded"}},
+                {"$group": {"_id": "$response", "digests": {"$sum": 1}}},
+            ],
+        }},
+    ])
+    return docs[0] if docs else {"status": [], "response": []}
+
+
+async def open_reports():
+    docs = await db.reports.aggregate([
+        {"$match": {"status": {"$in": OPEN_STATUSES}}},
+        {"$group": {"_id": "$target_id"}},
+        {"$count": "targets"},
+    ])
+    reports = await db.reports.count_documents({"status": {"$in": OPEN_STATUSES}})
+    return {"reports": reports, "targets": docs[0]["targets"] if docs else 0}
+
+
+async def collect(days=7):
+    """
+    All dashboard figures in one dict, stamped with the time they were computed.
+    """
+    now = datetime.utcnow()
+    return {
+        "computed_at": now,
+        "days": days,
+        "users": await user_breakdown(),
+        "likes": await likes_per_day(now - timedelta(days=days)),
+        "notifications": await notification_outcomes(),
+        "reports": await open_reports(),
+    }
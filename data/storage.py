@@ -0,0 +1,61 @@
+"""
+Storage backend selection.
+
+Handlers reach users, edges, like notifications, reports, decks and broadcast
+jobs through the attributes below. They point either at the MongoDB
+repositories (data/users.py and friends) or at the matching namespaces of the
+in-memory engine in data/memory.py, which offer the same coroutines. Call
+use_mongo() or use_memory() once, before the bot starts.
+
+Everything else (stats, index bootstrap, legacy migrations, replica mode's
+shared state and leases) needs MongoDB and is skipped on the memory backend.
+"""
+from data import broadcasts as mongo_broadcasts
+from data import db
+from data import decks as mongo_decks
+from data import edges as mongo_edges
+from data import notifications as mongo_notifications
+from data import reports as mongo_reports
+from data import users as mongo_users
+
+MONGO = "mongo"
+MEMORY = "memory"
+
+backend = None
+users = None
+edges = None
+notifications = None
+reports = None
+decks = None
+broadcasts = None
+_engine = None
+
+
+def use_mongo(uri=None, max_workers=16, profile_cache_ttl=None, event_listeners=None):
+    global backend, users, edges, notifications, reports, decks, broadcasts
+    db.init_db(uri, max_workers=max_workers, event_listeners=event_listeners)
+    if profile_cache_ttl is not None:
+        mongo_users.PROFILE_CACHE_TTL = profile_cache_ttl
+    backend = MONGO
+    users, edges, notifications = mongo_users, mongo_edges, mongo_notifications
+    reports, decks, broadcasts = mongo_reports, mongo_decks, mongo_broadcasts
+
+
+def use_memory(log_path=None):
+    """
+    Serve everything from process memory; with log_path, writes are logged
+    there and replayed on the next start.
+    """
+    global backend, users, edges, notifications, reports, decks, broadcasts, _engine
+    from data.memory import MemoryEngine
+
+    _engine = MemoryEngine(log_path)
+    _engine.open()
+    backend = MEMORY
+    users, edges, notifications = _engine.users, _engine.edges, _engine.notifications
+    reports, decks, broadcasts = _engine.reports, _engine.decks, _engine.broadcasts
+
+
+def close():
+    if _engine is not None:
+        _engine.close()
@@ -0,0 +1,19 @@
+"""
+Processed update ids, shared between replicas. Each id is inserted once;
+a TTL index on seen_at (see data/indexes.py) forgets it after the
+de-duplication window.
+"""
+from pymongo.errors import DuplicateKeyError
+
+from data import db
+
+
+async def claim(update_id, now):
+    """
+    Record update_id as processed. Returns False if it already was.
+    """
+    try:
+        await db.processed_updates.insert_one({"_id": update_id, "seen_at": now})
+    except DuplicateKeyError:
+        return False
+    return True
@@ -0,0 +1,71 @@
+"""
+Write-coalescing cache for Telegram usernames.
+
+Almost every update carries the sender's username, but it rarely changes. An
+LRU of the last known username per user lets note_username() skip unchanged
+values entirely; changed ones are queued and written in one batched write by a
+periodic flush. The hit/miss/flushed counters in `stats` are exported on
+/metrics (see metrics.py).
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from data import storage
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 50_000
+FLUSH_INTERVAL = 5  # seconds
+
+_known = OrderedDict()  # user_id -> last username persisted or queued
+_pending = {}  # user_id -> username waiting for the next flush
+stats = {"hits": 0, "misses": 0, "flushed": 0}
+
+
+def note_username(user_id, username):
+    """
+    Record the username seen on an update; queue a write only if it changed.
+    """
+    if not username:
+        return
+    if _known.get(user_id) == username:
+        _known.move_to_end(user_id)
+        stats["hits"] += 1
+        return
+    stats["misses"] += 1
+    _known[user_id] = username
+    _known.move_to_end(user_id)
+    if len(_known) > CACHE_SIZE:
+        _known.popitem(last=False)
+    _pending[user_id] = username
+
+
+async def flush():
+    """
+    Write all queued username changes in one batched write. Returns how many were written.
+    """
+    if not _pending:
+        return 0
+    batch = dict(_pending)
+    _pending.clear()
+    try:
+        await storage.users.set_fields_many({uid: {"tg_username": name} for uid, name in batch.items()})
+    except Exception:
+        # requeue whatever a newer note_username() hasn't superseded
+        for uid, name in batch.items():
+            _pending.setdefault(uid, name)
+        raise
+    stats["flushed"] += len(batch)
+    return len(batch)
+
+
+async def run_flusher(interval=FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            written = await flush()
+            if written:
+                logger.debug("Flushed %s username changes (stats=%s)", written, stats)
+        except Exception:
+            logger.exception("Failed to flush username changes")
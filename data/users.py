@@ -0,0 +1,243 @@
+"""
+User profile repository. Handlers read and write user documents only through
+these coroutines, never through the collection directly.
+
+Profiles are served from a bounded, TTL'd cache-aside cache keyed by user_id.
+Every write below updates or invalidates the cached entry, so a reader never
+sees a profile older than the last write made through this module.
+"""
+import time
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+
+from data import db
+
+PROFILE_CACHE_SIZE = 10_000
+PROFILE_CACHE_TTL = 60  # seconds; bounds staleness from writes made elsewhere
+
+_profiles = OrderedDict()  # user_id -> (expires_at, doc)
+_reads_in_flight = {}  # user_id -> number of cache-miss reads awaiting Mongo
+_raced = set()  # user_ids written while a miss was in flight; that read must not be cached
+cache_stats = {"hits": 0, "misses": 0}
+
+
+def _cache_get(user_id):
+    entry = _profiles.get(user_id)
+    if entry is None:
+        return None
+    expires_at, doc = entry
+    if expires_at < time.monotonic():
+        del _profiles[user_id]
+        return None
+    _profiles.move_to_end(user_id)
+    return doc
+
+
+def _begin_reads(user_ids):
+    for uid in user_ids:
+        _reads_in_flight[uid] = _reads_in_flight.get(uid, 0) + 1
+
+
+def _end_reads(user_ids, docs):
+    for doc in docs:
+        if doc["user_id"] not in _raced:
+            _cache_put(doc)
+    for uid in user_ids:
+        left = _reads_in_flight.pop(uid) - 1
+        if left:
+            _reads_in_flight[uid] = left
+        else:
+            _raced.discard(uid)
+
+
+def _cache_put(doc):
+    _profiles[doc["user_id"]] = (time.monotonic() + PROFILE_CACHE_TTL, doc)
+    _profiles.move_to_end(doc["user_id"])
+    if len(_profiles) > PROFILE_CACHE_SIZE:
+        _profiles.popitem(last=False)
+
+
+def _project(doc, projection):
+    if projection is None:
+        return dict(doc)
+    keep = {k for k, v in projection.items() if v}
+    if projection.get("_id", 1):
+        keep.add("_id")
+    return {k: v for k, v in doc.items() if k in keep}
+
+
+def invalidate(*user_ids):
+    for uid in user_ids:
+        _profiles.pop(uid, None)
+        if uid in _reads_in_flight:
+            _raced.add(uid)
+
+
+def invalidate_all():
+    _profiles.clear()
+    _raced.update(_reads_in_flight)
+
+
+def refresh_cached_fields(user_id, fields):
+    """
+    Apply already-persisted field values to the cached profile, if any.
+    """
+    doc = _cache_get(user_id)
+    if doc is not None:
+        doc.update(fields)
+    if user_id in _reads_in_flight:
+        _raced.add(user_id)
+
+
+async def get_user(user_id, projection=None):
+    doc = _cache_get(user_id)
+    if doc is not None:
+        cache_stats["hits"] += 1
+        return _project(doc, projection)
+    cache_stats["misses"] += 1
+    _begin_reads([user_id])
+    doc = None
+    try:
+        doc = await db.users.find_one({"user_id": user_id})
+    finally:
+        _end_reads([user_id], [doc] if doc else [])
+    return _project(doc, projection) if doc else None
+
+
+async def get_users(user_ids, projection=None):
+    """
+    Load several users, fetching cache misses in one round trip. Returns
+    {user_id: doc} for those found.
+    """
+    found = {}
+    missing = []
+    for uid in user_ids:
+        doc = _cache_get(uid)
+        if doc is None:
+            missing.append(uid)
+        else:
+            found[uid] = doc
+    cache_stats["hits"] += len(found)
+    if missing:
+        cache_stats["misses"] += len(missing)
+        _begin_reads(missing)
+        docs = []
+        try:
+            docs = await db.users.find({"user_id": {"$in": missing}})
+        finally:
+            _end_reads(missing, docs)
+        for doc in docs:
+            found[doc["user_id"]] = doc
+    return {uid: _project(doc, projection) for uid, doc in found.items()}
+
+
+async def create_user(doc):
+    await db.users.insert_one(doc)
+    invalidate(doc["user_id"])
+
+
+async def set_fields(user_id, fields):
+    await db.users.update_one({"user_id": user_id}, {"$set": fields})
+    refresh_cached_fields(user_id, fields)
+
+
+async def update_user(user_id, update):
+    await db.users.update_one({"user_id": user_id}, update)
+    # arbitrary operators: drop the entry rather than re-implement them here
+    invalidate(user_id)
+
+
+async def set_fields_many(fields_by_user, unfinished_only=False):
+    """
+    Set fields on many users in one bulk_write ({user_id: fields}). With
+    unfinished_only, profiles already at step "done" are left alone.
+    """
+    if not fields_by_user:
+        return
+    guard = {"step": {"$ne": "done"}} if unfinished_only else {}
+    ops = [UpdateOne({"user_id": uid, **guard}, {"$set": fields}) for uid, fields in fields_by_user.items()]
+    await db.users.bulk_write(ops, ordered=False)
+    for uid, fields in fields_by_user.items():
+        if unfinished_only:
+            # the guard may have skipped it; don't guess what was written
+            invalidate(uid)
+        else:
+            refresh_cached_fields(uid, fields)
+
+
+async def add_likes_received(user_id, n=1):
+    """
+    Bump the materialized like counter the leaderboard sorts on.
+    """
+    await db.users.update_one({"user_id": user_id}, {"$inc": {"likes_received": n}})
+    cached = _cache_get(user_id)
+    refresh_cached_fields(user_id, {"likes_received": (cached or {}).get("likes_received", 0) + n})
+
+
+async def top_by_likes(gender, limit=10):
+    """
+    Most-liked finished, unbanned profiles of one gender. Walks the
+    step_gender_likes index from the top, so cost is O(limit), not O(users).
+    """
+    return await db.users.find(
+        {"step": "done", "gender": gender, "banned": {"$ne": True}},
+        {"_id": 0, "name": 1, "department": 1, "year": 1, "likes_received": 1},
+        sort=[("likes_received", -1)],
+        limit=limit
+    )
+
+
+# Fields the match caption and keyboard need; photos is trimmed to the last one.
+CANDIDATE_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    "name": 1,
+    "age": 1,
+    "department": 1,
+    "year": 1,
+    "bio": 1,
+    "photos": {"$slice": ["$photos", -1]},
+}
+
+
+def _candidate_match(viewer_id, interested_in, exclude_ids=()):
+    match = {
+        "user_id": {"$nin": [viewer_id, *exclude_ids]},
+        "step": "done",
+        "banned": {"$ne": True},
+    }
+    if interested_in and interested_in != "both":
+        match["gender"] = interested_in
+    else:
+        match["gender"] = {"$in": ["male", "female"]}
+    return match
+
+
+async def sample_candidate_ids(viewer_id, interested_in, exclude_ids, size):
+    """
+    Return up to `size` random ids of finished, unbanned profiles matching the
+    viewer's interest and not in exclude_ids. Filtering and shuffling both run
+    inside MongoDB; only the ids come back.
+    """
+    docs = await db.users.aggregate([
+        {"$match": _candidate_match(viewer_id, interested_in, exclude_ids)},
+        {"$sample": {"size": size}},
+        {"$project": {"_id": 0, "user_id": 1}},
+    ])
+    return [d["user_id"] for d in docs]
+
+
+async def get_candidate(candidate_id, viewer_id, interested_in):
+    """
+    Load the caption fields of candidate_id, or None if that profile is no
+    longer eligible for the viewer (banned, unfinished, wrong gender).
+    """
+    match = _candidate_match(viewer_id, interested_in)
+    match["user_id"] = candidate_id
+    docs = await db.users.aggregate([
+        {"$match": match},
+        {"$limit": 1},
+        {"$project": CANDIDATE_PROJECTION},
+    ])
+    return docs[0] if docs else None
@@ -0,0 +1,68 @@
+"""
+Update de-duplication.
+
+Telegram re-delivers a webhook update when it does not get a timely answer,
+so the same update_id can arrive twice. A group -1 handler asks
+is_duplicate() before any other handler runs: ids seen within the window are
+dropped. The local check is a bounded, time-windowed set; with a shared store
+enabled, the first replica to insert an id into the processed_updates TTL
+collection wins and every other copy is dropped.
+"""
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from data import updates as update_repo
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 900  # seconds an update_id is remembered
+MAX_IDS = 100_000
+
+
+class UpdateDeduplicator:
+    def __init__(self, window=WINDOW, max_ids=MAX_IDS, shared=False):
+        self.window = window
+        self.max_ids = max_ids
+        self.shared = shared
+        self._seen = OrderedDict()  # update_id -> monotonic time first seen, oldest first
+        self.stats = {"dropped": 0, "passed": 0}
+
+    def _expire(self, now):
+        while self._seen:
+            update_id, seen_at = next(iter(self._seen.items()))
+            if seen_at > now - self.window and len(self._seen) <= self.max_ids:
+                break
+            self._seen.popitem(last=False)
+
+    def seen_locally(self, update_id):
+        """
+        Record update_id; True if it was already seen within the window.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        if update_id in self._seen:
+            return True
+        self._seen[update_id] = now
+        return False
+
+    async def is_duplicate(self, update_id):
+        if self.seen_locally(update_id):
+            self.stats["dropped"] += 1
+            return True
+        if self.shared:
+            try:
+                if not await update_repo.claim(update_id, datetime.utcnow()):
+                    self.stats["dropped"] += 1
+                    return True
+            except PyMongoError:
+                # better to risk a duplicate than to drop a real update
+                logger.exception("Shared update de-duplication failed for %s", update_id)
+        self.stats["passed"] += 1
+        return False
+
+
+deduplicator = UpdateDeduplicator()
@@ -0,0 +1,77 @@
+"""
+Leader election for multi-replica deployments.
+
+Every replica sends a heartbeat (used to split the global send rate between
+live replicas) and competes for one lease document. The holder runs the
+background jobs and renews the lease every LEASE_TTL / 3 seconds. A
+replica that fails to renew, including when Mongo is unreachable, cancels its jobs at once,
+well before the lease can expire and be taken over.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from data import leases as lease_repo
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "background-jobs"
+LEASE_TTL = 30  # seconds
+
+
+class Leader:
+    def __init__(self, jobs, lease_ttl=LEASE_TTL, on_replica_count=None):
+        """
+        jobs: coroutine functions to run while this replica holds the lease.
+        on_replica_count: called with the number of live replicas after each heartbeat.
+        """
+        self.replica_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_ttl = lease_ttl
+        self.is_leader = False
+        self._jobs = jobs
+        self._on_replica_count = on_replica_count
+        self._tasks = []
+
+    def _start_jobs(self):
+        logger.info("Replica %s is now the leader", self.replica_id)
+        self.is_leader = True
+        self._tasks = [asyncio.create_task(job()) for job in self._jobs]
+
+    async def _stop_jobs(self):
+        self.is_leader = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run(self):
+        while True:
+            try:
+                live = await lease_repo.heartbeat(self.replica_id, self.lease_ttl)
+                if self._on_replica_count:
+                    self._on_replica_count(live)
+                held = await lease_repo.acquire(LEASE_NAME, self.replica_id, self.lease_ttl)
+            except Exception:
+                logger.exception("Lease renewal failed for replica %s", self.replica_id)
+                held = False
+            if held and not self.is_leader:
+                self._start_jobs()
+            elif not held and self.is_leader:
+                logger.warning("Replica %s lost the lease; stopping background jobs", self.replica_id)
+                await self._stop_jobs()
+            await asyncio.sleep(self.lease_ttl / 3)
+
+    async def stop(self):
+        """
+        Stop jobs and hand the lease over immediately instead of letting it expire.
+        """
+        was_leader = self.is_leader
+        await self._stop_jobs()
+        try:
+            if was_leader:
+                await lease_repo.release(LEASE_NAME, self.replica_id)
+            await lease_repo.forget_replica(self.replica_id)
+        except Exception:
+            logger.exception("Failed to release the lease for replica %s", self.replica_id)
@@ -1,19 +1,39 @@
+import asyncio
 import logging
-import random
 import os
+import signal
 import sys
+import time
 from datetime import datetime, timedelta
+from functools import partial
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    CallbackQueryHandler, ContextTypes
+    CallbackQueryHandler, ContextTypes, TypeHandler, ApplicationHandlerStop
 )
-from pymongo import MongoClient
 from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from bson.objectid import ObjectId
 from aiohttp import web
 
+import broadcast
+import dedup
+import leader
+import maintenance
+import metrics
+import ratelimit
+import update_processor
+from outbox import outbox, INTERACTIVE, NOTIFICATION
+from scheduler import DeliveryScheduler
+from data import storage
+from data import indexes
+from data import usernames
+from data import drafts
+from data import state
+from data import stats as stats_repo
+from data.users import PROFILE_CACHE_TTL as DEFAULT_PROFILE_CACHE_TTL
+
 
 load_dotenv()
 
@@ -25,22 +45,68 @@ ADMIN_CHANNEL_ID = int(os.getenv("ADMIN_CHANNEL_ID")) if os.getenv("ADMIN_CHANNE
 WEBHOOK_PATH = "/webhook"
 PORT = int(os.getenv("PORT", 10000))
 BASE_URL = os.getenv("BASE_URL")  # e.g. https://your-app-name.onrender.com
+# "mongo", or "memory" to keep everything in process memory (one small instance, tests,
+# benchmarks); STORAGE_LOG_PATH makes the memory backend survive restarts via an append-only log.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", storage.MONGO).lower()
+STORAGE_LOG_PATH = os.getenv("STORAGE_LOG_PATH")
+# Upper bound on concurrent Mongo calls (size of the executor behind data.db)
+MONGO_MAX_WORKERS = int(os.getenv("MONGO_MAX_WORKERS", 16))
+# Retention: closed like notifications are deleted after this many days (0 keeps them),
+# closed reports older than REPORT_ARCHIVE_DAYS are folded into monthly summaries.
+NOTIFICATION_RETENTION_DAYS = float(os.getenv("NOTIFICATION_RETENTION_DAYS", 30))
+REPORT_ARCHIVE_DAYS = float(os.getenv("REPORT_ARCHIVE_DAYS", 90))
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", 24)) * 3600
+# Several replicas behind one webhook: conversation state, drafts and update de-duplication
+# go through Mongo, the send rate is split between live replicas, and only the replica
+# holding the background-jobs lease runs migrations, maintenance and broadcasts.
+REPLICA_MODE = os.getenv("REPLICA_MODE", "").lower() in ("1", "true", "yes")
+# Profiles cached in one replica do not see writes made by another, so keep them briefly there.
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", 5 if REPLICA_MODE else DEFAULT_PROFILE_CACHE_TTL))
+BROADCAST_PROMPT_TTL = 600  # seconds an admin has to send the broadcast text
+# Telegram re-delivers webhook updates it got no timely answer for; ids are remembered this long.
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", dedup.WINDOW))
+# Also de-duplicate through Mongo, for several replicas behind one webhook.
+UPDATE_DEDUP_SHARED = os.getenv("UPDATE_DEDUP_SHARED", "true" if REPLICA_MODE else "").lower() in ("1", "true", "yes")
+# Updates from different users run in parallel up to this cap; each user's run in order.
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", update_processor.MAX_CONCURRENT_UPDATES))
+STATS_REFRESH_INTERVAL = int(os.getenv("STATS_REFRESH_INTERVAL", 300))  # seconds
+# /metrics is served next to the webhook; when set, scrapers must send "Authorization: Bearer <token>".
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+STATS_DAYS = 7
 
 if not BOT_TOKEN:
     print("ERROR: BOT_TOKEN is not set in environment.")
     sys.exit(1)
 
-client = MongoClient(MONGO_URI) if MONGO_URI else MongoClient()
-db = client["unimatch_bot2"]
-users_collection = db["users"]
-reports_collection = db["reports"]  # new collection to persist reports
-like_notifications_collection = db["like_notifications"]  # new collection to queue and manage like notifications
+if STORAGE_BACKEND == storage.MEMORY and (REPLICA_MODE or UPDATE_DEDUP_SHARED):
+    print("ERROR: REPLICA_MODE and UPDATE_DEDUP_SHARED need STORAGE_BACKEND=mongo.")
+    sys.exit(1)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+if STORAGE_BACKEND == storage.MEMORY:
+    storage.use_memory(STORAGE_LOG_PATH)
+else:
+    storage.use_mongo(
+        MONGO_URI,
+        max_workers=MONGO_MAX_WORKERS,
+        profile_cache_ttl=PROFILE_CACHE_TTL,
+        event_listeners=[metrics.MongoCommandListener()],
+    )
+
+user_repo = storage.users
+report_repo = storage.reports
+notification_repo = storage.notifications
+deck_repo = storage.decks
+edge_repo = storage.edges
+
 # Minimum gap between "someone liked you" notifications if user didn't respond
 NOTIFICATION_MIN_GAP = timedelta(minutes=30)
+# How long to wait before retrying a notification whose delivery failed
+NOTIFICATION_RETRY_DELAY = timedelta(minutes=5)
+# Most admirers offered as buttons in one digest notification
+DIGEST_BUTTONS = 5
 
 # ------------------- UTILITIES -------------------
 async def safe_edit_or_send_callback(query, text, reply_markup=None, parse_mode=None):
@@ -74,9 +140,6 @@ def ensure_user_doc(doc):
         "interested_in": None,
         "bio": None,
         "photos": [],
-        "likes": [],
-        "liked_by": [],
-        "passed": [],
         "step": "awaiting_name",
     }
     if doc is None:
@@ -87,110 +150,133 @@ def ensure_user_doc(doc):
     return doc
 
 # Helper to keep Telegram username in DB up-to-date.
+# Unchanged usernames are absorbed by the cache; changes are batched and flushed in the background.
 def upsert_tg_username(user_id, username):
-    if username:
-        try:
-            users_collection.update_one({"user_id": user_id}, {"$set": {"tg_username": username}})
-        except Exception:
-            logger.exception("Failed to upsert tg_username for user %s", user_id)
+    usernames.note_username(user_id, username)
 
 
 # ------------------- LIKE NOTIFICATION QUEUE HELPERS -------------------
 def _get_current_utc():
     return datetime.utcnow()
 
-def _has_recent_unresponded_sent(recipient_id):
+
+async def _deliver_scheduled(recipient_id):
+    await try_deliver_next_notification(recipient_id, None)
+
+
+# Wakes up when a recipient's gap ends so queued notifications don't wait for the next like/response
+notification_scheduler = DeliveryScheduler(_deliver_scheduled, _get_current_utc)
+
+
+async def seed_notification_scheduler():
     """
-    Return True if there exists a 'sent' notification for recipient that was sent within NOTIFICATION_MIN_GAP and is still awaiting response.
+    Schedule every recipient that still has queued notifications (run once at startup).
     """
-    recent = like_notifications_collection.find_one({
-        "recipient_id": recipient_id,
-        "status": "sent",
-    }, sort=[("sent_at", -1)])
-    if not recent:
-        return False
-    sent_at = recent.get("sent_at")
-    if not sent_at:
-        return False
-    return (_get_current_utc() - sent_at) < NOTIFICATION_MIN_GAP
+    for r in await notification_repo.pending_recipients():
+        last_sent_at = r.get("last_sent_at")
+        due_at = last_sent_at + NOTIFICATION_MIN_GAP if last_sent_at else _get_current_utc()
+        notification_scheduler.schedule(r["_id"], due_at)
+    logger.info("Notification scheduler seeded with %s recipients", len(notification_scheduler))
 
 
-def queue_like_notification(liker_id, recipient_id):
+async def queue_like_notification(liker_id, recipient_id):
     """
-    Persist a like notification in the queue. Return the inserted doc id (string).
+    Add a like to the recipient's queued notification digest. Return the digest id (string).
     """
-    doc = {
-        "recipient_id": recipient_id,
-        "liker_id": liker_id,
-        "created_at": _get_current_utc(),
-        "sent_at": None,
-        "status": "queued",  # queued | sent | responded | cancelled
-        "response": None,  # store action like 'viewed','ignored','liked_back'
-    }
     try:
-        res = like_notifications_collection.insert_one(doc)
-        return str(res.inserted_id)
+        return await notification_repo.add_like(recipient_id, liker_id, _get_current_utc())
     except Exception:
         logger.exception("Failed to insert like notification for recipient %s from liker %s", recipient_id, liker_id)
         return None
 
 
+_releasing = set()  # release tasks of failed notification sends, referenced until they finish
+
+
+async def _release_notification(recipient_id, notification_id):
+    # put it back in the queue and retry later; the retry is scheduled even if the release fails
+    try:
+        await notification_repo.release_claim(notification_id, _get_current_utc())
+    except Exception:
+        logger.exception("Failed to requeue like notification %s for recipient %s", str(notification_id), recipient_id)
+    finally:
+        notification_scheduler.schedule(recipient_id, _get_current_utc() + NOTIFICATION_RETRY_DELAY)
+
+
+def _notification_settled(recipient_id, notification_id, delivery):
+    """
+    Done-callback of an outbox send started by try_deliver_next_notification.
+    """
+    error = None if delivery.cancelled() else delivery.exception()
+    if not delivery.cancelled() and error is None:
+        logger.info("Delivered like notification %s to recipient %s", str(notification_id), recipient_id)
+        return
+    logger.error("Failed to deliver like notification %s to recipient %s", str(notification_id), recipient_id, exc_info=error)
+    task = asyncio.create_task(_release_notification(recipient_id, notification_id))
+    _releasing.add(task)
+    task.add_done_callback(_releasing.discard)
+
+
 async def try_deliver_next_notification(recipient_id, context: ContextTypes.DEFAULT_TYPE):
     """
-    If recipient has no current 'sent' (awaiting-response) notification and there are queued notifications,
-    deliver the latest queued one immediately. Returns True if a notification was sent.
+    If recipient has no 'sent' (awaiting-response) notification from within NOTIFICATION_MIN_GAP and there are
+    queued notifications, hand the latest queued one to the outbox. Returns True if one was queued for sending;
+    a failed send puts it back in the queue and schedules a retry.
     """
-    # If there is currently an unresponded sent notification within the gap, do not deliver more
-    if _has_recent_unresponded_sent(recipient_id):
+    now = _get_current_utc()
+    # Unresponded notifications older than the gap no longer hold back delivery; cancel them
+    await notification_repo.expire_sent(recipient_id, now - NOTIFICATION_MIN_GAP, now)
+
+    # claim the recipient's queued digest atomically
+    queued, busy = await notification_repo.claim_next(recipient_id, now)
+    if busy:
+        # a notification sent within the gap is still awaiting response; come back when the gap ends
         logger.debug("Recipient %s has recent unresponded sent notification; skipping delivery", recipient_id)
+        recent = await notification_repo.latest_sent(recipient_id)
+        notification_scheduler.schedule(recipient_id, ((recent or {}).get("sent_at") or now) + NOTIFICATION_MIN_GAP)
         return False
-
-    # Ensure no 'sent' notifications exist (even older ones) that are awaiting response. We'll treat only status=='sent' as awaiting.
-    existing_sent = like_notifications_collection.find_one({"recipient_id": recipient_id, "status": "sent"})
-    if existing_sent:
-        # if it's old (older than gap), allow new delivery; otherwise skip (but _has_recent_unresponded_sent already checked)
-        sent_at = existing_sent.get("sent_at")
-        if sent_at and (_get_current_utc() - sent_at) < NOTIFICATION_MIN_GAP:
-            logger.debug("Existing sent notification is still in gap window for recipient %s", recipient_id)
-            return False
-        # else we allow sending another; mark the old as cancelled to avoid duplicates
-        try:
-            like_notifications_collection.update_one({"_id": existing_sent["_id"]}, {"$set": {"status": "cancelled"}})
-        except Exception:
-            logger.exception("Failed to cancel old sent notification for recipient %s", recipient_id)
-
-    # pick the latest queued notification (user asked to show latest immediately)
-    queued = like_notifications_collection.find_one({"recipient_id": recipient_id, "status": "queued"}, sort=[("created_at", -1)])
     if not queued:
         logger.debug("No queued notifications for recipient %s", recipient_id)
         return False
 
     # attempt to send
     try:
-        liker_id = queued["liker_id"]
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("👀 Show Profile", callback_data=f"show_liker_{liker_id}"),
-                InlineKeyboardButton("❌ Skip", callback_data="ignore_like")
+        liker_ids = queued.get("liker_ids") or []
+        count = queued.get("count") or len(liker_ids)
+        if count <= 1:
+            text = "💌 Someone expressed interest in you on AAU-LinkUp. Want to see who it is?"
+            keyboard = InlineKeyboardMarkup([
+                [
+                    InlineKeyboardButton("👀 Show Profile", callback_data=f"show_liker_{liker_ids[-1]}"),
+                    InlineKeyboardButton("❌ Skip", callback_data="ignore_like")
+                ]
+            ])
+        else:
+            # digest: one button per recent admirer, newest first
+            text = f"💌 {count} people are interested in you on AAU-LinkUp. Want to see who?"
+            rows = [
+                [InlineKeyboardButton(f"👀 Admirer #{i}", callback_data=f"show_liker_{lid}")]
+                for i, lid in enumerate(reversed(liker_ids[-DIGEST_BUTTONS:]), 1)
             ]
-        ])
-        await context.bot.send_message(
-            chat_id=recipient_id,
-            text="💌 Someone expressed interest in you on AAU-LinkUp. Want to see who it is?",
+            rows.append([InlineKeyboardButton("❌ Skip", callback_data="ignore_like")])
+            keyboard = InlineKeyboardMarkup(rows)
+        # not awaited: the caller (often a liker's tap) must not wait on the recipient's rate limits
+        delivery = outbox.send_message(
+            recipient_id,
+            text,
+            priority=NOTIFICATION,
             reply_markup=keyboard
         )
-        # mark as sent
-        like_notifications_collection.update_one(
-            {"_id": queued["_id"]},
-            {"$set": {"status": "sent", "sent_at": _get_current_utc()}}
-        )
-        logger.info("Delivered like notification %s to recipient %s", str(queued.get("_id")), recipient_id)
-        return True
     except Exception:
-        logger.exception("Failed to deliver queued like notification %s to recipient %s", str(queued.get("_id")), recipient_id)
-        # leave it queued to retry later
+        logger.exception("Failed to queue like notification %s for recipient %s", str(queued.get("_id")), recipient_id)
+        await _release_notification(recipient_id, queued["_id"])
         return False
 
+    delivery.add_done_callback(partial(_notification_settled, recipient_id, queued["_id"]))
+    # if they never respond, the next queued one (if any) goes out once the gap has passed
+    notification_scheduler.schedule(recipient_id, now + NOTIFICATION_MIN_GAP)
+    return True
+
 
 async def handle_new_like_notification(liker_id, recipient_id, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -198,16 +284,12 @@ async def handle_new_like_notification(liker_id, recipient_id, context: ContextT
     unless a recent unresponded notification exists for the recipient.
     """
     # persist notification
-    nid = queue_like_notification(liker_id, recipient_id)
+    nid = await queue_like_notification(liker_id, recipient_id)
     if not nid:
         return
 
-    # If recipient has a currently sent notification within gap and not responded, do not send now.
-    if _has_recent_unresponded_sent(recipient_id):
-        logger.debug("Queued notification %s for recipient %s due to recent sent", nid, recipient_id)
-        return
-
-    # Otherwise, try to deliver immediately
+    # Try to deliver immediately. If the recipient has a sent notification within the gap that they
+    # haven't responded to, this leaves it queued and schedules delivery for when the gap ends.
     await try_deliver_next_notification(recipient_id, context)
 
 
@@ -216,16 +298,8 @@ async def mark_notifications_responded(recipient_id, liker_id=None, response_typ
     Mark the most recent 'sent' notification(s) for recipient as responded.
     If liker_id is provided, only mark the matching notification for that liker_id.
     """
-    query = {"recipient_id": recipient_id, "status": "sent"}
-    if liker_id is not None:
-        query["liker_id"] = liker_id
-
     try:
-        docs = list(like_notifications_collection.find(query))
-        for d in docs:
-            like_notifications_collection.update_one({"_id": d["_id"]}, {
-                "$set": {"status": "responded", "response": response_type, "responded_at": _get_current_utc()}
-            })
+        await notification_repo.mark_responded(recipient_id, liker_id, response_type, _get_current_utc())
     except Exception:
         logger.exception("Failed to mark notifications responded for recipient %s liker %s", recipient_id, liker_id)
 
@@ -237,9 +311,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ensure we persist username on /start
     upsert_tg_username(user_id, tg_username)
 
-    user = users_collection.find_one({"user_id": user_id})
+    user = await user_repo.get_user(user_id)
     if user:
-        users_collection.update_one({"user_id": user_id}, {"$set": {"tg_username": tg_username}})
         keyboard = [[InlineKeyboardButton("🌟 Main Menu", callback_data="main_menu")]]
         if update.message:
             await update.message.reply_text("Welcome back! Use the menu below.", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -247,16 +320,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_edit_or_send_message(update, "Welcome back! Use the menu below.", reply_markup=InlineKeyboardMarkup(keyboard))
         return
 
-    users_collection.insert_one({
+    await user_repo.create_user({
         "user_id": user_id,
         "tg_username": tg_username,
         "step": "awaiting_name",
-        "likes": [],
-        "liked_by": [],
-        "passed": [],
         "photos": [],
         "department": "",
-        "year": ""
+        "year": "",
+        "likes_received": 0
     })
     await safe_edit_or_send_message(
         update,
@@ -273,10 +344,95 @@ async def start_onboarding(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # persist username on callbacks too
     upsert_tg_username(user_id, tg_username)
 
-    users_collection.update_one({"user_id": user_id}, {"$set": {"step": "awaiting_name", "tg_username": tg_username}})
+    # the draft lives in memory until the profile is complete (see data/drafts.py)
+    await drafts.begin(user_id, "awaiting_name")
     await safe_edit_or_send_callback(query, "First, your name?:", parse_mode="Markdown")
 
 # ------------------- MESSAGE HANDLER -------------------
+def _parse_text(text):
+    return text or None
+
+
+def _parse_age(text):
+    return int(text) if text.isdigit() and 16 <= int(text) <= 100 else None
+
+
+GENDERS = ("male", "female")
+INTERESTS = ("male", "female", "both")
+
+GENDER_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Male", callback_data="gender_male"),
+     InlineKeyboardButton("Female", callback_data="gender_female")]
+])
+
+# onboarding step -> (field, parser, invalid-input reply, next step, prompt for the next step, prompt keyboard)
+ONBOARDING_STEPS = {
+    "awaiting_name": ("name", _parse_text, "Please send a valid name.", "awaiting_department",
+                      "Great! Now enter your department (e.g., Computer Science):", None),
+    "awaiting_department": ("department", _parse_text, "Please enter a valid department.", "awaiting_year",
+                            "Awesome! Now enter your year (e.g., 1st, 2nd, 3rd, 4th, Alumni):", None),
+    "awaiting_year": ("year", _parse_text, "Please enter a valid year.", "awaiting_gender",
+                      "Nice! Now select your gender:", GENDER_KEYBOARD),
+    "awaiting_age": ("age", _parse_age, "Please enter a valid age (16–100).", "awaiting_photo",
+                     "Cool 😎 Now upload a profile photo.", None),
+    "awaiting_bio": ("bio", _parse_text, "Please write a short bio about yourself.", "done",
+                     "Profile complete! 🎉", None),
+}
+
+# edit step -> (field, parser, invalid-input reply, confirmation)
+EDIT_STEPS = {
+    "edit_name": ("name", _parse_text, "Please send a valid name.", "✅ Name updated."),
+    "edit_department": ("department", _parse_text, "Please enter a valid department.", "✅ Department updated."),
+    "edit_year": ("year", _parse_text, "Please send a valid year.", "✅ Year updated."),
+    "edit_age": ("age", _parse_age, "Please enter a valid age (16-100).", "✅ Age updated."),
+    "edit_bio": ("bio", _parse_text, "Please send a bio text.", "✅ Bio updated."),
+}
+
+
+async def current_draft(user_id):
+    # in-memory draft first; after a restart, whatever the user document checkpointed
+    draft = await drafts.get(user_id)
+    if draft is None:
+        doc = await user_repo.get_user(user_id, {"step": 1, "draft": 1})
+        if doc:
+            draft = await drafts.restore(user_id, doc)
+    return draft
+
+
+async def save_onboarding_field(update, context, step, text):
+    field, parse, invalid, next_step, prompt, keyboard = ONBOARDING_STEPS[step]
+    value = parse(text)
+    if value is None:
+        await update.message.reply_text(invalid)
+        return
+    if next_step == "done":
+        await drafts.complete(update.message.chat_id, {field: value})
+    else:
+        await drafts.advance(update.message.chat_id, {field: value}, next_step)
+    await update.message.reply_text(prompt, reply_markup=keyboard)
+    if next_step == "done":
+        await show_main_menu(update, context)
+
+
+async def save_edited_field(update, context, step, text):
+    field, parse, invalid, confirmation = EDIT_STEPS[step]
+    value = parse(text)
+    if value is None:
+        await update.message.reply_text(invalid)
+        return
+    await user_repo.set_fields(update.message.chat_id, {field: value, "step": "done"})
+    await drafts.discard(update.message.chat_id)
+    await update.message.reply_text(confirmation)
+    await show_main_menu(update, context)
+
+
+# step -> text handler(update, context, step, text)
+STEP_HANDLERS = {
+    **{step: save_onboarding_field for step in ONBOARDING_STEPS},
+    **{step: save_edited_field for step in EDIT_STEPS},
+}
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message if update.message else update.channel_post
     if not message:
@@ -289,35 +445,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.debug("Chat ID: %s", chat_id)
 
     # Broadcast flow support:
-    # - Admins can trigger broadcast from their private chat (using user_data)
-    # - Or from the configured admin control channel (using chat_data)
-    # Check admin user-data broadcast flag first (private admin)
+    # - Admins can trigger broadcast from their private chat (broadcast:user:<id> flag)
+    # - Or from the configured admin control channel (broadcast:chat:<id> flag)
+    # Flags live in data.state, shared between replicas in replica mode.
     user_id = message.chat_id
-    if user_id in ADMIN_IDS and context.user_data.get("awaiting_broadcast"):
-        all_users = list(users_collection.find({}, {"user_id": 1}))
-        sent = 0
-        for u in all_users:
-            try:
-                await context.bot.send_message(u["user_id"], f"📢 Broadcast from admin:\n\n{text}")
-                sent += 1
-            except Exception:
-                pass
-        context.user_data["awaiting_broadcast"] = False
-        await message.reply_text(f"Broadcast sent to {sent} users.")
+    # The broadcast runs as a background job; progress is reported in this chat.
+    if user_id in ADMIN_IDS and await state.store.pop(f"broadcast:user:{user_id}"):
+        await broadcast.start_broadcast(context.application, f"📢 Broadcast from admin:\n\n{text}", chat_id, run_here=not REPLICA_MODE)
         return
 
     # Channel-driven broadcast (if admin hits broadcast from the control channel)
-    if chat_id == ADMIN_CHANNEL_ID and context.chat_data.get("awaiting_broadcast"):
-        all_users = list(users_collection.find({}, {"user_id": 1}))
-        sent = 0
-        for u in all_users:
-            try:
-                await context.bot.send_message(u["user_id"], f"📢 Broadcast from admin channel:\n\n{text}")
-                sent += 1
-            except Exception:
-                pass
-        context.chat_data["awaiting_broadcast"] = False
-        await message.reply_text(f"Broadcast sent to {sent} users.")
+    if chat_id == ADMIN_CHANNEL_ID and await state.store.pop(f"broadcast:chat:{chat_id}"):
+        await broadcast.start_broadcast(context.application, f"📢 Broadcast from admin channel:\n\n{text}", chat_id, run_here=not REPLICA_MODE)
         return
 
     # Only handle onboarding/user logic for private chats (not channels)
@@ -325,97 +464,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # proceed with user onboarding/profile edits
-    user = ensure_user_doc(users_collection.find_one({"user_id": user_id}))
-    step = user.get("step")
-
-    if step == "awaiting_name":
-        if not text:
-            await message.reply_text("Please send a valid name.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"name": text, "step": "awaiting_department"}})
-        await message.reply_text("Great! Now enter your department (e.g., Computer Science):")
-        return
-
-    if step == "awaiting_department":
-        if not text:
-            await message.reply_text("Please enter a valid department.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"department": text, "step": "awaiting_year"}})
-        await message.reply_text("Awesome! Now enter your year (e.g., 1st, 2nd, 3rd, 4th, Alumni):")
-        return
-
-    if step == "awaiting_year":
-        if not text:
-            await message.reply_text("Please enter a valid year.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"year": text, "step": "awaiting_gender"}})
-        keyboard = [
-            [InlineKeyboardButton("Male", callback_data="gender_male"),
-             InlineKeyboardButton("Female", callback_data="gender_female")]
-        ]
-        await message.reply_text("Nice! Now select your gender:", reply_markup=InlineKeyboardMarkup(keyboard))
-        return
-
-    if step == "awaiting_age":
-        if not text.isdigit() or not (16 <= int(text) <= 100):
-            await message.reply_text("Please enter a valid age (16–100).")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"age": int(text), "step": "awaiting_photo"}})
-        await message.reply_text("Cool 😎 Now upload a profile photo.")
-        return
-
-    if step == "awaiting_bio":
-        if not text:
-            await message.reply_text("Please write a short bio about yourself.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"bio": text, "step": "done"}})
-        await message.reply_text("Profile complete! 🎉")
-        await show_main_menu(update, context)
-        return
-
-    if step == "edit_name":
-        if not text:
-            await message.reply_text("Please send a valid name.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"name": text, "step": "done"}})
-        await message.reply_text("✅ Name updated.")
-        await show_main_menu(update, context)
-        return
-
-    if step == "edit_department":
-        if not text:
-            await message.reply_text("Please enter a valid department.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"department": text, "step": "done"}})
-        await message.reply_text("✅ Department updated.")
-        await show_main_menu(update, context)
-        return
-
-    if step == "edit_year":
-        if not text:
-            await message.reply_text("Please send a valid year.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"year": text, "step": "done"}})
-        await message.reply_text("✅ Year updated.")
-        await show_main_menu(update, context)
-        return
-
-    if step == "edit_age":
-        if not text.isdigit() or not (16 <= int(text) <= 100):
-            await message.reply_text("Please enter a valid age (16-100).")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"age": int(text), "step": "done"}})
-        await message.reply_text("✅ Age updated.")
-        await show_main_menu(update, context)
-        return
-
-    if step == "edit_bio":
-        if not text:
-            await message.reply_text("Please send a bio text.")
-            return
-        users_collection.update_one({"user_id": user_id}, {"$set": {"bio": text, "step": "done"}})
-        await message.reply_text("✅ Bio updated.")
-        await show_main_menu(update, context)
+    draft = await current_draft(user_id)
+    step = draft["step"] if draft else None
+    handler = STEP_HANDLERS.get(step)
+    if handler:
+        await handler(update, context, step, text)
         return
 
     await update.message.reply_text(
@@ -430,14 +483,11 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please send a photo.")
         return
     photo = update.message.photo[-1].file_id
-    user = ensure_user_doc(users_collection.find_one({"user_id": user_id}))
-    step = user.get("step")
+    draft = await current_draft(user_id)
+    step = draft["step"] if draft else None
 
     if step == "awaiting_photo":
-        users_collection.update_one(
-            {"user_id": user_id},
-            {"$push": {"photos": photo}, "$set": {"step": "awaiting_interest"}}
-        )
+        await drafts.advance(user_id, {"photos": [photo]}, "awaiting_interest")
         keyboard = [
             [InlineKeyboardButton("Male", callback_data="interest_male"),
              InlineKeyboardButton("Female", callback_data="interest_female"),
@@ -447,276 +497,264 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if step == "edit_photo":
-        users_collection.update_one({"user_id": user_id}, {"$set": {"photos": [photo], "step": "done"}})
+        await user_repo.set_fields(user_id, {"photos": [photo], "step": "done"})
+        await drafts.discard(user_id)
         await update.message.reply_text("✅ Photo updated.")
         await show_main_menu(update, context)
         return
 
-    if step == "awaiting_broadcast" and user_id in ADMIN_IDS:
+    if user_id in ADMIN_IDS and await state.store.get(f"broadcast:user:{user_id}"):
         await update.message.reply_text("Broadcast requires text only.")
         return
 
-    users_collection.update_one({"user_id": user_id}, {"$addToSet": {"photos": photo}})
+    await user_repo.update_user(user_id, {"$addToSet": {"photos": photo}})
     await update.message.reply_text("Photo uploaded to your profile.")
 
 # ------------------- CALLBACK HANDLER -------------------
-async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def skip_candidate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    user_id = query.from_user.id
-    # persist username on any callback
-    upsert_tg_username(user_id, query.from_user.username)
+    try:
+        target_id = int(query.data.split("_", 1)[1])
+        await edge_repo.record_pass(query.from_user.id, target_id)
+    except Exception:
+        pass
+    await find_match(update, context)
 
-    user = ensure_user_doc(users_collection.find_one({"user_id": user_id}))
-    chat_id = query.message.chat_id
-    data = query.data
-    await query.answer()
 
-    if data.startswith("like_"):
-        await handle_like(update, context)
-        return
+async def show_edit_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    keyboard = [
+        [InlineKeyboardButton("✏️ Edit Name", callback_data="edit_name")],
+        [InlineKeyboardButton("✏️ Edit Age", callback_data="edit_age")],
+        [InlineKeyboardButton("✏️ Edit Gender", callback_data="edit_gender")],
+        [InlineKeyboardButton("✏️ Edit Department", callback_data="edit_department")],
+        [InlineKeyboardButton("✏️ Edit Year", callback_data="edit_year")],
+        [InlineKeyboardButton("✏️ Edit Bio", callback_data="edit_bio")],
+        [InlineKeyboardButton("🖼 Edit Photo", callback_data="edit_photo")],
+        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+    ]
+    await safe_edit_or_send_callback(query, "Choose what to edit:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-    if data.startswith("skip_"):
-        try:
-            target_id = int(data.split("_", 1)[1])
-            users_collection.update_one({"user_id": user_id}, {"$addToSet": {"passed": target_id}})
-        except Exception:
-            pass
-        await find_match(update, context)
-        return
 
-    if data == "main_menu":
-        await show_main_menu(update, context)
-        return
+async def begin_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await drafts.begin_edit(query.from_user.id, query.data)
+    await safe_edit_or_send_callback(query, f"✏️ Send your new {query.data.split('_', 1)[1]}:")
 
-    if data == "start_onboarding":
-        await start_onboarding(update, context)
-        return
 
-    if data == "edit_profile":
-        keyboard = [
-            [InlineKeyboardButton("✏️ Edit Name", callback_data="edit_name")],
-            [InlineKeyboardButton("✏️ Edit Age", callback_data="edit_age")],
-            [InlineKeyboardButton("✏️ Edit Gender", callback_data="edit_gender")],
-            [InlineKeyboardButton("✏️ Edit Department", callback_data="edit_department")],
-            [InlineKeyboardButton("✏️ Edit Year", callback_data="edit_year")],
-            [InlineKeyboardButton("✏️ Edit Bio", callback_data="edit_bio")],
-            [InlineKeyboardButton("🖼 Edit Photo", callback_data="edit_photo")],
-            [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-        ]
-        await safe_edit_or_send_callback(query, "Choose what to edit:", reply_markup=InlineKeyboardMarkup(keyboard))
+async def choose_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+    gender = query.data.split("_", 1)[1]
+    draft = await current_draft(user_id)
+    cur_step = draft["step"] if draft else ""
+    if gender not in GENDERS or not (cur_step.startswith("edit_") or cur_step == "awaiting_gender"):
+        await safe_edit_or_send_callback(query, "That choice has expired. Use the menu.")
         return
+    if cur_step.startswith("edit_"):
+        await user_repo.set_fields(user_id, {"gender": gender, "step": "done"})
+        await drafts.discard(user_id)
+        await safe_edit_or_send_callback(query, f"✅ Gender updated to {gender}.")
+        await show_main_menu(update, context)
+    else:
+        await drafts.advance(user_id, {"gender": gender}, "awaiting_age")
+        await safe_edit_or_send_callback(query, "Enter your age (16–100):")
 
-    if data.startswith("edit_"):
-        users_collection.update_one({"user_id": user_id}, {"$set": {"step": data}})
-        await safe_edit_or_send_callback(query, f"✏️ Send your new {data.split('_', 1)[1]}:")
-        return
 
-    if data.startswith("gender_"):
-        gender = data.split("_", 1)[1]
-        cur_step = user.get("step", "")
-        if cur_step.startswith("edit_"):
-            users_collection.update_one({"user_id": user_id}, {"$set": {"gender": gender, "step": "done"}})
-            await safe_edit_or_send_callback(query, f"✅ Gender updated to {gender}.")
-            await show_main_menu(update, context)
-        else:
-            users_collection.update_one({"user_id": user_id}, {"$set": {"gender": gender, "step": "awaiting_age"}})
-            await safe_edit_or_send_callback(query, "Enter your age (16–100):")
+async def choose_interest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+    interest = query.data.split("_", 1)[1]
+    draft = await current_draft(user_id)
+    if interest not in INTERESTS or not draft or draft["step"] != "awaiting_interest":
+        await safe_edit_or_send_callback(query, "That choice has expired. Use the menu.")
         return
+    await drafts.advance(user_id, {"interested_in": interest}, "awaiting_bio")
+    # the old deck was built for the previous interest
+    await deck_repo.discard_deck(user_id)
+    await safe_edit_or_send_callback(query, "Great! Write a short bio about yourself:")
 
-    if data.startswith("interest_"):
-        interest = data.split("_", 1)[1]
-        users_collection.update_one({"user_id": user_id}, {"$set": {"interested_in": interest, "step": "awaiting_bio"}})
-        await safe_edit_or_send_callback(query, "Great! Write a short bio about yourself:")
-        return
 
-    if data == "view_profile":
-        await show_profile(update, context)
-        return
+async def begin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    chat_id = query.message.chat_id
+    user_id = query.from_user.id
+    # Allow broadcast both from the configured admin channel or private admin
+    if chat_id == ADMIN_CHANNEL_ID:
+        await state.store.set(f"broadcast:chat:{chat_id}", True, BROADCAST_PROMPT_TTL)
+        await safe_edit_or_send_callback(query, "Send the message to broadcast (text only) in this channel.")
+    elif user_id in ADMIN_IDS:
+        await state.store.set(f"broadcast:user:{user_id}", True, BROADCAST_PROMPT_TTL)
+        await safe_edit_or_send_callback(query, "Send the message to broadcast (text only) in your private chat. It will be forwarded to all users.")
+    else:
+        await safe_edit_or_send_callback(query, "⛔ Only the control channel or admins can broadcast.")
 
-    if data == "find_match":
-        await find_match(update, context)
-        return
 
-    if data == "leaderboard":
-        await show_leaderboard(update, context)
+async def file_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    # Enhanced report handling:
+    try:
+        target_id = int(data.split("_", 1)[1])
+    except Exception:
+        await safe_edit_or_send_callback(query, "Invalid report target.")
         return
 
-    if data == "admin_panel":
-        await show_admin_panel(update, context)
-        return
+    reporter_id = query.from_user.id
 
-    if data == "broadcast":
-        # Allow broadcast both from the configured admin channel or private admin
-        if chat_id == ADMIN_CHANNEL_ID:
-            context.chat_data["awaiting_broadcast"] = True
-            await safe_edit_or_send_callback(query, "Send the message to broadcast (text only) in this channel.")
-        elif user_id in ADMIN_IDS:
-            context.user_data["awaiting_broadcast"] = True
-            await safe_edit_or_send_callback(query, "Send the message to broadcast (text only) in your private chat. It will be forwarded to all users.")
-        else:
-            await safe_edit_or_send_callback(query, "⛔ Only the control channel or admins can broadcast.")
+    # Prevent reporter from reporting themselves
+    if reporter_id == target_id:
+        await safe_edit_or_send_callback(query, "You cannot report yourself.")
         return
 
-    if data.startswith("report_"):
-        # Enhanced report handling:
-        try:
-            target_id = int(data.split("_", 1)[1])
-        except Exception:
-            await safe_edit_or_send_callback(query, "Invalid report target.")
-            return
-
-        reporter_id = query.from_user.id
+    # Prevent duplicate reports by same reporter for the same target (only if open)
+    existing = await report_repo.find_open_report(target_id, reporter_id)
+    if existing:
+        await safe_edit_or_send_callback(query, "You've already reported this user. Our admins will review it.")
+        return
 
-        # Prevent reporter from reporting themselves
-        if reporter_id == target_id:
-            await safe_edit_or_send_callback(query, "You cannot report yourself.")
-            return
+    # Persist the report
+    report_doc = {
+        "target_id": target_id,
+        "reporter_id": reporter_id,
+        "created_at": datetime.utcnow(),
+        "status": "open"
+    }
+    try:
+        report_id = await report_repo.insert_report(report_doc)
+    except Exception:
+        logger.exception("Failed to save report to DB for target=%s by reporter=%s", target_id, reporter_id)
+        await safe_edit_or_send_callback(query, "❌ Failed to file the report. Please try again later.")
+        return
 
-        # Prevent duplicate reports by same reporter for the same target (only if open)
-        existing = reports_collection.find_one({
-            "target_id": target_id,
-            "reporter_id": reporter_id,
-            "status": {"$in": ["open", "pending"]}
-        })
-        if existing:
-            await safe_edit_or_send_callback(query, "You've already reported this user. Our admins will review it.")
-            return
+    # Acknowledge the reporter
+    await safe_edit_or_send_callback(query, "🚫 Thank you — we've recorded your report. Our admins will review it shortly.")
 
-        # Persist the report
-        report_doc = {
-            "target_id": target_id,
-            "reporter_id": reporter_id,
-            "created_at": datetime.utcnow(),
-            "status": "open"
-        }
-        try:
-            res = reports_collection.insert_one(report_doc)
-            report_id = str(res.inserted_id)
-        except Exception:
-            logger.exception("Failed to save report to DB for target=%s by reporter=%s", target_id, reporter_id)
-            await safe_edit_or_send_callback(query, "❌ Failed to file the report. Please try again later.")
-            return
+    # Notify admin channel (or each admin privately if no channel configured)
+    try:
+        target_user = await user_repo.get_user(target_id) or {}
+        reporter_user = await user_repo.get_user(reporter_id) or {}
+
+        admin_text = (
+            f"⚠️ New report (id: {report_id})\n\n"
+            f"Target: {target_user.get('name','Unknown')} (id: {target_id})\n"
+            f"Reported by: {reporter_user.get('name','Unknown')} (id: {reporter_id})\n"
+            f"Time: {datetime.utcnow().isoformat()} UTC\n\n"
+            f"Use the buttons to view profile / ban or ignore the report."
+        )
 
-        # Acknowledge the reporter
-        await safe_edit_or_send_callback(query, "🚫 Thank you — we've recorded your report. Our admins will review it shortly.")
+        admin_keyboard = InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("View Profile", callback_data=f"admin_view_{target_id}"),
+                InlineKeyboardButton("Ban User", callback_data=f"admin_ban_{target_id}")
+            ],
+            [
+                InlineKeyboardButton("Ignore Report", callback_data=f"admin_ignore_{report_id}")
+            ]
+        ])
 
-        # Notify admin channel (or each admin privately if no channel configured)
-        try:
-            target_user = users_collection.find_one({"user_id": target_id}) or {}
-            reporter_user = users_collection.find_one({"user_id": reporter_id}) or {}
-
-            admin_text = (
-                f"⚠️ New report (id: {report_id})\n\n"
-                f"Target: {target_user.get('name','Unknown')} (id: {target_id})\n"
-                f"Reported by: {reporter_user.get('name','Unknown')} (id: {reporter_id})\n"
-                f"Time: {datetime.utcnow().isoformat()} UTC\n\n"
-                f"Use the buttons to view profile / ban or ignore the report."
-            )
+        # queued through the outbox; delivery failures are logged there
+        if ADMIN_CHANNEL_ID:
+            outbox.send_message(ADMIN_CHANNEL_ID, admin_text, priority=NOTIFICATION, reply_markup=admin_keyboard)
+        else:
+            # fallback: DM each admin
+            for aid in ADMIN_IDS:
+                outbox.send_message(aid, admin_text, priority=NOTIFICATION, reply_markup=admin_keyboard)
+    except Exception:
+        logger.exception("Failed to notify admins about report %s", report_id)
 
-            admin_keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("View Profile", callback_data=f"admin_view_{target_id}"),
-                    InlineKeyboardButton("Ban User", callback_data=f"admin_ban_{target_id}")
-                ],
-                [
-                    InlineKeyboardButton("Ignore Report", callback_data=f"admin_ignore_{report_id}")
-                ]
-            ])
 
-            if ADMIN_CHANNEL_ID:
-                await context.bot.send_message(chat_id=ADMIN_CHANNEL_ID, text=admin_text, reply_markup=admin_keyboard)
-            else:
-                # fallback: DM each admin
-                for aid in ADMIN_IDS:
-                    try:
-                        await context.bot.send_message(chat_id=aid, text=admin_text, reply_markup=admin_keyboard)
-                    except Exception:
-                        logger.exception("Failed to DM admin %s about report %s", aid, report_id)
-        except Exception:
-            logger.exception("Failed to notify admins about report %s", report_id)
+async def admin_view_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    # Only admins may use admin actions
+    if query.from_user.id not in ADMIN_IDS:
+        await safe_edit_or_send_callback(query, "⛔ Only admins can use this.")
+        return
+    try:
+        target_id = int(data.split("_", 2)[2])
+    except Exception:
+        await safe_edit_or_send_callback(query, "Invalid target.")
+        return
 
+    target = await user_repo.get_user(target_id)
+    if not target:
+        await safe_edit_or_send_callback(query, "User not found.")
         return
 
-    if data.startswith("admin_view_"):
-        # Only admins may use admin actions
-        if query.from_user.id not in ADMIN_IDS:
-            await safe_edit_or_send_callback(query, "⛔ Only admins can use this.")
-            return
-        try:
-            target_id = int(data.split("_", 2)[2])
-        except Exception:
-            await safe_edit_or_send_callback(query, "Invalid target.")
-            return
+    photos = target.get("photos", [])
+    caption = (
+        f"{target.get('name','Unknown')}, {target.get('age','N/A')}\n"
+        f"Dept: {target.get('department','N/A')} | Year: {target.get('year','N/A')}\n"
+        f"{target.get('bio','No bio available')}\n"
+        f"ID: {target_id}\n"
+        f"Reported by: see reports collection"
+    )
 
-        target = users_collection.find_one({"user_id": target_id})
-        if not target:
-            await safe_edit_or_send_callback(query, "User not found.")
-            return
+    admin_actions = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("Ban User", callback_data=f"admin_ban_{target_id}"),
+            InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")
+        ]
+    ])
+    try:
+        if photos:
+            await query.message.reply_photo(photo=photos[-1], caption=caption, reply_markup=admin_actions)
+        else:
+            await query.message.reply_text(caption, reply_markup=admin_actions)
+    except Exception:
+        logger.exception("Failed to send admin view profile for %s", target_id)
 
-        photos = target.get("photos", [])
-        caption = (
-            f"{target.get('name','Unknown')}, {target.get('age','N/A')}\n"
-            f"Dept: {target.get('department','N/A')} | Year: {target.get('year','N/A')}\n"
-            f"{target.get('bio','No bio available')}\n"
-            f"ID: {target_id}\n"
-            f"Reported by: see reports collection"
-        )
 
-        admin_actions = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("Ban User", callback_data=f"admin_ban_{target_id}"),
-                InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")
-            ]
-        ])
-        try:
-            if photos:
-                await query.message.reply_photo(photo=photos[-1], caption=caption, reply_markup=admin_actions)
-            else:
-                await query.message.reply_text(caption, reply_markup=admin_actions)
-        except Exception:
-            logger.exception("Failed to send admin view profile for %s", target_id)
+async def admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    if query.from_user.id not in ADMIN_IDS:
+        await safe_edit_or_send_callback(query, "⛔ Only admins can perform this action.")
         return
-
-    if data.startswith("admin_ban_"):
-        if query.from_user.id not in ADMIN_IDS:
-            await safe_edit_or_send_callback(query, "⛔ Only admins can perform this action.")
-            return
-        try:
-            target_id = int(data.split("_", 2)[2])
-        except Exception:
-            await safe_edit_or_send_callback(query, "Invalid target.")
-            return
-        users_collection.update_one({"user_id": target_id}, {"$set": {"banned": True}})
-        await safe_edit_or_send_callback(query, f"User {target_id} has been banned.")
-        try:
-            await context.bot.send_message(target_id, "You have been banned from AAU-LinkUp by the admins.")
-        except Exception:
-            logger.debug("Couldn't DM user about ban (they may not have started the bot).")
+    try:
+        target_id = int(data.split("_", 2)[2])
+    except Exception:
+        await safe_edit_or_send_callback(query, "Invalid target.")
         return
+    await user_repo.set_fields(target_id, {"banned": True})
+    await safe_edit_or_send_callback(query, f"User {target_id} has been banned.")
+    # best effort: they may not have started the bot; the outbox logs failures
+    outbox.send_message(target_id, "You have been banned from AAU-LinkUp by the admins.", priority=NOTIFICATION)
 
-    if data.startswith("admin_ignore_"):
-        if query.from_user.id not in ADMIN_IDS:
-            await safe_edit_or_send_callback(query, "⛔ Only admins can perform this action.")
-            return
-        try:
-            report_id = data.split("_", 2)[2]
-            oid = ObjectId(report_id)
-        except Exception:
-            await safe_edit_or_send_callback(query, "Invalid report id.")
-            return
-        try:
-            reports_collection.update_one({"_id": oid}, {"$set": {"status": "ignored", "reviewed_by": query.from_user.id, "reviewed_at": datetime.utcnow()}})
-            await safe_edit_or_send_callback(query, f"Report {report_id} marked as ignored.")
-        except Exception:
-            logger.exception("Failed to mark report %s as ignored", report_id)
-            await safe_edit_or_send_callback(query, "Failed to mark report as ignored.")
-        return
 
-    if data == "help_command":
-        await help_command(update, context)
+async def admin_ignore_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    if query.from_user.id not in ADMIN_IDS:
+        await safe_edit_or_send_callback(query, "⛔ Only admins can perform this action.")
         return
+    try:
+        report_id = data.split("_", 2)[2]
+        oid = ObjectId(report_id)
+    except Exception:
+        await safe_edit_or_send_callback(query, "Invalid report id.")
+        return
+    try:
+        await report_repo.set_report_fields(oid, {"status": "ignored", "reviewed_by": query.from_user.id, "reviewed_at": datetime.utcnow()})
+        await safe_edit_or_send_callback(query, f"Report {report_id} marked as ignored.")
+    except Exception:
+        logger.exception("Failed to mark report %s as ignored", report_id)
+        await safe_edit_or_send_callback(query, "Failed to mark report as ignored.")
+
+
+async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+    # persist username on any callback
+    upsert_tg_username(user_id, query.from_user.username)
+    await query.answer()
 
-    await safe_edit_or_send_callback(query, "Unknown action. Use the menu.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🌟 Main Menu", callback_data="main_menu")]]))
+    route = _button_route(query.data)
+    if route is None:
+        await safe_edit_or_send_callback(query, "Unknown action. Use the menu.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🌟 Main Menu", callback_data="main_menu")]]))
+        return
+    await route(update, context)
 
 # ------------------- PROFILE DISPLAY -------------------
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -728,7 +766,7 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         upsert_tg_username(user_id, update.effective_user.username)
 
-    user = users_collection.find_one({"user_id": user_id})
+    user = await user_repo.get_user(user_id)
     if not user:
         await safe_edit_or_send_message(update, "No profile found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🌟 Main Menu", callback_data="main_menu")]]))
         return
@@ -741,7 +779,7 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Department: {user.get('department')}\n"
         f"Year: {user.get('year')}\n"
         f"Bio: {user.get('bio')}\n"
-        f"❤️ Likes received: {len(user.get('liked_by', []))}\n"
+        f"❤️ Likes received: {user.get('likes_received', 0)}\n"
     )
     keyboard = [
         [InlineKeyboardButton("✏️ Edit Profile", callback_data="edit_profile")],
@@ -782,6 +820,30 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await safe_edit_or_send_message(update, "Choose an option:", reply_markup=reply_markup)
 
 # ------------------- MATCH SYSTEM -------------------
+# Viewers whose deck is currently being topped up, so taps don't stack refills
+_deck_refills = set()
+
+
+async def _refill_deck(viewer_id, shown_id):
+    try:
+        exclude = await edge_repo.outgoing_ids(viewer_id) + [shown_id]
+        added = await deck_repo.refill_deck(viewer_id, exclude)
+        logger.debug("Refilled deck for %s with %s candidates", viewer_id, added)
+    except Exception:
+        logger.exception("Failed to refill candidate deck for %s", viewer_id)
+    finally:
+        _deck_refills.discard(viewer_id)
+
+
+def schedule_deck_refill(context: ContextTypes.DEFAULT_TYPE, viewer_id, shown_id):
+    """
+    Top the viewer's deck up in the background so the current tap doesn't wait on it.
+    """
+    if viewer_id in _deck_refills:
+        return
+    _deck_refills.add(viewer_id)
+    context.application.create_task(_refill_deck(viewer_id, shown_id))
+
 # ------------------- FIND MATCH -------------------
 async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -790,40 +852,38 @@ async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # persist username on match actions
     upsert_tg_username(user_id, query.from_user.username)
 
-    user = ensure_user_doc(users_collection.find_one({"user_id": user_id}))
-
-    search_query = {"user_id": {"$ne": user_id}, "step": "done", "banned": {"$ne": True}}
-    interested_in = user.get("interested_in")
-    if interested_in and interested_in != "both":
-        search_query["gender"] = interested_in
-    else:
-        search_query["gender"] = {"$in": ["male", "female"]}
-
-    candidates = list(users_collection.find(search_query))
-
-    def eligible(c):
-        uid = c.get("user_id")
-        if uid == user_id or uid in (user.get("likes") or []) or uid in (user.get("passed") or []):
-            return False
-        # Also skip banned users (defense-in-depth)
-        if c.get("banned"):
-            return False
-        return True
-
-    filtered = [c for c in candidates if eligible(c)]
-
-    # If no profiles left to show, reset passed and likes
-        # If no profiles left to show, reset only 'passed' (keep 'likes'!)
-    if not filtered:
-        users_collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"passed": []}}  # keep likes intact
-        )
-        # Recompute with the same eligibility (still excluding already liked users)
-        candidates = list(users_collection.find(search_query))
-        filtered = [c for c in candidates if eligible(c)]
-
-        if not filtered:
+    # Pop from the viewer's pre-shuffled deck, skipping ids that went stale
+    candidate = None
+    popped = await deck_repo.pop_next(user_id)
+    while popped and popped[0] is not None:
+        candidate_id, remaining, interested_in = popped
+        candidate = await user_repo.get_candidate(candidate_id, user_id, interested_in)
+        if candidate:
+            if remaining < deck_repo.DECK_REFILL_AT:
+                schedule_deck_refill(context, user_id, candidate_id)
+            break
+        popped = await deck_repo.pop_next(user_id)
+
+    if not candidate:
+        # No deck yet or it ran dry: rebuild it, excluding everyone the viewer liked or passed
+        user = await user_repo.get_user(user_id, {"interested_in": 1}) or {}
+        interested_in = user.get("interested_in")
+        exhausted = False
+
+        ids = await deck_repo.build_deck(user_id, interested_in, await edge_repo.outgoing_ids(user_id))
+        # If no profiles left to show, reset only passes (keep likes!)
+        if not ids:
+            exhausted = True
+            await edge_repo.clear_passes(user_id)
+            # Rebuild, still excluding already liked users
+            ids = await deck_repo.build_deck(user_id, interested_in, await edge_repo.outgoing_ids(user_id, kinds=(edge_repo.LIKE,)))
+
+        if ids:
+            popped = await deck_repo.pop_next(user_id)
+            if popped and popped[0] is not None:
+                candidate = await user_repo.get_candidate(popped[0], user_id, interested_in)
+
+        if not candidate:
             keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="main_menu")]]
             await safe_edit_or_send_callback(
                 query,
@@ -831,10 +891,9 @@ async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
             return
-        else:
+        if exhausted:
             await query.message.reply_text("✨ You've seen everyone you haven't liked yet!")
 
-    candidate = random.choice(filtered)
     caption = (
         f"{candidate.get('name')}, {candidate.get('age')}\n"
         f"Department: {candidate.get('department')}\n"
@@ -893,34 +952,31 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("You can't like yourself.")
         return
 
-    # Load both users
-    liker = ensure_user_doc(users_collection.find_one({"user_id": user_id}))
-    liked = ensure_user_doc(users_collection.find_one({"user_id": liked_id}))
-    if not liked.get("user_id"):
+    # One batched profile read (which also checks the target exists), then two
+    # concurrent writes in record_like, then the counter bump
+    profiles = await user_repo.get_users([user_id, liked_id], {"_id": 0, "user_id": 1, "name": 1, "tg_username": 1})
+    if liked_id not in profiles:
         await query.answer("User not found.")
         return
+    liker_doc = profiles.get(user_id) or {}
+    liked_doc = profiles[liked_id]
 
-    # Prevent duplicate likes
-    if liked_id in (liker.get("likes") or []):
+    # Record the like and detect a mutual one atomically; only the like that
+    # completes the pair reports mutual, so racing taps notify exactly once
+    new_like, mutual = await edge_repo.record_like(user_id, liked_id)
+    if not new_like:
         await query.answer("You've already connected with this user.")
         await find_match(update, context)
         return
 
-    # Update likes and liked_by
-    users_collection.update_one({"user_id": user_id}, {"$addToSet": {"likes": liked_id}})
-    users_collection.update_one({"user_id": liked_id}, {"$addToSet": {"liked_by": user_id}})
-
-    # ✅ Re-fetch both docs fresh from DB (fixes mutual detection timing)
-    liker_doc = ensure_user_doc(users_collection.find_one({"user_id": user_id}))
-    liked_doc = ensure_user_doc(users_collection.find_one({"user_id": liked_id}))
+    # bumped before the edge is marked counted, so a failed bump is retried on the next tap
+    await user_repo.add_likes_received(liked_id)
+    await edge_repo.mark_counted(user_id, liked_id)
 
     # Logging to help debugging mutual-like edge cases
-    logger.debug("handle_like: user %s likes %s", user_id, liked_id)
-    logger.debug("liker_doc.likes=%s liked_doc.likes=%s", liker_doc.get("likes"), liked_doc.get("likes"))
+    logger.debug("handle_like: user %s likes %s (mutual=%s)", user_id, liked_id, mutual)
 
     liked_name = liked_doc.get("name", "Someone")
-    liked_likes = liked_doc.get("likes", [])
-    mutual = user_id in liked_likes
 
     await query.answer(f"You liked {liked_name} ❤️")
 
@@ -941,19 +997,17 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             logger.exception("Error marking notifications on mutual like for %s -> %s", user_id, liked_id)
 
-        # Notify both users (single message each), include TG username if available
-        try:
-            msg_to_liker = f"💞 It's a mutual connection! You and {liked_name_only} liked each other!"
-            if liked_mention:
-                msg_to_liker += f" Feel free to chat {liked_mention}"
-            await context.bot.send_message(chat_id=user_id, text=msg_to_liker)
-
-            msg_to_liked = f"💞 It's a mutual connection! You and {liker_name} liked each other!"
-            if liker_mention:
-                msg_to_liked += f" Feel free to chat {liker_mention}"
-            await context.bot.send_message(chat_id=liked_id, text=msg_to_liked)
-        except Exception as e:
-            logger.error(f"Failed to send mutual messages: {e}")
+        # Notify both users (single message each), include TG username if available.
+        # The liker is waiting on this tap, so theirs goes in the interactive lane.
+        msg_to_liker = f"💞 It's a mutual connection! You and {liked_name_only} liked each other!"
+        if liked_mention:
+            msg_to_liker += f" Feel free to chat {liked_mention}"
+        outbox.send_message(user_id, msg_to_liker, priority=INTERACTIVE)
+
+        msg_to_liked = f"💞 It's a mutual connection! You and {liker_name} liked each other!"
+        if liker_mention:
+            msg_to_liked += f" Feel free to chat {liker_mention}"
+        outbox.send_message(liked_id, msg_to_liked, priority=NOTIFICATION)
 
         # After responding, try to deliver next queued notification to the liked user (they just responded)
         try:
@@ -988,7 +1042,7 @@ async def show_liker_profile(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.answer("Invalid user.")
         return
 
-    liker = users_collection.find_one({"user_id": liker_id})
+    liker = await user_repo.get_user(liker_id)
     if not liker:
         await query.answer("User not found.")
         return
@@ -1037,28 +1091,37 @@ async def show_liker_profile(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
 # ------------------- LEADERBOARD -------------------
-async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    users = list(users_collection.find({"step": "done"}))
-    males = [u for u in users if u.get("gender") == "male"]
-    females = [u for u in users if u.get("gender") == "female"]
+# Rendered once per TTL from the step_gender_likes index; likes in between show up on the next render.
+LEADERBOARD_TTL = 30  # seconds
+_leaderboard = {"expires_at": 0.0, "text": None}
+
 
-    top_males = sorted(males, key=lambda u: len(u.get("liked_by", [])), reverse=True)[:10]
-    top_females = sorted(females, key=lambda u: len(u.get("liked_by", [])), reverse=True)[:10]
+async def _render_leaderboard():
+    top_males = await user_repo.top_by_likes("male", limit=10)
+    top_females = await user_repo.top_by_likes("female", limit=10)
 
     msg = "🏆 *Top 10 Most Liked Profiles*\n\n"
     msg += "*Male:*\n"
     if top_males:
         for i, u in enumerate(top_males, 1):
-            msg += f"{i}. {u.get('name','Unknown')} - ❤️ {len(u.get('liked_by', []))} | Dept: {u.get('department','')} | Year: {u.get('year','')}\n"
+            msg += f"{i}. {u.get('name','Unknown')} - ❤️ {u.get('likes_received', 0)} | Dept: {u.get('department','')} | Year: {u.get('year','')}\n"
     else:
         msg += "No male profiles yet.\n"
 
     msg += "\n*Female:*\n"
     if top_females:
         for i, u in enumerate(top_females, 1):
-            msg += f"{i}. {u.get('name','Unknown')} - ❤️ {len(u.get('liked_by', []))} | Dept: {u.get('department','')} | Year: {u.get('year','')}\n"
+            msg += f"{i}. {u.get('name','Unknown')} - ❤️ {u.get('likes_received', 0)} | Dept: {u.get('department','')} | Year: {u.get('year','')}\n"
     else:
         msg += "No female profiles yet.\n"
+    return msg
+
+
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if _leaderboard["text"] is None or _leaderboard["expires_at"] < time.monotonic():
+        _leaderboard["text"] = await _render_leaderboard()
+        _leaderboard["expires_at"] = time.monotonic() + LEADERBOARD_TTL
+    msg = _leaderboard["text"]
 
     keyboard = [
         [InlineKeyboardButton("🔙 Back to Menu", callback_data="main_menu")]
@@ -1075,10 +1138,95 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("📊 View Leaderboard", callback_data="leaderboard")],
         [InlineKeyboardButton("📢 Broadcast Message", callback_data="broadcast")],
+        [InlineKeyboardButton("📈 Statistics", callback_data="admin_stats")],
         [InlineKeyboardButton("❗ View Open Reports", callback_data="admin_list_reports")]
     ]
     await safe_edit_or_send_message(update, "🛠 Admin Panel:", reply_markup=InlineKeyboardMarkup(keyboard))
 
+# ------------------- REPORTS QUEUE -------------------
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _encode_cursor(cursor):
+    created_at, oid = cursor
+    ms = (created_at - _EPOCH) // timedelta(milliseconds=1)
+    return f"{ms}_{oid}"
+
+
+def _decode_cursor(raw):
+    ms, oid = raw.split("_")
+    return _EPOCH + timedelta(milliseconds=int(ms)), ObjectId(oid)
+
+
+async def admin_list_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # admin_list_reports opens the first page; admin_reports_<ms>_<oid> continues after that report
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMIN_IDS:
+        await safe_edit_or_send_callback(query, "⛔ Only admins can use this.")
+        return
+    after = None
+    if query.data.startswith("admin_reports_"):
+        try:
+            after = _decode_cursor(query.data[len("admin_reports_"):])
+        except Exception:
+            await safe_edit_or_send_callback(query, "Invalid page.")
+            return
+
+    rows, next_after = await report_repo.open_queue_page(after)
+    if not rows:
+        text = "✅ No open reports." if after is None else "✅ No more open reports."
+        keyboard = [[InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")]]
+        await safe_edit_or_send_callback(query, text, reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    names = await user_repo.get_users([r["target_id"] for r in rows], {"name": 1})
+    lines = ["❗ Open reports (oldest first):", ""]
+    keyboard = []
+    for i, r in enumerate(rows, 1):
+        name = names.get(r["target_id"], {}).get("name") or "Unknown"
+        lines.append(f"{i}. {name} (id: {r['target_id']}) — {r['count']} report(s), since {r['first_at']:%Y-%m-%d %H:%M}")
+        keyboard.append([
+            InlineKeyboardButton(f"👁 #{i}", callback_data=f"admin_view_{r['target_id']}"),
+            InlineKeyboardButton(f"🔨 Ban #{i}", callback_data=f"admin_resolve_ban_{r['target_id']}"),
+            InlineKeyboardButton(f"🙈 Ignore #{i}", callback_data=f"admin_resolve_ignore_{r['target_id']}"),
+        ])
+    nav = []
+    if after is not None:
+        nav.append(InlineKeyboardButton("⏮ First page", callback_data="admin_list_reports"))
+    if next_after is not None:
+        nav.append(InlineKeyboardButton("Next ▶", callback_data=f"admin_reports_{_encode_cursor(next_after)}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")])
+    await safe_edit_or_send_callback(query, "\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def admin_resolve_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # admin_resolve_ban_<target> / admin_resolve_ignore_<target>: close every open report on a user at once
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMIN_IDS:
+        await safe_edit_or_send_callback(query, "⛔ Only admins can perform this action.")
+        return
+    try:
+        _, _, action, target = query.data.split("_", 3)
+        target_id = int(target)
+    except Exception:
+        await safe_edit_or_send_callback(query, "Invalid target.")
+        return
+
+    if action == "ban":
+        await user_repo.set_fields(target_id, {"banned": True})
+        outbox.send_message(target_id, "You have been banned from AAU-LinkUp by the admins.", priority=NOTIFICATION)
+        closed = await report_repo.resolve_target(target_id, "resolved", query.from_user.id, datetime.utcnow())
+        text = f"User {target_id} banned; {closed} report(s) resolved."
+    else:
+        closed = await report_repo.resolve_target(target_id, "ignored", query.from_user.id, datetime.utcnow())
+        text = f"{closed} report(s) against {target_id} ignored."
+    keyboard = [[InlineKeyboardButton("❗ Back to Reports", callback_data="admin_list_reports")]]
+    await safe_edit_or_send_callback(query, text, reply_markup=InlineKeyboardMarkup(keyboard))
+
 # ------------------- ADMIN COMMAND -------------------
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -1087,6 +1235,94 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     await show_admin_panel(update, context)
 
+# ------------------- STATS DASHBOARD -------------------
+# Figures are computed by server-side pipelines in a background task and
+# served from here; a tap never waits on an aggregation unless nothing has
+# been computed yet.
+_stats = {"data": None}
+
+
+async def refresh_stats():
+    _stats["data"] = await stats_repo.collect(days=STATS_DAYS)
+
+
+async def refresh_stats_periodically():
+    while True:
+        try:
+            await refresh_stats()
+        except Exception:
+            logger.exception("Failed to refresh admin stats")
+        await asyncio.sleep(STATS_REFRESH_INTERVAL)
+
+
+def _md(value, default="unknown"):
+    return escape_markdown(str(value or default))
+
+
+def _pct(part, whole):
+    return f"{100 * part / whole:.0f}%" if whole else "n/a"
+
+
+def render_stats(data):
+    lines = [f"📈 *Statistics* (as of {data['computed_at']:%Y-%m-%d %H:%M} UTC)", "", "*Onboarding funnel:*"]
+    lines += [f"{_md(row['_id'])}: {row['count']}" for row in data["users"]["steps"]] or ["No users yet."]
+
+    lines += ["", "*Gender → interest (finished profiles):*"]
+    lines += [
+        f"{_md(row['_id'].get('gender'), '?')} → {_md(row['_id'].get('interested_in'), '?')}: {row['count']}"
+        for row in data["users"]["split"]
+    ] or ["No finished profiles yet."]
+
+    lines += ["", f"*Likes / matches, last {data['days']} days:*"]
+    lines += [f"{row['_id']}: ❤️ {row['likes']} | 💞 {row['matches']}" for row in data["likes"]] or ["No likes yet."]
+
+    by_status = {row["_id"]: row["digests"] for row in data["notifications"]["status"]}
+    total = sum(by_status.values())
+    delivered = total - by_status.get("queued", 0)
+    closed = by_status.get("responded", 0) + by_status.get("cancelled", 0)
+    lines += [
+        "",
+        "*Like notifications:*",
+        f"Digests: {total} | delivered {_pct(delivered, total)} | waiting {by_status.get('queued', 0)}",
+        f"Responded: {_pct(by_status.get('responded', 0), closed)} of closed",
+    ]
+    lines += [f"  {_md(row['_id'])}: {row['digests']}" for row in data["notifications"]["response"]]
+
+    lines += ["", f"*Open reports:* {data['reports']['reports']} against {data['reports']['targets']} user(s)"]
+    return "\n".join(lines)
+
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await safe_edit_or_send_message(update, "⛔ Admin panel only available to bot admins.")
+        return
+    if storage.backend != storage.MONGO:
+        await safe_edit_or_send_message(update, "📈 Statistics need the MongoDB storage backend.")
+        return
+    if _stats["data"] is None:
+        try:
+            await refresh_stats()
+        except Exception:
+            logger.exception("Failed to compute admin stats")
+            await safe_edit_or_send_message(update, "❌ Statistics are unavailable right now.")
+            return
+    keyboard = [[InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")]]
+    await safe_edit_or_send_message(update, render_stats(_stats["data"]), parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+
+# ------------------- MAINTENANCE COMMAND -------------------
+async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Admin panel only available to bot admins.")
+        return
+    await update.message.reply_text("🧹 Running maintenance…")
+    try:
+        summary = await maintenance.run(REPORT_ARCHIVE_DAYS)
+    except Exception:
+        logger.exception("Manual maintenance run failed")
+        await update.message.reply_text("❌ Maintenance failed; see logs.")
+        return
+    await update.message.reply_text(maintenance.format_summary(summary))
+
 # ------------------- HELP COMMAND -------------------
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = (
@@ -1111,14 +1347,163 @@ async def ignore_like(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             logger.exception("Failed to mark/deliver notifications after ignore_like for %s", update.callback_query.from_user.id)
 
+# ------------------- DISPATCH TABLES -------------------
+# handle_buttons resolves callback data here: exact matches first, then
+# prefixes ending in "_". Routed handlers load whatever profile data they
+# need themselves, so a tap costs no profile read up front.
+BUTTON_ROUTES = {
+    "main_menu": show_main_menu,
+    "start_onboarding": start_onboarding,
+    "edit_profile": show_edit_menu,
+    "view_profile": show_profile,
+    "find_match": find_match,
+    "leaderboard": show_leaderboard,
+    "admin_panel": show_admin_panel,
+    "admin_stats": show_stats,
+    "broadcast": begin_broadcast,
+    "help_command": help_command,
+}
+
+BUTTON_PREFIXES = {
+    "like_": handle_like,
+    "skip_": skip_candidate,
+    "edit_": begin_edit,
+    "gender_": choose_gender,
+    "interest_": choose_interest,
+    "report_": file_report,
+    "admin_view_": admin_view_profile,
+    "admin_ban_": admin_ban_user,
+    "admin_ignore_": admin_ignore_report,
+}
+
+# handle_buttons is one registered handler; time what it dispatches to as well
+metrics.instrument_routes(BUTTON_ROUTES)
+metrics.instrument_routes(BUTTON_PREFIXES)
+
+
+def _button_route(data):
+    route = BUTTON_ROUTES.get(data)
+    if route:
+        return route
+    # at most two probes: "admin_view_42" tries "admin_view_", then "admin_"
+    parts = data.split("_", 2)
+    for n in (2, 1):
+        if len(parts) > n:
+            route = BUTTON_PREFIXES.get("_".join(parts[:n]) + "_")
+            if route:
+                return route
+    return None
+
 # ------------------- APP SETUP -------------------
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # group -1: runs before every other handler, so a re-delivered update does no DB work
+    if await dedup.deduplicator.is_duplicate(update.update_id):
+        logger.info("Dropping duplicate update %s", update.update_id)
+        raise ApplicationHandlerStop
+
+
+async def migrate_social_graph():
+    try:
+        await edge_repo.migrate_user_arrays()
+        # counts are derived from edges, so only after the arrays are moved
+        await edge_repo.backfill_like_counts()
+    except Exception:
+        logger.exception("Social-graph migration failed")
+
+
+leader_election = None  # set in replica mode
+
+
+def _split_send_rate(live_replicas):
+    ratelimit.global_bucket.set_rate(ratelimit.GLOBAL_RATE / max(1, live_replicas))
+
+
+async def post_init(application: Application):
+    global leader_election
+    mongo = storage.backend == storage.MONGO
+    if REPLICA_MODE:
+        state.use_mongo()
+        drafts.use_store(state.store)
+    outbox.start(application.bot)
+    if mongo:
+        # must precede the one-queued / one-sent digest per recipient indexes
+        await notification_repo.collapse_legacy_rows()
+        cancelled = await notification_repo.collapse_duplicate_sent(_get_current_utc())
+        if cancelled:
+            logger.info("Cancelled %s duplicate sent notification(s) before indexing", cancelled)
+        await indexes.ensure_indexes(
+            notification_retention_days=NOTIFICATION_RETENTION_DAYS,
+            update_dedup_window=UPDATE_DEDUP_WINDOW if UPDATE_DEDUP_SHARED else None,
+        )
+        await indexes.report_collscans()
+        await edge_repo.backfill_like_pairs()
+    # per-process buffers and caches: every replica runs these
+    application.create_task(usernames.run_flusher())
+    application.create_task(drafts.run_checkpointer())
+    # claims are atomic, so replicas delivering the same recipient cannot double-send
+    await seed_notification_scheduler()
+    application.create_task(notification_scheduler.run())
+    if mongo:
+        application.create_task(refresh_stats_periodically())
+
+    # exactly one runner: the lease holder in replica mode, else this process
+    background_jobs = [
+        lambda: maintenance.run_periodically(REPORT_ARCHIVE_DAYS, MAINTENANCE_INTERVAL),
+        lambda: broadcast.watch_jobs(application),
+    ]
+    if mongo:
+        # Move legacy likes/liked_by/passed arrays into edges without blocking startup
+        background_jobs.insert(0, migrate_social_graph)
+    if REPLICA_MODE:
+        leader_election = leader.Leader(background_jobs, on_replica_count=_split_send_rate)
+        application.create_task(leader_election.run())
+    else:
+        for job in background_jobs:
+            application.create_task(job())
+
+
+async def post_shutdown(application: Application):
+    if leader_election:
+        await leader_election.stop()
+    await outbox.stop()
+    # don't lose username changes still waiting for the periodic flush
+    try:
+        await usernames.flush()
+    except Exception:
+        logger.exception("Failed to flush username changes on shutdown")
+    try:
+        await drafts.flush()
+    except Exception:
+        logger.exception("Failed to checkpoint onboarding drafts on shutdown")
+    storage.close()
+
+
+def build_application(request=None):
+    """
+    Build the Application with every handler registered. `request` replaces
+    the bot's HTTP layer (benchmark.py passes one that records calls instead).
+    """
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(update_processor.PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
+
+    dedup.deduplicator.window = UPDATE_DEDUP_WINDOW
+    dedup.deduplicator.shared = UPDATE_DEDUP_SHARED
+    app.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-1)
 
     # --- Command Handlers ---
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("admin", admin_command))
+    app.add_handler(CommandHandler("maintenance", maintenance_command))
+    app.add_handler(CommandHandler("stats", show_stats))
 
     # --- Message Handlers ---
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -1131,7 +1516,8 @@ def main():
     app.add_handler(CallbackQueryHandler(ignore_like, pattern="ignore_like"))
 
     # Admin action handlers
-    app.add_handler(CallbackQueryHandler(lambda u, c: None, pattern=r"^admin_list_reports$"))  # placeholder if you want to implement listing
+    app.add_handler(CallbackQueryHandler(admin_list_reports, pattern=r"^admin_(list_reports$|reports_)"))
+    app.add_handler(CallbackQueryHandler(admin_resolve_reports, pattern=r"^admin_resolve_(ban|ignore)_"))
     app.add_handler(CallbackQueryHandler(handle_buttons, pattern=r"^admin_view_"))  # route to handle_buttons for admin_view_
     app.add_handler(CallbackQueryHandler(handle_buttons, pattern=r"^admin_ban_"))  # route to handle_buttons for admin_ban_
     app.add_handler(CallbackQueryHandler(handle_buttons, pattern=r"^admin_ignore_"))  # route to handle_buttons for admin_ignore_
@@ -1139,14 +1525,71 @@ def main():
     # --- Keep this last! (generic handler) ---
     app.add_handler(CallbackQueryHandler(handle_buttons))
 
+    metrics.instrument_application(app)
+    return app
+
+
+# ------------------- WEBHOOK SERVER -------------------
+async def receive_update(request):
+    application = request.app["application"]
+    try:
+        update = Update.de_json(await request.json(), application.bot)
+    except Exception:
+        logger.warning("Ignoring malformed webhook payload")
+        return web.Response(status=400)
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+async def serve_metrics(request):
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return web.Response(status=401)
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+async def run_webhook_server(application: Application):
+    """
+    Serve the webhook (at /<token>, like before) and /metrics from one aiohttp
+    server. Mirrors Application.run_webhook's lifecycle: initialize, post_init,
+    start, stop on SIGINT/SIGTERM, then post_shutdown and shutdown.
+    """
+    web_app = web.Application()
+    web_app["application"] = application
+    web_app.router.add_post(f"/{BOT_TOKEN}", receive_update)
+    web_app.router.add_get("/metrics", serve_metrics)
+    runner = web.AppRunner(web_app)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # e.g. Windows; Ctrl+C still cancels asyncio.run
+
+    await application.initialize()
+    try:
+        await post_init(application)
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", PORT).start()
+        await application.bot.set_webhook(url=f"{BASE_URL}/{BOT_TOKEN}")
+        logger.info("Webhook server listening on port %s", PORT)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+
+
+def main():
+    app = build_application()
+
     # Use webhook if BASE_URL is provided, otherwise fallback to polling (convenient for local dev)
     if BASE_URL:
-        app.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=BOT_TOKEN,  # Use token as the URL path
-            webhook_url=f"{BASE_URL}/{BOT_TOKEN}",
-        )
+        asyncio.run(run_webhook_server(app))
     else:
         logger.info("BASE_URL not set; starting polling mode.")
         app.run_polling()
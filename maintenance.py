@@ -0,0 +1,78 @@
+"""
+Storage maintenance.
+
+Closed like notifications are removed by MongoDB's TTL monitor (see
+data/indexes.py); this job backfills closed_at on rows that predate it and
+archives closed reports into monthly summaries. It runs on a timer and on
+demand through the admin /maintenance command, which reports how much data
+each collection shed.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from pymongo.errors import PyMongoError
+
+from data import db
+from data import storage
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ("like_notifications", "reports", "report_summaries")
+
+
+async def _sizes():
+    sizes = {}
+    if storage.backend != storage.MONGO:
+        return sizes
+    for name in COLLECTIONS:
+        try:
+            stats = await getattr(db, name).command("collStats")
+        except PyMongoError:
+            logger.exception("collStats failed for %s", name)
+            continue
+        sizes[name] = {"count": stats.get("count", 0), "size": stats.get("size", 0), "storage": stats.get("storageSize", 0)}
+    return sizes
+
+
+async def run(report_archive_days):
+    """
+    Run one maintenance pass and return a summary dict: rows touched plus
+    per-collection document count and data size before and after.
+    """
+    now = datetime.utcnow()
+    before = await _sizes()
+    backfilled = await storage.notifications.backfill_closed_at(now)
+    archived = await storage.reports.archive_closed_reports(now - timedelta(days=report_archive_days))
+    after = await _sizes()
+    logger.info("Maintenance: archived %s report(s), stamped closed_at on %s notification(s)", archived, backfilled)
+    return {"archived_reports": archived, "backfilled_notifications": backfilled, "before": before, "after": after}
+
+
+def _mb(n):
+    return f"{n / 1_048_576:.2f} MB"
+
+
+def format_summary(summary):
+    lines = [
+        "🧹 Maintenance finished.",
+        f"Reports archived: {summary['archived_reports']}",
+        f"Notifications queued for TTL expiry: {summary['backfilled_notifications']}",
+        "",
+    ]
+    for name, after in summary["after"].items():
+        before = summary["before"].get(name, after)
+        lines.append(
+            f"{name}: {after['count']} docs, {_mb(after['size'])} "
+            f"(reclaimed {_mb(max(0, before['size'] - after['size']))}; on disk {_mb(after['storage'])})"
+        )
+    return "\n".join(lines)
+
+
+async def run_periodically(report_archive_days, interval):
+    while True:
+        try:
+            await run(report_archive_days)
+        except Exception:
+            logger.exception("Maintenance pass failed")
+        await asyncio.sleep(interval)
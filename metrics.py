@@ -0,0 +1,321 @@
+"""
+Per-handler latency, MongoDB and Bot API instrumentation.
+
+Every registered handler is wrapped by instrument_application(): each call
+records its wall time plus how many Mongo commands and Bot API requests it
+issued and how long those took. Attribution goes through a context variable
+holding the running handler's tally; Mongo commands see it because data.db
+runs them in the caller's context, Bot API requests because they are awaited
+inside the handler. Work a handler hands off (outbox sends, background tasks)
+is still counted in the global per-command / per-method histograms, just not
+charged to the handler.
+
+Counters kept elsewhere (username and profile cache hits, the outbox's
+depth, totals and latency) are read at scrape time. render() returns
+everything in the Prometheus text format; main.py serves it at /metrics.
+"""
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+from telegram.ext import ApplicationHandlerStop
+
+from data import usernames
+from data import users as profile_cache
+from outbox import outbox
+
+# seconds, Prometheus' default buckets plus a 30s tail for rate-limited sends
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, one series per label combination. observe() is
+    called from Mongo worker threads as well as the event loop, hence the lock.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total, n)) for labels, (counts, total, n) in self._series.items())
+        for labels, (counts, total, n) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="%s"' % (bound if isinstance(bound, str) else f"{bound:g}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {n}")
+        return lines
+
+
+class Collected:
+    """
+    A metric whose values live elsewhere: collect() is called at scrape time
+    and returns {label values: value}.
+    """
+
+    def __init__(self, name, help, kind, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+def _outbox_latency():
+    stats = outbox.metrics()
+    return {("0.5",): stats["latency_p50"], ("0.95",): stats["latency_p95"], ("0.99",): stats["latency_p99"]}
+
+
+handler_seconds = Histogram(
+    "bot_handler_duration_seconds", "Wall time of one handler call.", ["handler"])
+handler_db_operations = Histogram(
+    "bot_handler_db_operations", "MongoDB commands issued by one handler call.", ["handler"], COUNT_BUCKETS)
+handler_db_seconds = Histogram(
+    "bot_handler_db_seconds", "Total MongoDB command time of one handler call.", ["handler"])
+handler_bot_calls = Histogram(
+    "bot_handler_api_calls", "Bot API requests made by one handler call.", ["handler"], COUNT_BUCKETS)
+handler_bot_seconds = Histogram(
+    "bot_handler_api_seconds", "Total Bot API request time of one handler call.", ["handler"])
+handler_errors = Counter(
+    "bot_handler_errors_total", "Handler calls that raised.", ["handler"])
+db_command_seconds = Histogram(
+    "bot_db_command_duration_seconds", "MongoDB command round trips, from any caller.", ["command", "outcome"])
+bot_api_seconds = Histogram(
+    "bot_api_request_duration_seconds", "Bot API requests, from any caller.", ["method"])
+
+username_cache = Collected(
+    "bot_username_cache_lookups_total", "Username cache lookups; misses queue a write.", "counter", ["result"],
+    lambda: {("hit",): usernames.stats["hits"], ("miss",): usernames.stats["misses"]})
+username_writes = Collected(
+    "bot_username_writes_total", "Username changes written by the periodic flush.", "counter", [],
+    lambda: {(): usernames.stats["flushed"]})
+profile_cache_lookups = Collected(
+    "bot_profile_cache_lookups_total", "Profile cache lookups (MongoDB backend).", "counter", ["result"],
+    lambda: {("hit",): profile_cache.cache_stats["hits"], ("miss",): profile_cache.cache_stats["misses"]})
+outbox_depth = Collected(
+    "bot_outbox_depth", "Messages waiting in the outbox, per lane.", "gauge", ["lane"],
+    lambda: {(lane,): n for lane, n in outbox.metrics()["depth"].items()})
+outbox_messages = Collected(
+    "bot_outbox_messages_total", "Outbox sends by outcome; retried counts retry attempts.", "counter", ["outcome"],
+    lambda: {(outcome,): outbox.stats[outcome] for outcome in ("sent", "failed", "retried")})
+outbox_latency = Collected(
+    "bot_outbox_latency_seconds", "Enqueue-to-delivery time over the last sends, by quantile.", "gauge", ["quantile"],
+    _outbox_latency)
+
+REGISTRY = [
+    handler_seconds, handler_db_operations, handler_db_seconds, handler_bot_calls, handler_bot_seconds,
+    handler_errors, db_command_seconds, bot_api_seconds,
+    username_cache, username_writes, profile_cache_lookups, outbox_depth, outbox_messages, outbox_latency,
+]
+
+
+class _Tally:
+    __slots__ = ("db_ops", "db_seconds", "bot_calls", "bot_seconds")
+
+    def __init__(self):
+        self.db_ops = 0
+        self.db_seconds = 0.0
+        self.bot_calls = 0
+        self.bot_seconds = 0.0
+
+
+_current = contextvars.ContextVar("metrics_handler_tally", default=None)
+_tally_lock = threading.Lock()  # a handler may await several Mongo calls at once (gather)
+
+
+def _charge_db(seconds):
+    tally = _current.get()
+    if tally is not None:
+        with _tally_lock:
+            tally.db_ops += 1
+            tally.db_seconds += seconds
+
+
+def _charge_bot(seconds):
+    tally = _current.get()
+    if tally is not None:
+        tally.bot_calls += 1
+        tally.bot_seconds += seconds
+
+
+# ------------------- HANDLERS -------------------
+def instrument(fn, name=None):
+    """
+    Wrap a handler coroutine function so every call is measured under `name`
+    (default: the function's name). A handler called from another one (e.g.
+    find_match routed through handle_buttons) is measured on its own and also
+    counts towards its caller.
+    """
+    name = name or fn.__name__
+    if getattr(fn, "__instrumented__", False):
+        return fn
+
+    @functools.wraps(fn)
+    async def measured(*args, **kwargs):
+        parent = _current.get()
+        tally = _Tally()
+        token = _current.set(tally)
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            handler_seconds.observe(elapsed, name)
+            handler_db_operations.observe(tally.db_ops, name)
+            handler_db_seconds.observe(tally.db_seconds, name)
+            handler_bot_calls.observe(tally.bot_calls, name)
+            handler_bot_seconds.observe(tally.bot_seconds, name)
+            if parent is not None:
+                with _tally_lock:
+                    parent.db_ops += tally.db_ops
+                    parent.db_seconds += tally.db_seconds
+                parent.bot_calls += tally.bot_calls
+                parent.bot_seconds += tally.bot_seconds
+
+    measured.__instrumented__ = True
+    return measured
+
+
+def instrument_routes(table):
+    """
+    Wrap the handlers of a {key: handler} dispatch table in place.
+    """
+    for key, fn in table.items():
+        table[key] = instrument(fn)
+
+
+def instrument_application(application):
+    """
+    Wrap every handler registered on the application and time its Bot API
+    requests. Call after all handlers are added.
+    """
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument(handler.callback)
+    instrument_request(application.bot.request)
+
+
+# ------------------- MONGO -------------------
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Times every command the MongoClient sends. Pass an instance to
+    data.db.init_db (event_listeners=[...]).
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        db_command_seconds.observe(seconds, event.command_name, "ok")
+        _charge_db(seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        db_command_seconds.observe(seconds, event.command_name, "error")
+        _charge_db(seconds)
+
+
+# ------------------- BOT API -------------------
+def instrument_request(request):
+    """
+    Time every call that goes through `request` (a telegram BaseRequest), by
+    Bot API method. Patched on the instance so any request class works.
+    """
+    do_request = request.do_request
+    if getattr(do_request, "__instrumented__", False):
+        return
+
+    @functools.wraps(do_request)
+    async def measured(url, *args, **kwargs):
+        # the url ends in /bot<token>/<method>; only the method is kept
+        method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await do_request(url, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            bot_api_seconds.observe(elapsed, method)
+            _charge_bot(elapsed)
+
+    measured.__instrumented__ = True
+    request.do_request = measured
+
+
+# ------------------- EXPOSITION -------------------
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
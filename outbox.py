@@ -0,0 +1,169 @@
+"""
+Central outbound message queue.
+
+Every proactive send (mutual-match messages, like notifications, admin report
+alerts, ban notices, broadcasts) goes through one priority queue drained by a
+small pool of workers. Interactive results go ahead of notifications, which go
+ahead of bulk traffic. Workers share the rate limiters in ratelimit.py, pause
+everything on RetryAfter and retry transient network errors with exponential
+backoff. send_message() returns a future the caller may await for the sent
+Message (or the final error), or ignore.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+import ratelimit
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, NOTIFICATION, BULK = 0, 1, 2
+LANES = {INTERACTIVE: "interactive", NOTIFICATION: "notification", BULK: "bulk"}
+
+WORKERS = 8
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0  # seconds; doubled on every retry of a transient error
+
+
+class _Entry:
+    __slots__ = ("priority", "seq", "chat_id", "kwargs", "future", "enqueued_at", "attempts")
+
+    def __init__(self, priority, seq, chat_id, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _consume_exception(future):
+    # failures are logged by the worker; don't warn about unawaited futures
+    if not future.cancelled():
+        future.exception()
+
+
+class Outbox:
+    def __init__(self):
+        self._queue = None
+        self._workers = []
+        self._bot = None
+        self._seq = itertools.count()
+        self.depth = {lane: 0 for lane in LANES}
+        self.latencies = deque(maxlen=2000)  # seconds from enqueue to delivery
+        self.stats = {"sent": 0, "failed": 0, "retried": 0}
+        self.unsettled = 0  # sends queued, in flight or waiting to retry
+
+    def start(self, bot, workers=WORKERS):
+        self._bot = bot
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+        logger.info("Outbox started with %s workers", workers)
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def send_message(self, chat_id, text, priority=NOTIFICATION, **kwargs):
+        """
+        Queue a send_message call. Returns a future resolving to the sent Message.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        future.add_done_callback(self._settled)
+        self.unsettled += 1
+        kwargs["text"] = text
+        self._put(_Entry(priority, next(self._seq), chat_id, kwargs, future))
+        return future
+
+    def _settled(self, future):
+        self.unsettled -= 1
+
+    async def drain(self, poll=0.05):
+        """
+        Wait until every send queued so far was delivered or given up on.
+        """
+        while self.unsettled:
+            await asyncio.sleep(poll)
+
+    def _put(self, entry):
+        self.depth[entry.priority] += 1
+        self._queue.put_nowait(entry)
+
+    def _retry_later(self, entry, delay):
+        self.stats["retried"] += 1
+        asyncio.get_running_loop().call_later(delay, self._put, entry)
+
+    async def _worker(self):
+        while True:
+            entry = await self._queue.get()
+            self.depth[entry.priority] -= 1
+            entry.attempts += 1
+            await ratelimit.global_bucket.acquire()
+            await ratelimit.chat_limiter.acquire(entry.chat_id)
+            try:
+                message = await self._bot.send_message(chat_id=entry.chat_id, **entry.kwargs)
+            except RetryAfter as e:
+                delay = ratelimit.retry_after_seconds(e)
+                ratelimit.global_bucket.pause(delay)
+                if entry.attempts < MAX_ATTEMPTS:
+                    logger.warning("Flood control on chat %s; retrying in %.1fs", entry.chat_id, delay)
+                    self._retry_later(entry, delay)
+                    continue
+                self._fail(entry, e)
+            except BadRequest as e:
+                # a NetworkError subclass in python-telegram-bot, but resending won't help
+                self._fail(entry, e)
+            except NetworkError as e:
+                # TimedOut is a NetworkError; Forbidden is not
+                if entry.attempts < MAX_ATTEMPTS:
+                    self._retry_later(entry, BACKOFF_BASE * 2 ** (entry.attempts - 1))
+                    continue
+                self._fail(entry, e)
+            except TelegramError as e:
+                self._fail(entry, e)
+            except Exception as e:
+                # anything else is a bug, not a delivery problem; keep the worker alive and fail the caller
+                logger.exception("Outbox send to chat %s raised unexpectedly", entry.chat_id)
+                self._fail(entry, e)
+            else:
+                self.stats["sent"] += 1
+                self.latencies.append(time.monotonic() - entry.enqueued_at)
+                if not entry.future.done():
+                    entry.future.set_result(message)
+
+    def _fail(self, entry, exc):
+        self.stats["failed"] += 1
+        logger.info("Outbox gave up on chat %s after %s attempt(s): %s", entry.chat_id, entry.attempts, exc)
+        if not entry.future.done():
+            entry.future.set_exception(exc)
+
+    def metrics(self):
+        """
+        Queue depth per lane, counters and send-latency percentiles (seconds).
+        """
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return lat[min(len(lat) - 1, int(p * len(lat)))] if lat else 0.0
+
+        return {
+            "depth": {name: self.depth[lane] for lane, name in LANES.items()},
+            **self.stats,
+            "latency_p50": pct(0.50),
+            "latency_p95": pct(0.95),
+            "latency_p99": pct(0.99),
+        }
+
+
+outbox = Outbox()
@@ -0,0 +1,85 @@
+"""
+Async rate limiters matching Telegram's outbound limits: roughly 30 messages
+per second across all chats, and about one message per second to any single
+chat.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+GLOBAL_RATE = 30  # messages per second, bot-wide
+PER_CHAT_INTERVAL = 1.0  # seconds between messages to the same chat
+
+
+class TokenBucket:
+    """
+    Classic token bucket. acquire() waits until a token is available; pause()
+    stops every acquirer for a while (used when Telegram answers RetryAfter).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def set_rate(self, rate):
+        """
+        Change the refill rate (and capacity), e.g. to split a shared limit between replicas.
+        """
+        self.rate = rate
+        self.capacity = rate
+        self._tokens = min(self._tokens, self.capacity)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class PerChatLimiter:
+    """
+    Spaces messages to the same chat at least `interval` seconds apart.
+    Remembers the most recent `max_chats` chats only.
+    """
+
+    def __init__(self, interval=PER_CHAT_INTERVAL, max_chats=50_000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next_slot = OrderedDict()  # chat_id -> earliest monotonic time of the next send
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(chat_id, 0.0))
+        self._next_slot[chat_id] = slot + self.interval
+        self._next_slot.move_to_end(chat_id)
+        if len(self._next_slot) > self.max_chats:
+            self._next_slot.popitem(last=False)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def retry_after_seconds(exc):
+    """
+    RetryAfter.retry_after is an int in older python-telegram-bot releases and a timedelta in newer ones.
+    """
+    delay = exc.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+global_bucket = TokenBucket(GLOBAL_RATE)
+chat_limiter = PerChatLimiter()
@@ -0,0 +1,84 @@
+"""
+Time-driven delivery scheduler for like notifications.
+
+Keeps a min-heap of recipients keyed on the time their next notification may
+go out. The run loop sleeps until the earliest entry is due (or until an
+earlier one is scheduled), then hands every due recipient to `deliver` in one
+batch. Nothing polls the notifications collection.
+"""
+import asyncio
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+
+
+class DeliveryScheduler:
+    def __init__(self, deliver, clock, batch_size=BATCH_SIZE):
+        """
+        deliver: coroutine function taking a recipient_id.
+        clock: callable returning the current time (a naive UTC datetime).
+        """
+        self._deliver = deliver
+        self._clock = clock
+        self._batch_size = batch_size
+        self._heap = []  # (due_at, recipient_id); stale entries are skipped lazily
+        self._due = {}  # recipient_id -> the due_at currently in force
+        self._wake = asyncio.Event()
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, recipient_id, due_at):
+        """
+        Deliver to recipient_id no earlier than due_at. An earlier pending time wins.
+        """
+        current = self._due.get(recipient_id)
+        if current is not None and current <= due_at:
+            return
+        self._due[recipient_id] = due_at
+        heapq.heappush(self._heap, (due_at, recipient_id))
+        if self._heap[0] == (due_at, recipient_id):
+            self._wake.set()
+
+    def pop_due(self, now):
+        """
+        Remove and return up to batch_size recipients whose time has come.
+        """
+        due = []
+        while self._heap and len(due) < self._batch_size:
+            due_at, recipient_id = self._heap[0]
+            if self._due.get(recipient_id) != due_at:
+                heapq.heappop(self._heap)  # superseded by an earlier schedule()
+                continue
+            if due_at > now:
+                break
+            heapq.heappop(self._heap)
+            del self._due[recipient_id]
+            due.append(recipient_id)
+        return due
+
+    def seconds_until_next(self, now):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max((self._heap[0][0] - now).total_seconds(), 0.0)
+
+    async def run(self):
+        while True:
+            self._wake.clear()
+            now = self._clock()
+            due = self.pop_due(now)
+            if due:
+                results = await asyncio.gather(*(self._deliver(r) for r in due), return_exceptions=True)
+                for recipient_id, result in zip(due, results):
+                    if isinstance(result, Exception):
+                        logger.error("Scheduled notification delivery to %s failed", recipient_id, exc_info=result)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.seconds_until_next(now))
+            except asyncio.TimeoutError:
+                pass
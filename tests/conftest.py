@@ -0,0 +1,141 @@
+"""
+Shared test setup. The bot runs on the in-memory storage backend with a fake
+Bot API under it (benchmark.RecordingRequest), so handler tests need neither
+MongoDB nor the network. Every test starts from empty storage and fresh
+in-process caches, and with the outbound rate limits lifted.
+"""
+import asyncio
+import os
+import sys
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# main.py reads its configuration (and picks the storage backend) at import
+os.environ.update({
+    "BOT_TOKEN": "123456:test",
+    "ADMIN_ID": "1",
+    "ADMIN_CHANNEL_ID": "",
+    "BASE_URL": "",
+    "STORAGE_BACKEND": "memory",
+    "STORAGE_LOG_PATH": "",
+    "REPLICA_MODE": "false",
+    "UPDATE_DEDUP_SHARED": "false",
+})
+
+import pytest  # noqa: E402
+from telegram import Update  # noqa: E402
+
+import benchmark  # noqa: E402
+import dedup  # noqa: E402
+import main  # noqa: E402
+import ratelimit  # noqa: E402
+from data import drafts, state, storage, usernames  # noqa: E402
+from outbox import outbox  # noqa: E402
+from scheduler import DeliveryScheduler  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_bot_state(monkeypatch):
+    storage.use_memory()
+    for name, repo in (
+        ("user_repo", storage.users),
+        ("report_repo", storage.reports),
+        ("notification_repo", storage.notifications),
+        ("deck_repo", storage.decks),
+        ("edge_repo", storage.edges),
+    ):
+        monkeypatch.setattr(main, name, repo)
+    monkeypatch.setattr(dedup, "deduplicator", dedup.UpdateDeduplicator())
+    monkeypatch.setattr(state, "store", state.MemoryStore())
+    monkeypatch.setattr(drafts, "_drafts", OrderedDict())
+    monkeypatch.setattr(drafts, "_dirty", {})
+    monkeypatch.setattr(usernames, "_known", OrderedDict())
+    monkeypatch.setattr(usernames, "_pending", {})
+    monkeypatch.setattr(main, "notification_scheduler", DeliveryScheduler(main._deliver_scheduled, main._get_current_utc))
+    # tests check behaviour, not Telegram's pacing
+    monkeypatch.setattr(ratelimit, "global_bucket", ratelimit.TokenBucket(10_000))
+    monkeypatch.setattr(ratelimit, "chat_limiter", ratelimit.PerChatLimiter(interval=0))
+
+
+class CapturingRequest(benchmark.RecordingRequest):
+    """
+    RecordingRequest that also keeps every call's endpoint and parameters, in order.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.log = []
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        self.log.append((url.rsplit("/", 1)[-1], dict(request_data.parameters) if request_data else {}))
+        return await super().do_request(url, method, request_data, **kwargs)
+
+    def texts(self, chat_id, endpoint="sendMessage"):
+        return [
+            params.get("text") or params.get("caption")
+            for name, params in self.log
+            if name == endpoint and int(params.get("chat_id") or 0) == chat_id
+        ]
+
+
+class BotHarness:
+    """
+    The application main.py builds, fed raw updates the way the webhook
+    delivers them. Use as `async with BotHarness() as bot:`; leaving the block
+    waits for the outbox to drain.
+    """
+
+    def __init__(self):
+        self.request = CapturingRequest()
+        self.app = main.build_application(request=self.request)
+        self.build = benchmark.StreamBuilder()
+        self.errors = []
+
+        async def record_error(update, context):
+            self.errors.append(context.error)
+
+        self.app.add_error_handler(record_error)
+
+    async def __aenter__(self):
+        await self.app.initialize()
+        outbox.start(self.app.bot)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await outbox.drain()
+        await outbox.stop()
+        await self.app.shutdown()
+
+    async def feed(self, *raw_updates):
+        """
+        Process the updates concurrently, in arrival order, and wait for all of
+        them. Re-raises the first handler error.
+        """
+        updates = [Update.de_json(raw, self.app.bot) for raw in raw_updates]
+        await asyncio.gather(*(
+            self.app.update_processor.process_update(update, self.app.process_update(update))
+            for update in updates
+        ))
+        if self.errors:
+            raise self.errors[0]
+
+    def onboarding(self, user_id, gender, interest, name=None):
+        build = self.build
+        return [
+            build.text(user_id, "/start"),
+            build.button(user_id, "start_onboarding"),
+            build.text(user_id, name or f"User {user_id}"),
+            build.text(user_id, "Computer Science"),
+            build.text(user_id, "2nd"),
+            build.button(user_id, f"gender_{gender}"),
+            build.text(user_id, "21"),
+            build.photo(user_id),
+            build.button(user_id, f"interest_{interest}"),
+            build.text(user_id, "Here for study buddies."),
+        ]
+
+    async def onboard(self, user_id, gender, interest, name=None):
+        for raw in self.onboarding(user_id, gender, interest, name):
+            await self.feed(raw)
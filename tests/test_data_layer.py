@@ -0,0 +1,77 @@
+"""
+The repository layer hands blocking pymongo calls to a thread pool, so a slow
+query holds up only the update that issued it.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import BotHarness
+from data import db, storage
+
+
+class BlockingCollection:
+    """
+    pymongo Collection stand-in whose find_one blocks its worker thread until
+    `parties` calls are inside at the same time (or fails after 5 s).
+    """
+
+    name = "users"
+
+    def __init__(self, parties, delay=0.0):
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.delay = delay
+
+    def find_one(self, query):
+        self.barrier.wait()
+        time.sleep(self.delay)
+        return {"user_id": query["user_id"]}
+
+
+def test_concurrent_queries_overlap():
+    async def scenario():
+        users = db.AsyncCollection(BlockingCollection(2), ThreadPoolExecutor(4))
+        return await asyncio.gather(users.find_one({"user_id": 1}), users.find_one({"user_id": 2}))
+
+    # run one after the other, the first call would never get past the barrier
+    assert asyncio.run(scenario()) == [{"user_id": 1}, {"user_id": 2}]
+
+
+def test_event_loop_keeps_serving_during_a_slow_query():
+    async def scenario():
+        users = db.AsyncCollection(BlockingCollection(1, delay=0.3), ThreadPoolExecutor(1))
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await users.find_one({"user_id": 1})
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 10
+
+
+def test_updates_from_two_users_overlap():
+    async def scenario():
+        async with BotHarness() as bot:
+            both_inside = asyncio.Barrier(2)
+            get_user = storage.users.get_user
+
+            async def slow_get_user(user_id, projection=None):
+                # each /start waits here until the other one has arrived too
+                await asyncio.wait_for(both_inside.wait(), 5)
+                return await get_user(user_id, projection)
+
+            storage.users.get_user = slow_get_user
+            await bot.feed(bot.build.text(100, "/start"), bot.build.text(200, "/start"))
+            return bot.request.texts(100), bot.request.texts(200)
+
+    texts_100, texts_200 = asyncio.run(scenario())
+    assert any("Welcome to AAU-LinkUp" in t for t in texts_100)
+    assert any("Welcome to AAU-LinkUp" in t for t in texts_200)
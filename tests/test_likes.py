@@ -0,0 +1,128 @@
+"""
+Likes are recorded idempotently and a mutual like is detected atomically:
+when two users like each other at the same moment, exactly one of the two
+likes reports the match, so one mutual notification pair goes out. A like
+stays new until its counter bump is marked done.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from conftest import BotHarness
+from data import db, edges
+
+MUTUAL = "It's a mutual connection"
+
+
+class FakeEdges:
+    """
+    Stand-in for db.edges: like edges upserted by (liker, target), returning
+    the pre-image, plus the counted flag. Yields to the event loop first so
+    concurrent callers interleave.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.fail_next = False
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        await asyncio.sleep(0)
+        if self.fail_next:
+            self.fail_next = False
+            raise AutoReconnect("connection reset")
+        key = (query["liker_id"], query["target_id"])
+        before = self.docs.get(key)
+        if before is None:
+            self.docs[key] = dict(update["$setOnInsert"])
+        return dict(before) if before else None
+
+    async def update_one(self, query, update):
+        self.docs[(query["liker_id"], query["target_id"])].update(update["$set"])
+
+
+class FakePairs:
+    """
+    Stand-in for db.like_pairs: find_one_and_update with $addToSet, returning
+    the pre-image (None when the upsert created the document).
+    """
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        await asyncio.sleep(0)
+        doc = self.docs.get(query["_id"])
+        before = {"likes": list(doc["likes"])} if doc else None
+        doc = self.docs.setdefault(query["_id"], {"likes": []})
+        liker_id = update["$addToSet"]["likes"]
+        if liker_id not in doc["likes"]:
+            doc["likes"].append(liker_id)
+        return before
+
+
+@pytest.fixture
+def fake_graph(monkeypatch):
+    graph = SimpleNamespace(edges=FakeEdges(), pairs=FakePairs())
+    monkeypatch.setattr(db, "edges", graph.edges)
+    monkeypatch.setattr(db, "like_pairs", graph.pairs)
+    return graph
+
+
+def test_racing_likes_report_exactly_one_mutual(fake_graph):
+    async def scenario():
+        return await asyncio.gather(edges.record_like(1, 2), edges.record_like(2, 1))
+
+    results = asyncio.run(scenario())
+    assert all(new for new, _ in results)
+    assert sorted(mutual for _, mutual in results) == [False, True]
+
+
+def test_repeat_like_is_not_new(fake_graph):
+    async def scenario():
+        first = await edges.record_like(1, 2)
+        await edges.mark_counted(1, 2)
+        return first, await edges.record_like(1, 2)
+
+    assert asyncio.run(scenario()) == ((True, False), (False, False))
+
+
+def test_like_whose_counter_bump_failed_is_new_on_retry(fake_graph):
+    async def scenario():
+        # the first tap's likes_received bump failed, so mark_counted never ran
+        await edges.record_like(1, 2)
+        return await edges.record_like(1, 2)
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_like_retried_after_a_failed_edge_write_is_recorded(fake_graph):
+    async def scenario():
+        await edges.record_like(2, 1)
+        fake_graph.edges.fail_next = True
+        with pytest.raises(AutoReconnect):
+            await edges.record_like(1, 2)
+        # the pair write went through; the retry must still count as a new, mutual like
+        return await edges.record_like(1, 2)
+
+    assert asyncio.run(scenario()) == (True, True)
+    assert (1, 2) in fake_graph.edges.docs
+
+
+def test_simultaneous_likes_send_one_mutual_pair():
+    pairs = [(100 + i, 200 + i) for i in range(5)]
+
+    async def scenario():
+        async with BotHarness() as bot:
+            for a, b in pairs:
+                await bot.onboard(a, "male", "female")
+                await bot.onboard(b, "female", "male")
+            build = bot.build
+            await bot.feed(*(raw for a, b in pairs for raw in (build.button(a, f"like_{b}"), build.button(b, f"like_{a}"))))
+        return bot.request
+
+    request = asyncio.run(scenario())
+    for a, b in pairs:
+        for user_id in (a, b):
+            assert sum(MUTUAL in (t or "") for t in request.texts(user_id)) == 1, user_id
@@ -0,0 +1,125 @@
+"""
+The outbox delivers by priority, retries what Telegram asks it to retry, fails
+the caller's future for everything else and keeps its workers alive.
+"""
+import asyncio
+import datetime as dt
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import outbox as outbox_module
+import ratelimit
+from outbox import BULK, INTERACTIVE, NOTIFICATION, Outbox
+
+
+class FakeBot:
+    """
+    Bot stand-in: send_message records (chat_id, text) and raises the next
+    scripted outcome for that chat, if any.
+    """
+
+    def __init__(self, script=None):
+        self.script = {chat_id: list(outcomes) for chat_id, outcomes in (script or {}).items()}
+        self.sent = []
+        self.attempts = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        self.attempts.append(chat_id)
+        outcomes = self.script.get(chat_id)
+        if outcomes:
+            raise outcomes.pop(0)
+        self.sent.append((chat_id, text))
+        return f"message {len(self.sent)}"
+
+
+@pytest.fixture(autouse=True)
+def fast_outbox(monkeypatch):
+    # behaviour, not Telegram's pacing
+    monkeypatch.setattr(outbox_module, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(ratelimit, "global_bucket", ratelimit.TokenBucket(10_000))
+    monkeypatch.setattr(ratelimit, "chat_limiter", ratelimit.PerChatLimiter(interval=0))
+
+
+async def _run(bot, sends, workers=1):
+    """
+    Queue `sends` ((chat_id, text, priority) each) before any worker runs,
+    then wait for every future to settle. Returns the outbox and the settled
+    futures.
+    """
+    box = Outbox()
+    box.start(bot, workers)
+    futures = [box.send_message(chat_id, text, priority) for chat_id, text, priority in sends]
+    await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 5)
+    await box.stop()
+    return box, futures
+
+
+def test_higher_priority_lanes_go_first():
+    bot = FakeBot()
+    asyncio.run(_run(bot, [
+        (1, "bulk", BULK),
+        (2, "notification", NOTIFICATION),
+        (3, "interactive", INTERACTIVE),
+        (4, "second notification", NOTIFICATION),
+    ]))
+    assert [text for _, text in bot.sent] == ["interactive", "notification", "second notification", "bulk"]
+
+
+def test_network_errors_are_retried_until_sent():
+    bot = FakeBot({1: [NetworkError("reset"), NetworkError("reset")]})
+    box, (future,) = asyncio.run(_run(bot, [(1, "hello", NOTIFICATION)]))
+    assert future.result() == "message 1"
+    assert bot.attempts == [1, 1, 1]
+    assert box.stats == {"sent": 1, "failed": 0, "retried": 2}
+
+
+def test_network_errors_give_up_after_max_attempts():
+    bot = FakeBot({1: [NetworkError("reset")] * outbox_module.MAX_ATTEMPTS})
+    box, (future,) = asyncio.run(_run(bot, [(1, "hello", NOTIFICATION)]))
+    assert isinstance(future.exception(), NetworkError)
+    assert len(bot.attempts) == outbox_module.MAX_ATTEMPTS
+    assert box.stats["failed"] == 1
+
+
+def test_retry_after_pauses_and_retries():
+    bot = FakeBot({1: [RetryAfter(dt.timedelta(milliseconds=50))]})
+    box, (future,) = asyncio.run(_run(bot, [(1, "hello", NOTIFICATION)]))
+    assert future.result() == "message 1"
+    assert box.stats["retried"] == 1
+
+
+def test_bad_request_fails_without_retry():
+    bot = FakeBot({1: [BadRequest("chat not found")]})
+    box, futures = asyncio.run(_run(bot, [(1, "hello", NOTIFICATION), (2, "next", NOTIFICATION)]))
+    assert isinstance(futures[0].exception(), BadRequest)
+    assert futures[1].result() == "message 1"
+    assert bot.attempts == [1, 2]
+    assert box.stats == {"sent": 1, "failed": 1, "retried": 0}
+
+
+def test_unexpected_error_fails_the_send_and_the_worker_keeps_going():
+    bot = FakeBot({1: [ValueError("bug")]})
+    box, futures = asyncio.run(_run(bot, [(1, "hello", NOTIFICATION), (2, "next", NOTIFICATION)]))
+    assert isinstance(futures[0].exception(), ValueError)
+    assert futures[1].result() == "message 1"
+    assert box.stats == {"sent": 1, "failed": 1, "retried": 0}
+
+
+def test_metrics_report_depth_and_latency():
+    async def scenario():
+        box = Outbox()
+        box.start(FakeBot(), workers=1)
+        futures = [box.send_message(chat_id, "bulk", BULK) for chat_id in range(3)]
+        futures.append(box.send_message(9, "notification", NOTIFICATION))
+        queued = box.metrics()
+        await asyncio.wait_for(asyncio.gather(*futures), 5)
+        await box.stop()
+        return queued, box.metrics()
+
+    queued, drained = asyncio.run(scenario())
+    assert queued["depth"] == {"interactive": 0, "notification": 1, "bulk": 3}
+    assert drained["depth"] == {"interactive": 0, "notification": 0, "bulk": 0}
+    assert drained["sent"] == 4
+    assert 0 <= drained["latency_p50"] <= drained["latency_p99"]
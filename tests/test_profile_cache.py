@@ -0,0 +1,139 @@
+"""
+The profile cache in data/users.py never serves a profile older than the last
+write made through the repository, including writes that land while a cache
+miss is still reading the old document.
+"""
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+from data import db
+from data import users
+
+
+class FakeUsers:
+    """
+    Stand-in for db.users holding documents by user_id. find_one copies the
+    document first and can then be held at `gate`, like a read whose reply is
+    still on the wire.
+    """
+
+    def __init__(self, docs):
+        self.docs = {d["user_id"]: dict(d) for d in docs}
+        self.reads = 0
+        self.gate = None
+        self.waiting = asyncio.Event()
+
+    async def find_one(self, query):
+        self.reads += 1
+        doc = dict(self.docs[query["user_id"]]) if query["user_id"] in self.docs else None
+        if self.gate is not None:
+            self.waiting.set()
+            await self.gate.wait()
+        return doc
+
+    async def find(self, query):
+        self.reads += 1
+        return [dict(self.docs[uid]) for uid in query["user_id"]["$in"] if uid in self.docs]
+
+    def _apply(self, user_id, update):
+        doc = self.docs[user_id]
+        doc.update(update.get("$set", {}))
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+        for field, n in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + n
+        return doc
+
+    async def update_one(self, query, update):
+        self._apply(query["user_id"], update)
+
+
+@pytest.fixture
+def fake_users(monkeypatch):
+    fake = FakeUsers([{"user_id": 1, "name": "Old", "bio": "old bio", "likes_received": 0}])
+    monkeypatch.setattr(db, "users", fake)
+    monkeypatch.setattr(users, "_profiles", OrderedDict())
+    monkeypatch.setattr(users, "_reads_in_flight", {})
+    monkeypatch.setattr(users, "_raced", set())
+    return fake
+
+
+def test_profile_is_cached(fake_users):
+    async def scenario():
+        await users.get_user(1)
+        await users.get_user(1)
+
+    asyncio.run(scenario())
+    assert fake_users.reads == 1
+
+
+def test_set_fields_is_visible_to_the_next_read(fake_users):
+    async def scenario():
+        await users.get_user(1)
+        await users.set_fields(1, {"name": "New"})
+        return await users.get_user(1)
+
+    assert asyncio.run(scenario())["name"] == "New"
+
+
+def test_batched_read_sees_the_edit(fake_users):
+    async def scenario():
+        await users.get_users([1])
+        await users.set_fields(1, {"name": "New"})
+        return await users.get_users([1])
+
+    assert asyncio.run(scenario())[1]["name"] == "New"
+    assert fake_users.reads == 1
+
+
+def test_update_user_is_visible_to_the_next_read(fake_users):
+    async def scenario():
+        await users.get_user(1)
+        await users.update_user(1, {"$set": {"name": "New"}, "$unset": {"bio": ""}})
+        return await users.get_user(1)
+
+    doc = asyncio.run(scenario())
+    assert doc["name"] == "New"
+    assert "bio" not in doc
+
+
+def test_like_counter_is_visible_to_the_next_read(fake_users):
+    async def scenario():
+        await users.get_user(1)
+        await users.add_likes_received(1)
+        return await users.get_user(1)
+
+    assert asyncio.run(scenario())["likes_received"] == 1
+    assert fake_users.reads == 1
+
+
+def test_write_during_a_cache_miss_is_not_overwritten_by_the_old_read(fake_users):
+    async def scenario():
+        fake_users.gate = asyncio.Event()
+        read = asyncio.create_task(users.get_user(1))
+        await fake_users.waiting.wait()
+        # the edit lands while the miss is still carrying the old document back
+        await users.set_fields(1, {"name": "New"})
+        fake_users.gate.set()
+        fake_users.gate = None
+        await read
+        return await users.get_user(1)
+
+    assert asyncio.run(scenario())["name"] == "New"
+
+
+def test_batched_writes_are_visible_to_the_next_read(fake_users, monkeypatch):
+    async def bulk_write(ops, ordered=True):
+        for op in ops:
+            fake_users._apply(op._filter["user_id"], op._doc)
+
+    monkeypatch.setattr(fake_users, "bulk_write", bulk_write, raising=False)
+
+    async def scenario():
+        await users.get_user(1)
+        await users.set_fields_many({1: {"tg_username": "renamed"}})
+        return await users.get_user(1)
+
+    assert asyncio.run(scenario())["tg_username"] == "renamed"
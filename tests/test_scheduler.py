@@ -0,0 +1,164 @@
+"""
+The delivery scheduler hands each recipient to `deliver` once its time has
+come, earliest first and in bounded batches, and wakes up early when an
+earlier delivery is scheduled.
+"""
+import asyncio
+import datetime as dt
+
+from scheduler import DeliveryScheduler
+
+T0 = dt.datetime(2026, 1, 1, 12, 0)
+
+
+class FakeClock:
+    def __init__(self, now=T0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += dt.timedelta(seconds=seconds)
+
+
+def at(seconds):
+    return T0 + dt.timedelta(seconds=seconds)
+
+
+class Recorder:
+    """
+    `deliver` stand-in recording recipients in delivery order; recipients in
+    `fail` raise instead.
+    """
+
+    def __init__(self, fail=()):
+        self.delivered = []
+        self.fail = set(fail)
+        self.arrived = asyncio.Event()
+
+    async def __call__(self, recipient_id):
+        self.delivered.append(recipient_id)
+        self.arrived.set()
+        if recipient_id in self.fail:
+            raise RuntimeError(f"delivery to {recipient_id} failed")
+
+
+async def _wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_pop_due_returns_due_recipients_earliest_first():
+    scheduler = DeliveryScheduler(Recorder(), FakeClock())
+    scheduler.schedule(3, at(30))
+    scheduler.schedule(1, at(10))
+    scheduler.schedule(2, at(20))
+    scheduler.schedule(4, at(40))
+    assert scheduler.pop_due(at(0)) == []
+    assert scheduler.pop_due(at(30)) == [1, 2, 3]
+    assert len(scheduler) == 1
+    assert scheduler.seconds_until_next(at(30)) == 10
+
+
+def test_pop_due_is_bounded_by_batch_size():
+    scheduler = DeliveryScheduler(Recorder(), FakeClock(), batch_size=2)
+    for recipient_id in range(5):
+        scheduler.schedule(recipient_id, at(recipient_id))
+    assert scheduler.pop_due(at(10)) == [0, 1]
+    assert scheduler.pop_due(at(10)) == [2, 3]
+    assert scheduler.pop_due(at(10)) == [4]
+
+
+def test_earlier_schedule_wins():
+    scheduler = DeliveryScheduler(Recorder(), FakeClock())
+    scheduler.schedule(1, at(60))
+    scheduler.schedule(1, at(10))
+    scheduler.schedule(1, at(30))  # later than the pending time: ignored
+    assert scheduler.seconds_until_next(at(0)) == 10
+    assert scheduler.pop_due(at(10)) == [1]
+    assert scheduler.pop_due(at(60)) == []
+    assert scheduler.seconds_until_next(at(60)) is None
+
+
+def test_run_delivers_what_is_due_and_waits_for_the_rest():
+    async def scenario():
+        clock = FakeClock()
+        deliver = Recorder()
+        scheduler = DeliveryScheduler(deliver, clock)
+        scheduler.schedule(1, at(0))
+        scheduler.schedule(2, at(3600))
+        task = asyncio.create_task(scheduler.run())
+        await _wait_for(lambda: deliver.delivered)
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return deliver.delivered, len(scheduler)
+
+    assert asyncio.run(scenario()) == ([1], 1)
+
+
+def test_run_wakes_up_for_an_earlier_schedule():
+    async def scenario():
+        clock = FakeClock()
+        deliver = Recorder()
+        scheduler = DeliveryScheduler(deliver, clock)
+        scheduler.schedule(1, at(3600))
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)  # the loop is now sleeping for an hour
+        clock.advance(5)
+        scheduler.schedule(2, at(5))
+        await asyncio.wait_for(deliver.arrived.wait(), 1)
+        task.cancel()
+        return deliver.delivered
+
+    assert asyncio.run(scenario()) == [2]
+
+
+def test_run_sleeps_until_the_due_time():
+    async def scenario():
+        started = dt.datetime.utcnow()
+        deliver = Recorder()
+        scheduler = DeliveryScheduler(deliver, dt.datetime.utcnow)
+        scheduler.schedule(1, started + dt.timedelta(seconds=0.2))
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.wait_for(deliver.arrived.wait(), 2)
+        task.cancel()
+        return (dt.datetime.utcnow() - started).total_seconds()
+
+    assert 0.2 <= asyncio.run(scenario()) < 1.0
+
+
+def test_run_delivers_a_backlog_in_batches():
+    async def scenario():
+        deliver = Recorder()
+        scheduler = DeliveryScheduler(deliver, FakeClock(), batch_size=50)
+        for recipient_id in range(120):
+            scheduler.schedule(recipient_id, at(-recipient_id))
+        task = asyncio.create_task(scheduler.run())
+        await _wait_for(lambda: len(deliver.delivered) == 120)
+        task.cancel()
+        return deliver.delivered
+
+    delivered = asyncio.run(scenario())
+    assert delivered == list(range(119, -1, -1))
+
+
+def test_a_failing_delivery_does_not_stop_the_loop():
+    async def scenario():
+        clock = FakeClock()
+        deliver = Recorder(fail={1})
+        scheduler = DeliveryScheduler(deliver, clock)
+        scheduler.schedule(1, at(0))
+        scheduler.schedule(2, at(0))
+        task = asyncio.create_task(scheduler.run())
+        await _wait_for(lambda: len(deliver.delivered) == 2)
+        scheduler.schedule(3, at(0))
+        await _wait_for(lambda: len(deliver.delivered) == 3)
+        task.cancel()
+        return deliver.delivered, task
+
+    delivered, task = asyncio.run(scenario())
+    assert delivered == [1, 2, 3]
+    assert task.cancelled()
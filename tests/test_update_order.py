@@ -0,0 +1,102 @@
+"""
+Updates from one user are handled one at a time, in arrival order; updates
+from different users run concurrently, up to the processor's cap.
+"""
+import asyncio
+import random
+
+from telegram import Update
+
+import main
+from benchmark import StreamBuilder
+from conftest import BotHarness
+from update_processor import PerUserUpdateProcessor
+
+
+class Tracker:
+    """
+    Handler stand-in: each call sleeps a random few milliseconds and records
+    when it started and finished, and how many calls were running at once.
+    """
+
+    def __init__(self, seed=7):
+        self.rng = random.Random(seed)
+        self.order = {}  # user_id -> texts in handling order
+        self.running = {}  # user_id -> calls currently inside
+        self.active = 0
+        self.peak = 0
+        self.overlapped_users = False
+
+    async def handle(self, update):
+        user_id = update.effective_user.id
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.running[user_id] = self.running.get(user_id, 0) + 1
+        assert self.running[user_id] == 1, f"two updates from {user_id} ran at once"
+        if sum(1 for n in self.running.values() if n) > 1:
+            self.overlapped_users = True
+        try:
+            await asyncio.sleep(self.rng.uniform(0, 0.005))
+            self.order.setdefault(user_id, []).append(update.message.text)
+        finally:
+            self.running[user_id] -= 1
+            self.active -= 1
+
+
+def _interleaved(users, per_user):
+    build = StreamBuilder()
+    return [
+        Update.de_json(build.text(user_id, f"{user_id}:{n}"), None)
+        for n in range(per_user)
+        for user_id in users
+    ]
+
+
+async def _process(processor, tracker, updates):
+    await asyncio.gather(*(processor.process_update(update, tracker.handle(update)) for update in updates))
+
+
+def test_each_users_updates_run_in_arrival_order():
+    users = range(100, 108)
+    tracker = Tracker()
+    asyncio.run(_process(PerUserUpdateProcessor(64), tracker, _interleaved(users, 20)))
+    for user_id in users:
+        assert tracker.order[user_id] == [f"{user_id}:{n}" for n in range(20)]
+
+
+def test_different_users_overlap():
+    tracker = Tracker()
+    asyncio.run(_process(PerUserUpdateProcessor(64), tracker, _interleaved(range(100, 108), 5)))
+    assert tracker.overlapped_users
+    assert tracker.peak > 1
+
+
+def test_concurrency_cap_is_respected():
+    tracker = Tracker()
+    asyncio.run(_process(PerUserUpdateProcessor(3), tracker, _interleaved(range(100, 120), 3)))
+    assert tracker.peak == 3
+
+
+def test_lock_table_is_emptied_once_idle():
+    processor = PerUserUpdateProcessor(64)
+    asyncio.run(_process(processor, Tracker(), _interleaved(range(100, 104), 5)))
+    assert processor._locks == {}
+
+
+def test_onboarding_fed_concurrently_builds_the_full_profile():
+    async def scenario():
+        async with BotHarness() as bot:
+            # every step arrives before the previous one was handled
+            await bot.feed(*bot.onboarding(100, "female", "male", name="Abebe"))
+            return await main.user_repo.get_user(100)
+
+    user = asyncio.run(scenario())
+    assert user["step"] == "done"
+    assert user["name"] == "Abebe"
+    assert user["department"] == "Computer Science"
+    assert user["year"] == "2nd"
+    assert user["gender"] == "female"
+    assert user["age"] == 21
+    assert user["photos"] == ["photo-100"]
+    assert user["interested_in"] == "male"
+    assert user["bio"] == "Here for study buddies."
@@ -0,0 +1,62 @@
+"""
+Concurrent update processing with per-user ordering.
+
+Updates from different users are handled in parallel, up to a configurable
+cap; updates from the same user (or chat, for updates without a user) run
+one at a time, in the order they arrived. The per-user lock is taken before
+a concurrency slot, so one user flooding the bot waits in line behind their
+own updates instead of occupying every slot.
+"""
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+MAX_CONCURRENT_UPDATES = 64
+
+
+def ordering_key(update):
+    """
+    The key updates are serialised on: the sender, else the chat, else None
+    (no ordering needed).
+    """
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return ("user", user.id)
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return ("chat", chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # ordering key -> [asyncio.Lock, updates holding or waiting on it]
+
+    async def process_update(self, update, coroutine):
+        key = ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Lock waiters are woken FIFO and the application starts one task per
+            # update in arrival order, so a user's updates run in arrival order
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass